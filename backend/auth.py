@@ -1,14 +1,24 @@
 # auth.py
 
 from flask import Flask, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import DuplicateKeyError, OperationFailure
+import argparse
 import os
+import gzip
+import threading
+import hashlib
 from flask_cors import CORS
 import jwt
 import datetime
 from functools import wraps
 
+from catalog import get_bundle, get_catalog
+from ownership import MAX_BULK_CLAIM, create_ownership_index
+from password_hashing import HASH_WORKERS, HasherBusyError, PasswordHasher
+from user_cache import notify_user_changed
+from token_auth import TokenVerifier, UserNotFoundError
+
 app = Flask(__name__)
 
 # Configure CORS to allow requests from http://localhost:3000
@@ -17,20 +27,74 @@ CORS(app, origins="http://localhost:3000", supports_credentials=True)
 # Secret key for JWT
 SECRET_KEY = 'your_secret_key'  # Replace with a strong secret key and keep it secure
 
-# MongoDB connection
+# Ordinooki listing configuration
+ORDINOOKI_FIELDS = {'name', 'attributes', 'stats'}  # Meta fields clients can project
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Serving configuration, 0 workers runs the Flask development server
+AUTH_HOST = os.environ.get('AUTH_HOST', '127.0.0.1')
+AUTH_PORT = int(os.environ.get('AUTH_PORT', 5000))
+AUTH_WORKERS = int(os.environ.get('AUTH_WORKERS', 0))  # Server processes in production mode
+AUTH_THREADS = int(os.environ.get('AUTH_THREADS', 8))  # Request threads per server process
+HASHING_RETRY_AFTER = 1  # Seconds clients are told to wait when hashing is overloaded
+
+# Verified tokens are cached until they expire
+token_verifier = TokenVerifier(SECRET_KEY)
+
+# Password hashes are derived on a bounded process pool, production workers split the cores between them
+password_hasher = PasswordHasher(max_workers=int(os.environ.get('AUTH_HASH_WORKERS', HASH_WORKERS)))
+
+# MongoDB connection, opened by database() on first use in each process
 MONGODB_CONNECTION_STRING = os.environ.get('MONGODB_CONNECTION_STRING')
 if not MONGODB_CONNECTION_STRING:
     print("Please set the MONGODB_CONNECTION_STRING environment variable.")
     exit(1)
 
-try:
-    client = MongoClient(MONGODB_CONNECTION_STRING)
-    db = client['your_database_name']  # Replace with your actual database name
-    usuarios_collection = db['usuarios']  # Collection name
-    print("Connected to MongoDB.")
-except Exception as e:
-    print(f"Failed to connect to MongoDB: {e}")
-    exit(1)
+class Database:
+    def __init__(self):
+        """
+        MongoDB client, collections and ownership index of one process.
+        """
+        self.pid = os.getpid()
+        self.client = MongoClient(MONGODB_CONNECTION_STRING)
+        db = self.client['your_database_name']  # Replace with your actual database name
+        self.users = db['usuarios']  # Collection name
+        # Unique ordinooki id -> owner mapping, claims never scan other users
+        self.ownership = create_ownership_index(self.client, db)
+        self.ownership.ensure_indexes()
+        try:
+            # Registration relies on it to settle concurrent sign-ups for the same username
+            self.users.create_index([('username', ASCENDING)], unique=True)
+        except OperationFailure as e:
+            print(f"Could not create the unique username index, remove duplicate usernames first: {e}")
+
+_database = None
+_database_lock = threading.Lock()
+
+def database():
+    """
+    Return the Database of this process, connecting on first use. Server
+    workers connect after they are forked, a MongoClient is never shared
+    between processes.
+    """
+    global _database
+    current = _database
+    if current is not None and current.pid == os.getpid():
+        return current
+    with _database_lock:
+        if _database is None or _database.pid != os.getpid():
+            _database = Database()
+            print("Connected to MongoDB.")
+        return _database
+
+def hashing_busy():
+    response = jsonify({'error': 'Server is busy, please try again.'})
+    response.headers['Retry-After'] = str(HASHING_RETRY_AFTER)
+    return response, 503
+
+def user_exists(username):
+    return database().users.find_one({'username': username}, {'_id': 1}) is not None
 
 # Authentication middleware
 def auth_required(f):
@@ -51,15 +115,15 @@ def auth_required(f):
             return jsonify({'error': 'Token is missing!'}), 401
         
         try:
-            # Decode the token
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            current_user = usuarios_collection.find_one({'username': data['username']})
-            if not current_user:
-                return jsonify({'error': 'User not found!'}), 401
+            # Verify the token, repeated tokens are answered from the cache
+            data = token_verifier.verify(token, user_exists)
+            current_user = {'username': data['username']}
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token has expired!'}), 401
         except jwt.InvalidTokenError:
             return jsonify({'error': 'Invalid token!'}), 401
+        except UserNotFoundError:
+            return jsonify({'error': 'User not found!'}), 401
         
         # Pass user information to the route
         return f(current_user, *args, **kwargs)
@@ -76,20 +140,25 @@ def register():
     if not username or not password:
         return jsonify({'error': 'Username and password are required.'}), 400
 
-    # Check if the username already exists
-    if usuarios_collection.find_one({'username': username}):
-        return jsonify({'error': 'Username already exists'}), 400
-
-    # Hash the password
-    password_hash = generate_password_hash(password)
+    # Hash the password on the hashing pool
+    try:
+        password_hash = password_hasher.hash(password)
+    except HasherBusyError:
+        return hashing_busy()
 
-    # Insert the new user into the database
-    usuarios_collection.insert_one({
-        'username': username,
-        'password_hash': password_hash,
-        'progress': {},  # Initialize empty progress
-        'ordinookiIds': []  # Initialize empty ordinookiIds
-    })
+    # Existence check and insert in one upsert, the unique index settles concurrent registrations
+    try:
+        # The inserted document takes its username from the filter
+        result = database().users.update_one({'username': username}, {'$setOnInsert': {
+            'password_hash': password_hash,
+            'progress': {},  # Initialize empty progress
+            'ordinookiIds': []  # Initialize empty ordinookiIds
+        }}, upsert=True)
+        created = result.upserted_id is not None
+    except DuplicateKeyError:
+        created = False
+    if not created:
+        return jsonify({'error': 'Username already exists'}), 400
 
     return jsonify({'message': 'User registered successfully'}), 201
 
@@ -103,9 +172,14 @@ def login():
     if not username or not password:
         return jsonify({'error': 'Username and password are required.'}), 400
 
-    user = usuarios_collection.find_one({'username': username})
+    user = database().users.find_one({'username': username}, {'password_hash': 1})
+
+    try:
+        valid = bool(user) and password_hasher.check(user['password_hash'], password)
+    except HasherBusyError:
+        return hashing_busy()
 
-    if user and check_password_hash(user['password_hash'], password):
+    if valid:
         # Generate a JWT token
         token = jwt.encode({
             'username': username,
@@ -124,33 +198,25 @@ def update_ordinookis(current_user):
     ordinookiIds = data.get('ordinookiIds', [])
     selectedId = data.get('selectedId')  # New field
 
-    if not isinstance(ordinookiIds, list):
-        return jsonify({'error': 'ordinookiIds must be a list'}), 400
+    if not isinstance(ordinookiIds, list) or not all(isinstance(id, str) for id in ordinookiIds):
+        return jsonify({'error': 'ordinookiIds must be a list of strings'}), 400
 
     if selectedId and selectedId not in ordinookiIds:
         return jsonify({'error': 'selectedId must be one of the ordinookiIds'}), 400
 
+    if len(ordinookiIds) > MAX_BULK_CLAIM:
+        return jsonify({'error': f'At most {MAX_BULK_CLAIM} Ordinookis can be claimed at once'}), 400
+
     username = current_user['username']
 
     try:
-        update_fields = {'ordinookiIds': {'$addToSet': {'$each': ordinookiIds}}}
-        if selectedId:
-            update_fields['selected_ordinooki'] = selectedId
-
-        usuarios_collection.update_one(
-            {'username': username},
-            {
-                '$addToSet': {'ordinookiIds': {'$each': ordinookiIds}},
-                '$set': {'selected_ordinooki': selectedId} if selectedId else {}
-            }
-        )
-
-        # Optionally, remove selectedId from other users to ensure uniqueness
-        if selectedId:
-            usuarios_collection.update_many(
-                {'username': {'$ne': username}},
-                {'$pull': {'ordinookiIds': selectedId}}
-            )
+        # Every listed Ordinooki is taken from its previous owner, so the index covers all owned ids
+        previous_owners = database().ownership.claim(username, ordinookiIds, selected_id=selectedId)
+
+        # Let the websocket server drop its cached copies of the changed users
+        notify_user_changed(username)
+        for owner in previous_owners:
+            notify_user_changed(owner)
 
         return jsonify({'message': 'Ordinookis updated successfully'}), 200
 
@@ -159,39 +225,152 @@ def update_ordinookis(current_user):
         return jsonify({'error': 'Failed to update Ordinookis'}), 500
 
 
+# Token cache counters
+@app.route('/api/auth/cache-stats', methods=['GET'])
+def auth_cache_stats():
+    return jsonify(token_verifier.stats), 200
+
+# Catalog bundle manifest, tells clients which bundle version is current
+@app.route('/api/catalog', methods=['GET'])
+def catalog_manifest():
+    bundle = get_bundle()
+    response = jsonify({
+        'version': bundle.version,
+        'url': f'/api/catalog/{bundle.version}',
+        'size': len(bundle.data)
+    })
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Catalog bundle, every Ordinooki as gzipped JSON. Its URL names its content, so it never changes
+@app.route('/api/catalog/<version>', methods=['GET'])
+def catalog_bundle(version):
+    bundle = get_bundle()
+    if version != bundle.version:
+        return jsonify({'error': 'Unknown catalog version', 'version': bundle.version}), 404
+
+    if request.if_none_match.contains(bundle.version):
+        response = app.response_class(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = app.response_class(bundle.data, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = app.response_class(gzip.decompress(bundle.data), mimetype='application/json')
+
+    response.set_etag(bundle.version)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 # Fetch Ordinookis endpoint
 @app.route('/api/ordinookis', methods=['GET'])
 @auth_required
 def get_ordinookis(current_user):
-    ordinookiIds = current_user.get('ordinookiIds', [])
-    
-    if not ordinookiIds:
-        return jsonify({'ordinookis': []}), 200
-
-    # Fetch Ordinooki details based on IDs
-    # Assuming you have a collection or data source for Ordinookis
-    # For this example, we'll mock the data
-    # Replace this with actual database queries as needed
-    ordinookis = []
-    for oid in ordinookiIds:
-        # Mock Ordinooki data
-        # Replace with actual data fetching logic
-        ordinooki = {
-            'id': oid,
-            'meta': {
-                'name': f'Ordinooki {oid}',
-                'stats': {
-                    'HP': 100,
-                    'Attack': 20,
-                    'Defense': 15,
-                    'Speed': 10,
-                    'Critical Chance': 5
-                }
-            }
-        }
-        ordinookis.append(ordinooki)
-    
-    return jsonify({'ordinookis': ordinookis}), 200
+    # Only the owned ids are needed, auth_required does not load the full document
+    user = database().users.find_one({'username': current_user['username']}, {'ordinookiIds': 1}) or {}
+    ordinookiIds = user.get('ordinookiIds', [])
+
+    # Optional projection, e.g. ?fields=stats
+    fields = None
+    if request.args.get('fields'):
+        fields = set(request.args['fields'].split(','))
+        if not fields <= ORDINOOKI_FIELDS:
+            return jsonify({'error': f"fields must be a subset of {', '.join(sorted(ORDINOOKI_FIELDS))}"}), 400
+
+    # Pagination over the owned ids
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    page_ids = ordinookiIds[offset:offset + limit]
+
+    # The response only depends on the catalog version, the page of ids and the projection,
+    # so the ETag is known before building anything
+    catalog = get_catalog()
+    etag = hashlib.sha256('|'.join([
+        catalog.source_hash,
+        ','.join(sorted(fields)) if fields else '*',
+        str(offset),
+        str(limit),
+        str(len(ordinookiIds)),
+        *page_ids
+    ]).encode('utf-8')).hexdigest()[:32]
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        indexes, missing = catalog.resolve(page_ids)
+        next_offset = offset + limit if offset + limit < len(ordinookiIds) else None
+        response = jsonify({
+            'ordinookis': [catalog.project(index, fields) for index in indexes],
+            'missing': missing,
+            'total': len(ordinookiIds),
+            'offset': offset,
+            'limit': limit,
+            'nextOffset': next_offset
+        })
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def serve(host=AUTH_HOST, port=AUTH_PORT, workers=AUTH_WORKERS, threads=AUTH_THREADS):
+    """
+    Serve the API with gunicorn: `workers` processes of `threads` request threads each.
+
+    A request waiting for its password hash only blocks its own thread, the
+    other threads keep answering. Each worker imports this module again after
+    the fork and connects to MongoDB from post_fork, so MongoDB clients and
+    hashing pools are never shared.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("gunicorn is not installed, falling back to the threaded development server.")
+        app.run(host=host, port=port, threaded=True)
+        return
+
+    # Hashing processes are split between the workers instead of each taking every core
+    os.environ.setdefault('AUTH_HASH_WORKERS', str(max(1, (os.cpu_count() or 1) // workers)))
+
+    class AuthApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('post_fork', connect_worker)
+
+        def load(self):
+            from auth import app as worker_app
+            return worker_app
+
+    AuthApplication().run()
+
+def connect_worker(server, worker):
+    # Connect the module the worker serves from, which is not this one when auth.py runs as a script
+    from auth import database as worker_database
+    worker_database()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the auth API.")
+    parser.add_argument('--workers', type=int, default=AUTH_WORKERS,
+                        help="server processes, 0 runs the Flask development server")
+    parser.add_argument('--threads', type=int, default=AUTH_THREADS, help="request threads per server process")
+    parser.add_argument('--host', default=AUTH_HOST, help="listen address")
+    parser.add_argument('--port', type=int, default=AUTH_PORT, help="listen port")
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        serve(args.host, args.port, args.workers, args.threads)
+    else:
+        try:
+            database()
+        except Exception as e:
+            print(f"Failed to connect to MongoDB: {e}")
+            exit(1)
+        app.run(host=args.host, port=args.port, threaded=True)
 
 if __name__ == '__main__':
-    app.run(port=5000)
+    main()
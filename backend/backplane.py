@@ -0,0 +1,362 @@
+# backplane.py
+
+import abc
+import argparse
+import asyncio
+import json
+import os
+from urllib.parse import urlparse
+
+from logger import log
+
+# Backplane configuration
+MEMORY_BACKPLANE_URL = 'memory://'
+BACKPLANE_URL = os.environ.get('BACKPLANE_URL', MEMORY_BACKPLANE_URL)  # memory://, redis://host:port or unix:///path
+BACKPLANE_RECONNECT_DELAY = 1.0  # Seconds between reconnect attempts
+
+
+class Backplane(abc.ABC):
+    """
+    Pub/sub channel shared by every websocket_server node.
+
+    Payloads are JSON-serializable dicts. Subscribers also receive what they
+    publish themselves, receivers filter on the sender's node id.
+    """
+
+    def __init__(self):
+        self.handler = None
+        self.channels = set()
+        self.published = 0
+        self.received = 0
+
+    async def start(self, handler):
+        """
+        :param handler: Callable taking (channel, payload) for every received message
+        """
+        self.handler = handler
+
+    async def subscribe(self, *channels):
+        self.channels.update(channels)
+
+    @abc.abstractmethod
+    async def publish(self, channel, payload):
+        """
+        Send `payload` to every subscriber of `channel`.
+        """
+
+    async def close(self):
+        pass
+
+    def _dispatch(self, channel, data):
+        self.received += 1
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            log.warning("Dropped malformed backplane message on %s", channel)
+            return
+        try:
+            self.handler(channel, payload)
+        except Exception as e:
+            log.error("Backplane handler failed on %s: %s", channel, e)
+
+
+class InMemoryHub:
+    def __init__(self):
+        """
+        Message router for backplanes living in the same process.
+        """
+        self.subscribers = {}  # channel -> set of InMemoryBackplane
+
+    def publish(self, channel, payload, sender=None):
+        subscribers = self.subscribers.get(channel, ())
+        if not subscribers or (len(subscribers) == 1 and sender in subscribers):
+            # A lone node only hears itself, skip the serialization
+            return len(subscribers)
+        data = json.dumps(payload)
+        loop = asyncio.get_running_loop()
+        for backplane in subscribers:
+            # Delivered on the next loop iteration, like a message from the network
+            loop.call_soon(backplane._dispatch, channel, data)
+        return len(subscribers)
+
+
+_default_hub = InMemoryHub()
+
+
+class InMemoryBackplane(Backplane):
+    def __init__(self, hub=None):
+        """
+        Backplane for nodes inside one process. This is the default, a single
+        node then only talks to itself and nothing is serialized.
+
+        :param hub: InMemoryHub shared by the nodes, the process wide one if None
+        """
+        super().__init__()
+        self.hub = hub or _default_hub
+
+    async def subscribe(self, *channels):
+        await super().subscribe(*channels)
+        for channel in channels:
+            self.hub.subscribers.setdefault(channel, set()).add(self)
+
+    async def publish(self, channel, payload):
+        self.published += 1
+        return self.hub.publish(channel, payload, self)
+
+    async def close(self):
+        for channel in self.channels:
+            self.hub.subscribers.get(channel, set()).discard(self)
+
+
+# A subset of the Redis serialization protocol (RESP2), enough for pub/sub
+
+class RespError(Exception):
+    pass
+
+
+def encode_command(*args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode('utf-8')
+        elif isinstance(arg, int):
+            arg = str(arg).encode('ascii')
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+def encode_reply(value):
+    if isinstance(value, RespError):
+        return b'-%s\r\n' % str(value).encode('utf-8')
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(encode_reply(item) for item in value)
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+async def read_value(reader):
+    """
+    Read one RESP value. Errors are returned as RespError instances, not raised.
+    """
+    line = await reader.readuntil(b'\r\n')
+    kind, body = line[:1], line[1:-2]
+    if kind == b'+':
+        return body.decode('utf-8')
+    if kind == b'-':
+        return RespError(body.decode('utf-8'))
+    if kind == b':':
+        return int(body)
+    if kind == b'$':
+        size = int(body)
+        if size < 0:
+            return None
+        return (await reader.readexactly(size + 2))[:-2]
+    if kind == b'*':
+        size = int(body)
+        if size < 0:
+            return None
+        return [await read_value(reader) for _ in range(size)]
+    raise RespError(f"Unexpected RESP type {kind!r}")
+
+
+async def open_connection(url):
+    parsed = urlparse(url)
+    if parsed.scheme == 'unix':
+        return await asyncio.open_unix_connection(parsed.path)
+    return await asyncio.open_connection(parsed.hostname or 'localhost', parsed.port or 6379)
+
+
+class RespBackplane(Backplane):
+    def __init__(self, url):
+        """
+        Backplane over Redis pub/sub, or over the local broker in this module
+        which speaks the same protocol on a TCP or Unix socket.
+
+        One connection publishes, a second one holds the subscriptions. Both
+        reconnect on their own and subscriptions are restored.
+
+        :param url: redis://host:port or unix:///path/to/socket
+        """
+        super().__init__()
+        self.url = url
+        self.publisher = None
+        self.publish_lock = asyncio.Lock()
+        self.subscriber = None
+        self.subscriber_task = None
+        self.ready = asyncio.Event()
+
+    async def start(self, handler):
+        await super().start(handler)
+        self.subscriber_task = asyncio.ensure_future(self._subscriber_loop())
+        await self.ready.wait()
+
+    async def subscribe(self, *channels):
+        await super().subscribe(*channels)
+        if self.subscriber:
+            self.subscriber[1].write(encode_command('SUBSCRIBE', *channels))
+            await self.subscriber[1].drain()
+
+    async def _subscriber_loop(self):
+        while True:
+            try:
+                reader, writer = await open_connection(self.url)
+                self.subscriber = (reader, writer)
+                if self.channels:
+                    writer.write(encode_command('SUBSCRIBE', *self.channels))
+                    await writer.drain()
+                self.ready.set()
+                while True:
+                    value = await read_value(reader)
+                    if isinstance(value, list) and value and value[0] == b'message':
+                        try:
+                            self._dispatch(value[1].decode('utf-8'), value[2])
+                        except (ValueError, IndexError, AttributeError) as e:
+                            # One bad message is skipped, the stream is still in sync
+                            log.warning("Dropped malformed backplane message: %s", e)
+                    elif isinstance(value, RespError):
+                        log.warning("Backplane error: %s", value)
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.IncompleteReadError, RespError, ValueError) as e:
+                # A value that cannot be parsed leaves the stream out of sync, reconnect
+                log.warning("Backplane subscriber connection lost: %s", e)
+            finally:
+                if self.subscriber:
+                    self.subscriber[1].close()
+                    self.subscriber = None
+            await asyncio.sleep(BACKPLANE_RECONNECT_DELAY)
+
+    async def publish(self, channel, payload):
+        data = encode_command('PUBLISH', channel, json.dumps(payload))
+        async with self.publish_lock:
+            for attempt in range(2):
+                try:
+                    if self.publisher is None:
+                        self.publisher = await open_connection(self.url)
+                    reader, writer = self.publisher
+                    writer.write(data)
+                    reply = await read_value(reader)
+                    if isinstance(reply, RespError):
+                        raise reply
+                    self.published += 1
+                    return reply
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    # Reconnect once, the broker may have restarted
+                    if self.publisher:
+                        self.publisher[1].close()
+                    self.publisher = None
+                    if attempt:
+                        log.warning("Backplane publish failed: %s", e)
+        return 0
+
+    async def close(self):
+        if self.subscriber_task:
+            self.subscriber_task.cancel()
+        if self.publisher:
+            self.publisher[1].close()
+            self.publisher = None
+
+
+class LocalBroker:
+    def __init__(self):
+        """
+        Minimal pub/sub broker speaking RESP (PING, SUBSCRIBE, UNSUBSCRIBE,
+        PUBLISH), so a few nodes on one host can share a backplane without
+        running Redis.
+        """
+        self.subscribers = {}  # channel -> set of StreamWriter
+        self.clients = 0
+
+    async def handle(self, reader, writer):
+        self.clients += 1
+        subscribed = set()
+        try:
+            while True:
+                command = await read_value(reader)
+                if not isinstance(command, list) or not command:
+                    writer.write(encode_reply(RespError("ERR expected a command array")))
+                    continue
+                name = command[0].decode('utf-8').upper()
+                args = [arg.decode('utf-8') for arg in command[1:]]
+
+                if name == 'PUBLISH' and len(args) == 2:
+                    frame = encode_reply([b'message', args[0], command[2]])
+                    receivers = self.subscribers.get(args[0], ())
+                    for subscriber in receivers:
+                        subscriber.write(frame)
+                    writer.write(encode_reply(len(receivers)))
+                elif name == 'SUBSCRIBE' and args:
+                    for channel in args:
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(encode_reply([b'subscribe', channel, len(subscribed)]))
+                elif name == 'UNSUBSCRIBE':
+                    for channel in args or list(subscribed):
+                        self.subscribers.get(channel, set()).discard(writer)
+                        subscribed.discard(channel)
+                        writer.write(encode_reply([b'unsubscribe', channel, len(subscribed)]))
+                elif name == 'PING':
+                    writer.write(b'+PONG\r\n')
+                else:
+                    writer.write(encode_reply(RespError(f"ERR unknown command '{name}'")))
+                await writer.drain()
+        except (OSError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Client went away or the broker is shutting down
+            pass
+        finally:
+            self.clients -= 1
+            for channel in subscribed:
+                members = self.subscribers.get(channel)
+                if members is not None:
+                    members.discard(writer)
+                    if not members:
+                        del self.subscribers[channel]
+            writer.close()
+
+    async def serve(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme == 'unix':
+            if os.path.exists(parsed.path):
+                os.unlink(parsed.path)
+            return await asyncio.start_unix_server(self.handle, parsed.path)
+        return await asyncio.start_server(self.handle, parsed.hostname or 'localhost', parsed.port or 6379)
+
+
+def create_backplane(url=None):
+    """
+    Return the backplane for a memory://, redis:// or unix:// URL, BACKPLANE_URL if None.
+    """
+    if url is None:
+        url = BACKPLANE_URL
+    if not url or url == MEMORY_BACKPLANE_URL:
+        return InMemoryBackplane()
+    if urlparse(url).scheme in ('redis', 'unix'):
+        return RespBackplane(url)
+    raise ValueError(f"Unsupported backplane URL: {url}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local pub/sub broker for websocket_server nodes.")
+    parser.add_argument('--listen', default='unix:///tmp/ordinooki-backplane.sock',
+                        help="redis://host:port or unix:///path to listen on")
+    args = parser.parse_args()
+
+    async def run():
+        server = await LocalBroker().serve(args.listen)
+        print(f"Backplane broker listening on {args.listen}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,35 @@ import asyncio
 import json
 import random
 
+from battle_replay import DRAW, BattleLog
+
+# Battle rules, shared with the headless simulators
+CRITICAL_MULTIPLIER = 1.5  # Damage multiplier of a critical hit
+MAX_TURNS = 2000           # Attacks before a fight nobody can finish is called a draw
+
+def base_damage(attack, defense):
+    return max(attack - defense, 0)
+
+def critical_damage(damage):
+    return max(int(damage * CRITICAL_MULTIPLIER), 0)
+
+def attacks_first(speed1, speed2, rng=random):
+    """
+    Return True if the first fighter attacks first. Ties are decided by a coin flip.
+    """
+    if speed1 != speed2:
+        return speed1 > speed2
+    return rng.random() < 0.5
+
 class BattleSession:
-    def __init__(self, player1, player2, server):
+    def __init__(self, player1, player2, server, seed=None):
         """
         Initialize a battle session between two players.
 
         :param player1: Dictionary containing player1's data (username, ordinooki)
         :param player2: Dictionary containing player2's data (username, ordinooki)
         :param server: Reference to the main server to send messages
+        :param seed: Seed of the battle's random generator, random if None
         """
         self.player1 = {
             "username": player1['username'],
@@ -24,63 +45,120 @@ class BattleSession:
             "health": player2['ordinooki']['meta']['stats']['HP']
         }
         self.server = server
-        self.battle_log = []
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.log = BattleLog(
+            self.seed,
+            (self.player1['username'], self.player2['username']),
+            (self.player1['ordinooki']['id'], self.player2['ordinooki']['id'])
+        )
         self.is_active = True
         self.lock = asyncio.Lock()
+        self.attacker = None
+        self.defender = None
+
+    @property
+    def battle_log(self):
+        # Messages are rendered from the compact log on demand
+        return self.log.render()
+
+    @property
+    def turns(self):
+        return len(self.log)
+
+    @property
+    def winner(self):
+        return self.log.winner
+
+    def index_of(self, player):
+        return 0 if player is self.player1 else 1
 
     def calculate_damage(self, attacker, defender):
-        base_damage = attacker['ordinooki']['meta']['stats']['Attack'] - defender['ordinooki']['meta']['stats']['Defense']
-        base_damage = max(base_damage, 0)
+        damage = base_damage(attacker['ordinooki']['meta']['stats']['Attack'], defender['ordinooki']['meta']['stats']['Defense'])
         critical_chance = attacker['ordinooki']['meta']['stats'].get('Critical Chance', 0)
-        critical_hit = 1.5 if random.random() < critical_chance else 1
-        damage = base_damage * critical_hit
-        damage = max(int(damage), 0)
-        return damage, critical_hit > 1
+        is_critical = self.rng.random() < critical_chance
+        if is_critical:
+            damage = critical_damage(damage)
+        return damage, is_critical
 
     def determine_turn_order(self):
         speed1 = self.player1['ordinooki']['meta']['stats']['Speed']
         speed2 = self.player2['ordinooki']['meta']['stats']['Speed']
-        if speed1 > speed2:
+        if attacks_first(speed1, speed2, self.rng):
             return self.player1, self.player2
-        elif speed2 > speed1:
+        else:
             return self.player2, self.player1
+
+    def begin(self):
+        """
+        Decide who opens the fight.
+        """
+        self.attacker, self.defender = self.determine_turn_order()
+        self.log.first = self.index_of(self.attacker)
+
+    def play_turn(self):
+        """
+        Play a single attack of the current attacker and record it in the log.
+
+        :return: True once the fight is over
+        """
+        attacker, defender = self.attacker, self.defender
+        damage, is_critical = self.calculate_damage(attacker, defender)
+        defender['health'] -= damage
+        self.log.record(self.index_of(attacker), damage, is_critical, self.player1['health'], self.player2['health'])
+
+        # Check for battle end
+        if defender['health'] <= 0:
+            self.is_active = False
+            if attacker['health'] > 0:
+                self.log.finish(self.index_of(attacker))
+            else:
+                self.log.finish(DRAW)
+        elif self.turns >= MAX_TURNS:
+            # Neither side can finish the other off
+            self.is_active = False
+            self.log.finish(DRAW)
         else:
-            return (self.player1, self.player2) if random.random() < 0.5 else (self.player2, self.player1)
+            # Swap roles for next turn
+            self.attacker, self.defender = defender, attacker
+        return not self.is_active
 
     async def start_battle(self):
-        attacker, defender = self.determine_turn_order()
-        start_msg = f"{attacker['username']} starts the battle!"
-        self.battle_log.append(start_msg)
-        await self.server.broadcast_battle_update(self.player1['username'], self.player2['username'], start_msg, self.player1['health'], self.player2['health'])
+        self.begin()
+        await self.server.broadcast_battle_update(self.player1['username'], self.player2['username'], self.log.start_message(), self.player1['health'], self.player2['health'])
 
         while self.is_active:
-            damage, is_critical = self.calculate_damage(attacker, defender)
-            attack_msg = f"{attacker['username']} attacks {defender['username']} for {damage} damage{' (Critical Hit!)' if is_critical else ''}."
-            self.battle_log.append(attack_msg)
-            defender['health'] -= damage
+            finished = self.play_turn()
 
             # Broadcast the attack
             await self.server.broadcast_battle_update(
                 self.player1['username'],
                 self.player2['username'],
-                attack_msg,
+                self.log.turn_message(self.turns - 1),
                 self.player1['health'],
                 self.player2['health']
             )
 
-            # Check for battle end
-            if defender['health'] <= 0:
-                self.is_active = False
-                if attacker['health'] > 0 and defender['health'] <= 0:
-                    result_msg = f"{attacker['username']} Wins!"
-                elif defender['health'] <= 0 and attacker['health'] <= 0:
-                    result_msg = "It's a Draw!"
-                else:
-                    result_msg = f"{defender['username']} Wins!"
-                self.battle_log.append(result_msg)
-                await self.server.broadcast_battle_result(self.player1['username'], self.player2['username'], result_msg)
+            if finished:
+                await self.server.broadcast_battle_result(self.player1['username'], self.player2['username'], self.log.result_message())
                 break
 
-            # Swap roles for next turn
-            attacker, defender = defender, attacker
             await asyncio.sleep(1)  # Simulate time between turns
+
+def replay(log, ordinooki1, ordinooki2):
+    """
+    Play a logged battle again from its seed.
+
+    :return: BattleLog of the replayed fight, identical to `log` for the same Ordinookis
+    """
+    session = BattleSession(
+        {'username': log.usernames[0], 'ordinooki': ordinooki1},
+        {'username': log.usernames[1], 'ordinooki': ordinooki2},
+        None,
+        log.seed
+    )
+    session.log.battle_id = log.battle_id
+    session.begin()
+    while session.is_active:
+        session.play_turn()
+    return session.log
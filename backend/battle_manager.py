@@ -0,0 +1,291 @@
+# battle_manager.py
+
+import asyncio
+import itertools
+import os
+from collections import OrderedDict
+
+from battle_logic import BattleSession
+from battle_replay import DRAW, BattleLogWriter
+from logger import log
+
+# Battle scheduling configuration
+BATTLE_TURN_INTERVAL = float(os.environ.get('BATTLE_TURN_INTERVAL', 1.0))  # Seconds between attacks
+BATTLE_START_DELAY = float(os.environ.get('BATTLE_START_DELAY', 1.0))      # Seconds before the first attack
+TIMER_TICK = 0.1    # Resolution of the timer wheel in seconds
+TIMER_SLOTS = 256   # Slots in the timer wheel, delays beyond one rotation wrap around
+RECENT_BATTLE_LOGS = 256  # Finished battle logs kept in memory for battle_log requests
+
+
+class TimerWheel:
+    def __init__(self, tick=TIMER_TICK, slots=TIMER_SLOTS):
+        """
+        Hashed timer wheel, scheduling and expiring timers in O(1).
+
+        :param tick: Seconds one advance() represents
+        :param slots: Number of slots in the wheel
+        """
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.position = 0
+
+    def schedule(self, delay, item):
+        """
+        Make `item` due after `delay` seconds (rounded up to whole ticks).
+        """
+        ticks = max(1, int(-(-delay // self.tick)))
+        rounds = (ticks - 1) // len(self.slots)
+        self.slots[(self.position + ticks) % len(self.slots)].append([rounds, item])
+
+    def advance(self):
+        """
+        Move the wheel one tick forward and return the items that became due.
+        """
+        self.position = (self.position + 1) % len(self.slots)
+        slot = self.slots[self.position]
+        if not slot:
+            return []
+        due = []
+        waiting = []
+        for timer in slot:
+            if timer[0] == 0:
+                due.append(timer[1])
+            else:
+                timer[0] -= 1
+                waiting.append(timer)
+        self.slots[self.position] = waiting
+        return due
+
+
+class BattleManager:
+    def __init__(self, broadcaster, username_to_client, turn_interval=BATTLE_TURN_INTERVAL,
+                 start_delay=BATTLE_START_DELAY, log_writer=None, router=None):
+        """
+        Owns every live BattleSession of the process.
+
+        All fights share one timer wheel driven by a single task instead of a
+        sleeping coroutine per fight. Updates produced during a tick are sent
+        to both participants as one frame per battle. Finished battles go to
+        the log writer, only the most recent ones stay in memory.
+
+        :param broadcaster: Broadcaster used to reach the participants
+        :param username_to_client: username -> websocket mapping of connected clients
+        :param turn_interval: Seconds between two attacks of a fight
+        :param start_delay: Seconds between fight_start and the first attack
+        :param log_writer: BattleLogWriter finished battles are appended to
+        :param router: Optional ClusterNode reaching participants connected to other nodes,
+            and told about starts and ends so no node starts a second fight for a player
+        """
+        self.broadcaster = broadcaster
+        self.username_to_client = username_to_client
+        self.turn_interval = turn_interval
+        self.start_delay = start_delay
+        self.wheel = TimerWheel()
+        self.sessions = {}          # battle id -> BattleSession
+        self.active_by_player = {}  # username -> battle id
+        self.pending_events = {}    # battle id -> (usernames, events to send on the next flush)
+        self.battle_ids = itertools.count(1)
+        self.log_writer = log_writer or BattleLogWriter()
+        self.router = router
+        self.recent_logs = OrderedDict()  # battle id -> BattleLog of a finished battle
+        self.on_finish = []               # callables(BattleLog) run when a battle ends
+
+    def is_busy(self, username):
+        if username in self.active_by_player:
+            return True
+        return self.router is not None and self.router.in_battle(username)
+
+    def start(self, player1, player2):
+        """
+        Start a fight between two players and return its battle id, None if
+        one of them is already fighting.
+
+        :param player1: Dictionary with the first player's username and ordinooki
+        :param player2: Dictionary with the second player's username and ordinooki
+        """
+        if self.is_busy(player1['username']) or self.is_busy(player2['username']):
+            return None
+        battle_id = next(self.battle_ids)
+        session = BattleSession(player1, player2, self)
+        session.battle_id = battle_id
+        session.log.battle_id = battle_id
+        self.sessions[battle_id] = session
+        self.active_by_player[player1['username']] = battle_id
+        self.active_by_player[player2['username']] = battle_id
+
+        session.begin()
+        if self.router is not None:
+            self.router.battle_started((player1['username'], player2['username']))
+        self._events(session).append({
+            "event": "start",
+            "first": session.log.first,
+            "player1Health": session.player1['health'],
+            "player2Health": session.player2['health']
+        })
+        self.wheel.schedule(self.start_delay, battle_id)
+        return battle_id
+
+    def forfeit(self, username):
+        """
+        End the fight of a player that left, the opponent wins.
+        """
+        battle_id = self.active_by_player.get(username)
+        if battle_id is None:
+            return
+        session = self.sessions[battle_id]
+        session.is_active = False
+        session.log.finish(1 if session.player1['username'] == username else 0, forfeit=True)
+        self._queue_result(session)
+        self._finish(session)
+
+    def _finish(self, session):
+        if self.sessions.pop(session.battle_id, None) is None:
+            return
+        self._release(session.battle_id, (session.player1['username'], session.player2['username']))
+        self.log_writer.add(session.log)
+        for callback in self.on_finish:
+            try:
+                callback(session.log)
+            except Exception as e:
+                log.error("Battle %s finish callback failed: %s", session.battle_id, e)
+        self.recent_logs[session.battle_id] = session.log
+        while len(self.recent_logs) > RECENT_BATTLE_LOGS:
+            self.recent_logs.popitem(last=False)
+
+    def _abort(self, battle_id):
+        # A fight that failed is called a draw, so its players are free to fight again
+        session = self.sessions.get(battle_id)
+        try:
+            if session is not None:
+                session.is_active = False
+                session.log.finish(DRAW)
+                self._queue_result(session)
+                self._finish(session)
+        finally:
+            self._release(battle_id, list(self.active_by_player))
+            self.sessions.pop(battle_id, None)
+
+    def _release(self, battle_id, usernames):
+        usernames = [name for name in usernames if self.active_by_player.get(name) == battle_id]
+        for username in usernames:
+            del self.active_by_player[username]
+        if usernames and self.router is not None:
+            self.router.battle_finished(usernames)
+
+    def get_log(self, battle_id):
+        """
+        Return the BattleLog of a live or recently finished battle, None if unknown.
+        """
+        session = self.sessions.get(battle_id)
+        if session is not None:
+            return session.log
+        return self.recent_logs.get(battle_id)
+
+    def _events(self, session):
+        pending = self.pending_events.get(session.battle_id)
+        if pending is None:
+            pending = ((session.player1['username'], session.player2['username']), [])
+            self.pending_events[session.battle_id] = pending
+        return pending[1]
+
+    def _queue_attack(self, session):
+        # Clients get the raw record, messages are rendered on request (battle_log)
+        attacker, critical, damage, health1, health2 = session.log.turn(len(session.log) - 1)
+        self._events(session).append({
+            "event": "attack",
+            "attacker": attacker,
+            "damage": damage,
+            "critical": bool(critical),
+            "player1Health": health1,
+            "player2Health": health2
+        })
+
+    def _queue_result(self, session):
+        log = session.log
+        self._events(session).append({
+            "event": "result",
+            "winner": log.winner,
+            "outcome": "draw" if log.outcome == DRAW else "forfeit" if log.forfeit else "win"
+        })
+
+    # BattleSession's server interface, for sessions driven by start_battle()
+    async def broadcast_battle_update(self, username1, username2, message, health1, health2):
+        battle_id = self.active_by_player.get(username1)
+        if battle_id is not None and len(self.sessions[battle_id].log):
+            self._queue_attack(self.sessions[battle_id])
+
+    async def broadcast_battle_result(self, username1, username2, message):
+        battle_id = self.active_by_player.get(username1)
+        if battle_id is not None:
+            session = self.sessions[battle_id]
+            self._queue_result(session)
+            self._finish(session)
+
+    def _play(self, battle_id):
+        session = self.sessions.get(battle_id)
+        if session is None or not session.is_active:
+            return
+        finished = session.play_turn()
+        self._queue_attack(session)
+        if finished:
+            self._queue_result(session)
+            self._finish(session)
+        else:
+            self.wheel.schedule(self.turn_interval, battle_id)
+
+    def flush(self):
+        """
+        Send every battle's queued events as one frame to both participants.
+        """
+        pending, self.pending_events = self.pending_events, {}
+        for battle_id, (players, events) in pending.items():
+            message = {
+                "type": "battle_update",
+                "battleId": battle_id,
+                "player1": players[0],
+                "player2": players[1],
+                "events": events
+            }
+            try:
+                if self.router is not None:
+                    self.router.send_many(players, message)
+                    continue
+                clients = [self.username_to_client[name] for name in players if name in self.username_to_client]
+                self.broadcaster.send_many(clients, message)
+            except Exception as e:
+                # The other battles still get their frames
+                log.error("Battle %s update failed: %s", battle_id, e)
+
+    def stats(self):
+        return {
+            "active_battles": len(self.sessions),
+            "players_in_battle": len(self.active_by_player),
+            "logs_pending": len(self.log_writer.pending),
+            "logs_written": self.log_writer.written
+        }
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            for battle_id in self.wheel.advance():
+                try:
+                    self._play(battle_id)
+                except Exception as e:
+                    # One broken fight must not freeze every other fight of the node
+                    log.error("Battle %s failed, calling it a draw: %s", battle_id, e)
+                    try:
+                        self._abort(battle_id)
+                    except Exception as e:
+                        log.error("Battle %s could not be ended: %s", battle_id, e)
+            try:
+                self.flush()
+            except Exception as e:
+                log.error("Battle update flush failed: %s", e)
+            next_tick += self.wheel.tick
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Fell behind, skip the missed ticks instead of bursting
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
@@ -0,0 +1,129 @@
+# battle_odds.py
+
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+from battle_logic import base_damage, critical_damage
+
+BattleOdds = namedtuple('BattleOdds', ['player1_win', 'player2_win', 'draw', 'expected_turns'])
+
+
+def stats_key(stats):
+    """
+    Turn an Ordinooki stats dict into the hashable tuple the solver is memoized on.
+    """
+    return (
+        stats['HP'],
+        stats['Attack'],
+        stats['Defense'],
+        stats['Speed'],
+        stats.get('Critical Chance', 0)
+    )
+
+
+@lru_cache(maxsize=65536)
+def hits_to_kill(damage, critical, chance, hp):
+    """
+    Distribution of the number of hits needed to bring `hp` to zero.
+
+    Walks the (hits, crits so far) states, keeping only the fights still
+    alive: after n hits with k crits the defender has taken
+    (n - k) * damage + k * critical.
+
+    :return: Tuple whose (n - 1)th element is P(the nth hit is the killing blow),
+             empty if the attacker can never win
+    """
+    if critical <= 0:
+        return ()
+    if chance <= 0 or critical == damage:
+        if damage <= 0:
+            return ()
+        return (0.0,) * (math.ceil(hp / damage) - 1) + (1.0,)
+    if chance >= 1:
+        return (0.0,) * (math.ceil(hp / critical) - 1) + (1.0,)
+
+    extra = critical - damage
+    pmf = []
+    alive = [1.0]  # alive[k] = P(defender still standing after n hits, k of them crits)
+    hits = 0
+    while alive:
+        hits += 1
+        stepped = [0.0] * (len(alive) + 1)
+        for crits, mass in enumerate(alive):
+            stepped[crits] += mass * (1 - chance)
+            stepped[crits + 1] += mass * chance
+        # Fewest crits that make this hit a killing blow
+        needed = max(math.ceil((hp - hits * damage) / extra), 0)
+        pmf.append(sum(stepped[needed:]))
+        alive = stepped[:needed]
+    return tuple(pmf)
+
+
+def _opener_odds(opener_hits, responder_hits):
+    """
+    Odds for a fixed turn order. The opener wins iff it needs no more hits than the responder.
+
+    :return: (opener_win, responder_win, draw, expected_turns)
+    """
+    if not opener_hits and not responder_hits:
+        # Nobody can deal damage, the fight never ends
+        return 0.0, 0.0, 1.0, math.inf
+    if not responder_hits:
+        return 1.0, 0.0, 0.0, sum((2 * n - 1) * p for n, p in enumerate(opener_hits, 1))
+    if not opener_hits:
+        return 0.0, 1.0, 0.0, sum(2 * n * p for n, p in enumerate(responder_hits, 1))
+
+    opener_win = responder_win = expected_turns = 0.0
+    responder_survives = 1.0  # P(responder needs at least n hits)
+    opener_survives = 1.0     # P(opener needs more than n hits)
+    for n in range(1, max(len(opener_hits), len(responder_hits)) + 1):
+        opener_p = opener_hits[n - 1] if n <= len(opener_hits) else 0.0
+        responder_p = responder_hits[n - 1] if n <= len(responder_hits) else 0.0
+
+        # The opener's nth attack lands before the responder's nth attack
+        opener_win += opener_p * responder_survives
+        expected_turns += opener_p * responder_survives * (2 * n - 1)
+
+        opener_survives = max(opener_survives - opener_p, 0.0)
+        responder_win += responder_p * opener_survives
+        expected_turns += responder_p * opener_survives * 2 * n
+        responder_survives = max(responder_survives - responder_p, 0.0)
+
+    return opener_win, responder_win, 0.0, expected_turns
+
+
+@lru_cache(maxsize=65536)
+def solve(stats1, stats2):
+    """
+    Exact outcome of a battle between two stat tuples (see stats_key).
+
+    :return: BattleOdds from the first fighter's point of view
+    """
+    hp1, attack1, defense1, speed1, chance1 = stats1
+    hp2, attack2, defense2, speed2, chance2 = stats2
+
+    damage1 = base_damage(attack1, defense2)
+    damage2 = base_damage(attack2, defense1)
+    hits1 = hits_to_kill(damage1, critical_damage(damage1), chance1, hp2)
+    hits2 = hits_to_kill(damage2, critical_damage(damage2), chance2, hp1)
+
+    if speed1 > speed2:
+        odds = _opener_odds(hits1, hits2)
+    elif speed2 > speed1:
+        player2_win, player1_win, draw, expected_turns = _opener_odds(hits2, hits1)
+        odds = (player1_win, player2_win, draw, expected_turns)
+    else:
+        # Speed ties are a coin flip for the opening attack
+        first = _opener_odds(hits1, hits2)
+        second = _opener_odds(hits2, hits1)
+        odds = ((first[0] + second[1]) / 2, (first[1] + second[0]) / 2,
+                (first[2] + second[2]) / 2, (first[3] + second[3]) / 2)
+    return BattleOdds(*odds)
+
+
+def predict(ordinooki1, ordinooki2):
+    """
+    Exact odds for two Ordinooki entries (in the ordinooki.json shape).
+    """
+    return solve(stats_key(ordinooki1['meta']['stats']), stats_key(ordinooki2['meta']['stats']))
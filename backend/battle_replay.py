@@ -0,0 +1,223 @@
+# battle_replay.py
+
+import argparse
+import asyncio
+import json
+import os
+import struct
+import time
+
+from logger import log as logger
+
+# Battle log configuration
+BATTLE_LOG_PATH = os.environ.get('BATTLE_LOG_PATH', os.path.join(os.path.dirname(__file__), 'battles.log'))
+BATTLE_LOG_FLUSH_INTERVAL = float(os.environ.get('BATTLE_LOG_FLUSH_INTERVAL', 5))  # Seconds between file appends
+BATTLE_LOG_BATCH_SIZE = 1000  # Finished battles per append
+
+DRAW = -1  # Outcome of a battle nobody won
+
+# One attack: attacker index, critical flag, damage, player1 HP, player2 HP
+RECORD_STRUCT = struct.Struct('<BBHii')
+# One finished battle in the log file: battle id, seed, finish time, opener index,
+# outcome (winner index or DRAW), forfeit flag, length of the names block, number of records
+BATTLE_HEADER_STRUCT = struct.Struct('<IQdBbBHI')
+
+
+class BattleLog:
+    __slots__ = ('battle_id', 'seed', 'usernames', 'ordinooki_ids', 'first', 'outcome', 'forfeit',
+                 'finished_at', 'records')
+
+    def __init__(self, seed, usernames, ordinooki_ids, battle_id=0):
+        """
+        Compact event log of one battle.
+
+        Every attack is a fixed-width record in a bytearray. Together with the
+        seed and both Ordinookis the fight can be replayed exactly, so messages
+        are only rendered when somebody reads the log.
+
+        :param seed: Seed of the battle's random generator
+        :param usernames: (player1, player2) usernames
+        :param ordinooki_ids: (player1, player2) Ordinooki ids
+        :param battle_id: Id the battle manager assigned to the fight
+        """
+        self.battle_id = battle_id
+        self.seed = seed
+        self.usernames = tuple(usernames)
+        self.ordinooki_ids = tuple(ordinooki_ids)
+        self.first = None       # Index of the player that opened the fight
+        self.outcome = None     # Winner index or DRAW, None while the fight goes on
+        self.forfeit = False
+        self.finished_at = None
+        self.records = bytearray()
+
+    def __len__(self):
+        return len(self.records) // RECORD_STRUCT.size
+
+    def __iter__(self):
+        return RECORD_STRUCT.iter_unpack(self.records)
+
+    def record(self, attacker, damage, critical, health1, health2):
+        self.records += RECORD_STRUCT.pack(attacker, critical, damage, health1, health2)
+
+    def turn(self, index):
+        """
+        Return (attacker, critical, damage, player1 HP, player2 HP) of the index-th attack.
+        """
+        return RECORD_STRUCT.unpack_from(self.records, index * RECORD_STRUCT.size)
+
+    def finish(self, outcome, forfeit=False):
+        self.outcome = outcome
+        self.forfeit = forfeit
+        self.finished_at = time.time()
+
+    @property
+    def winner(self):
+        if self.outcome is None or self.outcome == DRAW:
+            return None
+        return self.usernames[self.outcome]
+
+    def start_message(self):
+        return f"{self.usernames[self.first]} starts the battle!"
+
+    def turn_message(self, index):
+        attacker, critical, damage, _, _ = self.turn(index)
+        return (f"{self.usernames[attacker]} attacks {self.usernames[1 - attacker]} for {damage} damage"
+                f"{' (Critical Hit!)' if critical else ''}.")
+
+    def result_message(self):
+        if self.outcome is None:
+            return None
+        if self.outcome == DRAW:
+            return "It's a Draw!"
+        if self.forfeit:
+            return f"{self.usernames[self.outcome]} Wins! ({self.usernames[1 - self.outcome]} left the battle)"
+        return f"{self.usernames[self.outcome]} Wins!"
+
+    def render(self):
+        """
+        Build the human-readable messages of the fight so far.
+        """
+        messages = []
+        if self.first is not None:
+            messages.append(self.start_message())
+        messages.extend(self.turn_message(index) for index in range(len(self)))
+        if self.outcome is not None:
+            messages.append(self.result_message())
+        return messages
+
+    def pack(self):
+        names = json.dumps(self.usernames + self.ordinooki_ids).encode('utf-8')
+        header = BATTLE_HEADER_STRUCT.pack(
+            self.battle_id, self.seed, self.finished_at or 0.0, self.first or 0,
+            DRAW if self.outcome is None else self.outcome, self.forfeit, len(names), len(self)
+        )
+        return header + names + self.records
+
+    @classmethod
+    def unpack_from(cls, data, offset=0):
+        """
+        Read one battle written by pack().
+
+        :return: (BattleLog, offset of the next battle)
+        """
+        battle_id, seed, finished_at, first, outcome, forfeit, names_size, count = \
+            BATTLE_HEADER_STRUCT.unpack_from(data, offset)
+        offset += BATTLE_HEADER_STRUCT.size
+        names = json.loads(bytes(data[offset:offset + names_size]).decode('utf-8'))
+        offset += names_size
+        log = cls(seed, names[:2], names[2:], battle_id)
+        log.first = first
+        log.outcome = outcome
+        log.forfeit = bool(forfeit)
+        log.finished_at = finished_at
+        log.records = bytearray(data[offset:offset + count * RECORD_STRUCT.size])
+        return log, offset + count * RECORD_STRUCT.size
+
+
+def read_battle_logs(path=BATTLE_LOG_PATH):
+    """
+    Yield every battle stored in an append-only log file.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        log, offset = BattleLog.unpack_from(data, offset)
+        yield log
+
+
+class BattleLogWriter:
+    def __init__(self, path=BATTLE_LOG_PATH, flush_interval=BATTLE_LOG_FLUSH_INTERVAL):
+        """
+        Appends finished battles to a file in batches.
+
+        :param path: Append-only log file
+        :param flush_interval: Seconds between two appends
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.written = 0
+
+    def add(self, log):
+        self.pending.append(log)
+
+    def _append(self, data):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    async def flush(self):
+        loop = asyncio.get_running_loop()
+        while self.pending:
+            batch = self.pending[:BATTLE_LOG_BATCH_SIZE]
+            del self.pending[:BATTLE_LOG_BATCH_SIZE]
+            try:
+                await loop.run_in_executor(None, self._append, b''.join(log.pack() for log in batch))
+            except OSError as e:
+                # Keep the batch for the next flush
+                self.pending[:0] = batch
+                logger.warning("Failed to write battle log: %s", e)
+                return
+            self.written += len(batch)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print and verify battles from the battle log file.")
+    parser.add_argument('--path', default=BATTLE_LOG_PATH, help="battle log file")
+    parser.add_argument('--battle', type=int, default=None, help="only show this battle id")
+    parser.add_argument('--verify', action='store_true', help="replay every battle and compare the records")
+    args = parser.parse_args()
+
+    # Imported here, battle_logic itself depends on this module
+    from battle_logic import replay
+    from catalog import get_catalog
+
+    catalog = get_catalog()
+    shown = mismatches = 0
+    for log in read_battle_logs(args.path):
+        if args.battle is not None and log.battle_id != args.battle:
+            continue
+        shown += 1
+        print(f"Battle {log.battle_id} (seed {log.seed}): {log.usernames[0]} vs {log.usernames[1]}, {len(log)} attacks")
+        if args.battle is not None:
+            for message in log.render():
+                print(f"  {message}")
+        if args.verify and not log.forfeit:
+            ordinookis = [catalog.get(ordinooki_id) for ordinooki_id in log.ordinooki_ids]
+            if None in ordinookis:
+                print("  Cannot verify, an Ordinooki is no longer in the catalog.")
+                continue
+            replayed = replay(log, *ordinookis)
+            if replayed.records != log.records or replayed.outcome != log.outcome:
+                mismatches += 1
+                print("  Replay does not match the log!")
+    print(f"{shown} battles, {mismatches} replay mismatches")
+
+
+if __name__ == '__main__':
+    main()
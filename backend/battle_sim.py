@@ -0,0 +1,172 @@
+# battle_sim.py
+
+import argparse
+import time
+
+import numpy as np
+
+from battle_logic import CRITICAL_MULTIPLIER, MAX_TURNS
+from catalog import get_catalog
+
+# Simulation configuration
+DEFAULT_TRIALS = 32          # Battles simulated per pair of Ordinookis
+DEFAULT_BATCH_SIZE = 2000000  # Battles advanced together in one set of arrays
+MAX_ROUNDS = MAX_TURNS // 2  # Rounds (one attack each) before a fight is called a draw
+
+
+class BattleSimulator:
+    def __init__(self, hp, attack, defense, speed, critical_chance, seed=None):
+        """
+        Headless Monte-Carlo battles using the BattleSession rules.
+
+        Every fighter is a position in the stat arrays. Many battles are run at
+        once as NumPy vectors: both fighters' HP, one crit draw per attack and
+        masks that drop finished fights from the next round.
+
+        :param hp, attack, defense, speed, critical_chance: Per fighter stats
+        :param seed: Seed of the random generator, for reproducible tables
+        """
+        self.hp = np.asarray(hp, dtype=np.int32)
+        self.attack = np.asarray(attack, dtype=np.int32)
+        self.defense = np.asarray(defense, dtype=np.int32)
+        self.speed = np.asarray(speed, dtype=np.int32)
+        self.critical_chance = np.asarray(critical_chance, dtype=np.float64)
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_catalog(cls, catalog, seed=None):
+        return cls(catalog.hp, catalog.attack, catalog.defense, catalog.speed, catalog.critical_chance, seed)
+
+    def simulate(self, first, second):
+        """
+        Fight first[k] against second[k] for every k.
+
+        :return: (winner, turns) arrays, winner is 0 if first[k] won, 1 if
+                 second[k] won and -1 for a draw (neither can deal damage)
+        """
+        first = np.asarray(first)
+        second = np.asarray(second)
+        count = len(first)
+
+        # Turn order: the faster fighter opens, ties are a coin flip
+        speed_a = self.speed[first]
+        speed_b = self.speed[second]
+        swap = (speed_b > speed_a) | ((speed_a == speed_b) & (self.rng.random(count) < 0.5))
+        opener = np.where(swap, second, first)
+        responder = np.where(swap, first, second)
+
+        # Side A always attacks first, side B second
+        damage_a = np.maximum(self.attack[opener] - self.defense[responder], 0)
+        damage_b = np.maximum(self.attack[responder] - self.defense[opener], 0)
+        critical_a = np.floor(damage_a * CRITICAL_MULTIPLIER).astype(np.int32)
+        critical_b = np.floor(damage_b * CRITICAL_MULTIPLIER).astype(np.int32)
+        chance_a = self.critical_chance[opener]
+        chance_b = self.critical_chance[responder]
+        hp_a = self.hp[opener].copy()
+        hp_b = self.hp[responder].copy()
+
+        opener_won = np.zeros(count, dtype=bool)
+        finished = np.zeros(count, dtype=bool)
+        turns = np.full(count, 2 * MAX_ROUNDS, dtype=np.int32)
+
+        # Fights where nobody can deal damage would never end, they are draws
+        active = np.flatnonzero((damage_a > 0) | (damage_b > 0))
+        state = [
+            array[active] for array in
+            (hp_a, hp_b, damage_a, damage_b, critical_a, critical_b, chance_a, chance_b)
+        ]
+
+        for round_number in range(MAX_ROUNDS):
+            if not len(active):
+                break
+            for attacker in (0, 1):
+                defender = 1 - attacker
+
+                # One crit draw per attack, then a masked HP update
+                critical = self.rng.random(len(active)) < state[6 + attacker]
+                state[defender] -= np.where(critical, state[4 + attacker], state[2 + attacker])
+                done = state[defender] <= 0
+                if done.any():
+                    ended = active[done]
+                    finished[ended] = True
+                    opener_won[ended] = attacker == 0
+                    turns[ended] = 2 * round_number + attacker + 1
+                    keep = ~done
+                    active = active[keep]
+                    state = [array[keep] for array in state]
+                    if not len(active):
+                        break
+
+        winner = np.where(opener_won != swap, 0, 1).astype(np.int8)
+        winner[~finished] = -1
+        return winner, turns
+
+    def win_matrix(self, fighters=None, trials=DEFAULT_TRIALS, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+        """
+        Estimate the pairwise win probabilities of a set of fighters.
+
+        :param fighters: Fighter positions to include, all of them if None
+        :param trials: Battles per unordered pair
+        :param batch_size: Upper bound of battles simulated at once
+        :param progress: Optional callable receiving (pairs_done, pairs_total)
+        :return: (matrix, fighters), matrix[i, j] is the probability fighters[i] beats fighters[j]
+        """
+        fighters = np.arange(len(self.hp)) if fighters is None else np.asarray(fighters)
+        size = len(fighters)
+        wins = np.zeros((size, size), dtype=np.float32)
+        rows, columns = np.triu_indices(size, 1)
+        pairs_per_batch = max(batch_size // trials, 1)
+
+        for start in range(0, len(rows), pairs_per_batch):
+            row = np.repeat(rows[start:start + pairs_per_batch], trials)
+            column = np.repeat(columns[start:start + pairs_per_batch], trials)
+            winner, _ = self.simulate(fighters[row], fighters[column])
+
+            # Trials of a pair are contiguous, so they reduce with a reshape
+            first_won = (winner == 0).reshape(-1, trials).mean(axis=1)
+            second_won = (winner == 1).reshape(-1, trials).mean(axis=1)
+            pair_rows = row[::trials]
+            pair_columns = column[::trials]
+            wins[pair_rows, pair_columns] = first_won
+            wins[pair_columns, pair_rows] = second_won
+            if progress:
+                progress(min(start + pairs_per_batch, len(rows)), len(rows))
+
+        return wins, fighters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte-Carlo win-rate table for every pair of Ordinookis.")
+    parser.add_argument('--trials', type=int, default=DEFAULT_TRIALS, help="battles per pair")
+    parser.add_argument('--seed', type=int, default=None, help="random seed for a reproducible table")
+    parser.add_argument('--limit', type=int, default=None, help="only use the first N catalog entries")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="battles simulated at once")
+    parser.add_argument('--output', default='win_matrix.npz', help="where to write the matrix (.npz)")
+    parser.add_argument('--top', type=int, default=10, help="number of strongest Ordinookis to print")
+    args = parser.parse_args()
+
+    catalog = get_catalog()
+    simulator = BattleSimulator.from_catalog(catalog, args.seed)
+    fighters = np.arange(len(catalog) if args.limit is None else min(args.limit, len(catalog)))
+
+    started = time.perf_counter()
+
+    def progress(done, total):
+        print(f"\r{done}/{total} pairs ({time.perf_counter() - started:.1f}s)", end='', flush=True)
+
+    matrix, fighters = simulator.win_matrix(fighters, args.trials, args.batch_size, progress)
+    print()
+
+    ids = np.array([catalog.ids[index] for index in fighters])
+    np.savez_compressed(args.output, win_probability=matrix, ids=ids, trials=args.trials,
+                        seed=-1 if args.seed is None else args.seed)
+    print(f"Wrote {len(fighters)}x{len(fighters)} win matrix to {args.output} in {time.perf_counter() - started:.1f}s")
+
+    # Average win rate against the whole field
+    average = matrix.sum(axis=1) / max(len(fighters) - 1, 1)
+    for index in np.argsort(average)[::-1][:args.top]:
+        print(f"{catalog.names[fighters[index]]:>16}  {average[index]:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,485 @@
+# benchmark.py
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import jwt
+import websockets
+
+from catalog import get_catalog
+
+# Secret key for JWT (should be the same as in auth.py and websocket_server.py)
+SECRET_KEY = 'your_secret_key'
+
+# Benchmark configuration
+BENCHMARK_HOST = 'localhost'
+BENCHMARK_PORT = 6799              # Kept away from a development server on 6789
+BENCHMARK_INVALIDATION_PORT = 6798
+GROUP_SIZE = 20                    # Players standing close enough to see each other
+GROUP_SPACING = 2000               # Map distance between groups, beyond the view radius
+MOVE_RANGE = 50                    # Players wander this far around their group's spot
+SENT_HISTORY = 64                  # Positions per player remembered to match worldDelta frames
+CONNECT_BATCH = 100                # Clients connecting at once
+CHURN_RESUME_TTL = 2               # Seconds dropped sessions stay resumable during a churn run
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_results.jsonl')
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def make_token(username, hours=6):
+    return jwt.encode({
+        'username': username,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=hours)
+    }, SECRET_KEY, algorithm='HS256')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(latencies):
+    return {
+        "samples": len(latencies),
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies) if latencies else None
+    }
+
+
+def _children(pid):
+    found = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                found.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return found
+
+
+def process_usage(pid):
+    """
+    CPU seconds and resident bytes of a process and all of its descendants (Linux /proc).
+    """
+    cpu = 0.0
+    rss = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/stat') as f:
+                # The command name may contain spaces, fields are counted after its closing parenthesis
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            with open(f'/proc/{current}/statm') as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError):
+            continue
+        pending.extend(_children(current))
+    return cpu, rss
+
+
+class SimulatedClient:
+    def __init__(self, benchmark, index):
+        """
+        One fake player: moves around its group's spot and answers challenges.
+
+        :param benchmark: Benchmark the client reports to
+        :param index: Position of the client, decides its name and group
+        """
+        self.benchmark = benchmark
+        self.username = f"bench{index}"
+        group = index // GROUP_SIZE
+        self.home_x = 500 + (group % 50) * GROUP_SPACING
+        self.home_y = 500 + (group // 50) * GROUP_SPACING
+        self.group = group
+        self.observer = random.random() < benchmark.observer_fraction
+        self.websocket = None
+        self.sent = {}           # x coordinate sent -> perf_counter at send time
+        self.sequence = 0
+        self.busy = False        # In a challenge or battle, movement pauses meanwhile
+        self.challenged_at = None
+        self.tasks = []
+
+    async def connect(self):
+        url = f"ws://{self.benchmark.host}:{self.benchmark.port}"
+        self.websocket = await websockets.connect(url, max_queue=None, ping_interval=None)
+        await self.websocket.send(json.dumps({'token': make_token(self.username)}))
+        reply = json.loads(await self.websocket.recv())
+        if not reply.get('authenticated'):
+            raise RuntimeError(f"Authentication failed for {self.username}: {reply}")
+        self.tasks = [
+            asyncio.ensure_future(self._receive()),
+            asyncio.ensure_future(self._move())
+        ]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.websocket:
+            await self.websocket.close()
+
+    def _next_x(self):
+        # Every position in the history window is unique, so a worldDelta entry maps to one send time
+        self.sequence += 1
+        return self.home_x - MOVE_RANGE + (self.sequence % (20 * MOVE_RANGE)) * 0.1
+
+    async def _move(self):
+        interval = 1.0 / self.benchmark.update_rate
+        await asyncio.sleep(random.random() * interval)
+        while True:
+            if not self.busy:
+                x = self._next_x()
+                if len(self.sent) >= SENT_HISTORY:
+                    self.sent.clear()
+                self.sent[x] = time.perf_counter()
+                await self.websocket.send(json.dumps({
+                    "type": "playerUpdate",
+                    "x": x,
+                    "y": self.home_y,
+                    "animation": "walk",
+                    "flipX": False,
+                    "scale": 1
+                }))
+                self.benchmark.sent += 1
+            await asyncio.sleep(interval * random.uniform(0.8, 1.2))
+
+    async def challenge(self, target):
+        self.busy = target.busy = True
+        self.challenged_at = time.perf_counter()
+        await self.websocket.send(json.dumps({"type": "challenge_request", "from": self.username, "to": target.username}))
+        self.benchmark.sent += 1
+
+    async def _receive(self):
+        benchmark = self.benchmark
+        async for frame in self.websocket:
+            received_at = time.perf_counter()
+            benchmark.received += 1
+            if isinstance(frame, bytes):
+                continue
+            # Only observers parse movement frames, everybody else skims for the challenge flow
+            if '"worldDelta"' in frame[:40]:
+                if self.observer:
+                    self._measure(json.loads(frame), received_at)
+                continue
+            if '"challenge_request"' in frame:
+                data = json.loads(frame)
+                self.busy = True
+                await self.websocket.send(json.dumps({"type": "challenge_accept", "from": self.username, "to": data["from"]}))
+                benchmark.sent += 1
+            elif '"fight_start"' in frame[:40]:
+                if self.challenged_at is not None:
+                    benchmark.challenge_latencies.append((received_at - self.challenged_at) * 1000)
+                    self.challenged_at = None
+                    benchmark.battles_started += 1
+            elif '"fight_start_error"' in frame or '"challenge_response"' in frame:
+                self.busy = False
+                self.challenged_at = None
+            elif '"event": "result"' in frame:
+                self.busy = False
+
+    def _measure(self, data, received_at):
+        clients = self.benchmark.clients_by_name
+        for username, state in data.get("players", {}).items():
+            mover = clients.get(username)
+            if mover is None:
+                continue
+            sent_at = mover.sent.get(state.get("x"))
+            if sent_at is not None:
+                self.benchmark.latencies.append((received_at - sent_at) * 1000)
+
+
+class Benchmark:
+    def __init__(self, steps, duration, warmup, update_rate, challenge_rate, observer_fraction,
+                 workers=0, host=BENCHMARK_HOST, port=BENCHMARK_PORT, server_env=None):
+        """
+        Ramps simulated players against a freshly started websocket server.
+
+        The server runs as a child process on an in-memory user store seeded
+        with one user per simulated player, so it needs no MongoDB. For each
+        player count the run records fan-out latency (playerUpdate sent until
+        the worldDelta carrying it arrives at a client in the same group),
+        challenge latency (challenge_request until fight_start), message rates
+        and the server's CPU and RSS.
+
+        :param steps: Increasing player counts to measure
+        :param duration: Seconds measured per step
+        :param warmup: Seconds after connecting before a step is measured
+        :param update_rate: playerUpdate messages per second per player
+        :param challenge_rate: Challenges started per second across all players
+        :param observer_fraction: Share of clients that parse worldDelta frames for latency
+        :param workers: Run launcher.py with this many workers, 0 for a single websocket_server
+        :param server_env: Extra environment variables for the server
+        """
+        self.steps = steps
+        self.duration = duration
+        self.warmup = warmup
+        self.update_rate = update_rate
+        self.challenge_rate = challenge_rate
+        self.observer_fraction = observer_fraction
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.server_env = server_env or {}
+        self.clients = []
+        self.clients_by_name = {}
+        self.server = None
+        self.workdir = tempfile.mkdtemp(prefix='ordinooki-bench-')
+        self.connect_failures = 0
+        self._reset()
+
+    def _reset(self):
+        self.sent = 0
+        self.received = 0
+        self.latencies = []
+        self.challenge_latencies = []
+        self.battles_started = 0
+
+    def _write_users(self, count):
+        catalog = get_catalog()
+        path = os.path.join(self.workdir, 'users.json')
+        users = []
+        for index in range(count):
+            ordinooki_id = catalog.ids[index % len(catalog)]
+            users.append({
+                'username': f"bench{index}",
+                'password_hash': '',
+                'progress': {},
+                'ordinookiIds': [ordinooki_id],
+                'selected_ordinooki': ordinooki_id
+            })
+        with open(path, 'w') as f:
+            json.dump(users, f)
+        return path
+
+    def start_server(self):
+        users_path = self._write_users(max(self.steps))
+        env = {
+            **os.environ,
+            'MONGODB_CONNECTION_STRING': f"memory://{users_path}",
+            'WEBSOCKET_HOST': self.host,
+            'WEBSOCKET_PORT': str(self.port),
+            'CACHE_INVALIDATION_PORT': str(BENCHMARK_INVALIDATION_PORT),
+            'BATTLE_LOG_PATH': os.path.join(self.workdir, 'battles.log'),
+            **self.server_env
+        }
+        backend = os.path.dirname(os.path.abspath(__file__))
+        if self.workers:
+            command = [sys.executable, 'launcher.py', '--workers', str(self.workers),
+                       '--host', self.host, '--port', str(self.port)]
+        else:
+            command = [sys.executable, 'websocket_server.py']
+        self.server = subprocess.Popen(
+            command, cwd=backend, env=env,
+            stdout=open(os.path.join(self.workdir, 'server.log'), 'w'), stderr=subprocess.STDOUT
+        )
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.server.poll() is not None:
+                raise RuntimeError(f"Server exited, see {self.workdir}/server.log")
+            try:
+                socket.create_connection((self.host, self.port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("Server did not start listening within 30 seconds")
+
+    def stop_server(self):
+        if self.server and self.server.poll() is None:
+            self.server.terminate()
+            try:
+                self.server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.server.kill()
+
+    async def _grow(self, count):
+        while len(self.clients) < count:
+            batch = [SimulatedClient(self, index)
+                     for index in range(len(self.clients), min(count, len(self.clients) + CONNECT_BATCH))]
+            results = await asyncio.gather(*(client.connect() for client in batch), return_exceptions=True)
+            for client, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    self.connect_failures += 1
+                    continue
+                self.clients.append(client)
+                self.clients_by_name[client.username] = client
+            if all(isinstance(result, Exception) for result in results):
+                print(f"Could not connect more clients: {results[0]}")
+                return
+
+    async def _challenges(self):
+        if self.challenge_rate <= 0:
+            return
+        while True:
+            await asyncio.sleep(random.expovariate(self.challenge_rate))
+            if len(self.clients) < 2:
+                continue
+            challenger = random.choice(self.clients)
+            group = [client for client in self.clients[challenger.group * GROUP_SIZE:(challenger.group + 1) * GROUP_SIZE]
+                     if client is not challenger and not client.busy]
+            if challenger.busy or not group:
+                continue
+            await challenger.challenge(random.choice(group))
+
+    async def run_step(self, count):
+        await self._grow(count)
+        await asyncio.sleep(self.warmup)
+
+        self._reset()
+        server_cpu, _ = process_usage(self.server.pid)
+        client_cpu = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        await asyncio.sleep(self.duration)
+        elapsed = time.perf_counter() - started
+        server_cpu_end, server_rss = process_usage(self.server.pid)
+        client_cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+
+        client_seconds = (client_cpu_end.ru_utime + client_cpu_end.ru_stime) - (client_cpu.ru_utime + client_cpu.ru_stime)
+        return {
+            "players": len(self.clients),
+            "seconds": round(elapsed, 3),
+            "sent_per_second": self.sent / elapsed,
+            "received_per_second": self.received / elapsed,
+            "fanout_latency_ms": summarize(self.latencies),
+            "challenge_latency_ms": summarize(self.challenge_latencies),
+            "battles_started": self.battles_started,
+            "server_cpu_percent": 100 * (server_cpu_end - server_cpu) / elapsed,
+            "server_rss_mb": server_rss / (1 << 20),
+            # A busy load generator skews the latencies, compare against this before trusting them
+            "client_cpu_percent": 100 * client_seconds / elapsed,
+            "connect_failures": self.connect_failures
+        }
+
+    async def run_churn(self, count, cycles, settle):
+        """
+        Connect and disconnect `count` players `cycles` times, sampling the server's RSS after each cycle.
+
+        Every cycle reuses the same usernames, so per-user caches stay the
+        same size and any growth is state left behind by closed connections.
+        """
+        results = []
+        for cycle in range(cycles):
+            await self._grow(count)
+            await asyncio.sleep(settle)
+            players = len(self.clients)
+            await asyncio.gather(*(client.close() for client in self.clients), return_exceptions=True)
+            self.clients = []
+            self.clients_by_name = {}
+            # Long enough for the server to drop the sessions and expire their resume tokens
+            await asyncio.sleep(settle + CHURN_RESUME_TTL)
+            _, server_rss = process_usage(self.server.pid)
+            results.append({"cycle": cycle, "players": players, "server_rss_mb": server_rss / (1 << 20)})
+            print(f"cycle {cycle:>3}: {players} players connected and closed, server {server_rss / (1 << 20):.1f} MB")
+        return results
+
+    async def run(self):
+        results = []
+        challenges = asyncio.ensure_future(self._challenges())
+        try:
+            for count in self.steps:
+                step = await self.run_step(count)
+                results.append(step)
+                latency = step["fanout_latency_ms"]
+                print(f"{step['players']:>6} players: p50 {latency['p50'] or 0:.1f} ms, p99 {latency['p99'] or 0:.1f} ms, "
+                      f"{step['received_per_second']:.0f} msg/s out, {step['sent_per_second']:.0f} msg/s in, "
+                      f"server {step['server_cpu_percent']:.0f}% CPU {step['server_rss_mb']:.0f} MB, "
+                      f"client {step['client_cpu_percent']:.0f}% CPU")
+        finally:
+            challenges.cancel()
+            await asyncio.gather(*(client.close() for client in self.clients), return_exceptions=True)
+        return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for websocket_server.")
+    parser.add_argument('--players', default='100,500,1000,2000', help="comma separated player counts to ramp through")
+    parser.add_argument('--duration', type=float, default=10, help="seconds measured per step")
+    parser.add_argument('--warmup', type=float, default=3, help="seconds after connecting before measuring")
+    parser.add_argument('--rate', type=float, default=10, help="playerUpdate messages per second per player")
+    parser.add_argument('--challenges', type=float, default=2, help="challenges per second across all players")
+    parser.add_argument('--observers', type=float, default=0.1, help="share of clients measuring fan-out latency")
+    parser.add_argument('--workers', type=int, default=0, help="benchmark launcher.py with N workers")
+    parser.add_argument('--port', type=int, default=BENCHMARK_PORT, help="port the server under test listens on")
+    parser.add_argument('--output', default=RESULTS_PATH, help="JSON lines file the run is appended to")
+    parser.add_argument('--seed', type=int, default=None, help="random seed of the load generator")
+    parser.add_argument('--churn', type=int, default=0,
+                        help="instead of ramping, connect and disconnect the largest player count this many times")
+    parser.add_argument('--settle', type=float, default=2, help="seconds between churn connects and disconnects")
+    parser.add_argument('--max-rss-growth', type=float, default=None,
+                        help="with --churn, exit with status 1 if server RSS grows more MB than this after the first cycle")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    steps = sorted(int(count) for count in args.players.split(','))
+
+    # Every simulated player holds a socket, on both sides
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    started_at = datetime.datetime.utcnow().isoformat() + 'Z'
+    server_env = {'RESUME_TTL': str(CHURN_RESUME_TTL)} if args.churn else None
+    benchmark = Benchmark(steps, args.duration, args.warmup, args.rate, args.challenges, args.observers,
+                          args.workers, port=args.port, server_env=server_env)
+    benchmark.start_server()
+    try:
+        if args.churn:
+            results = asyncio.run(benchmark.run_churn(max(steps), args.churn, args.settle))
+        else:
+            results = asyncio.run(benchmark.run())
+    finally:
+        benchmark.stop_server()
+
+    run = {
+        "revision": git_revision(),
+        "started_at": started_at,
+        "config": {
+            "workers": args.workers,
+            "update_rate": args.rate,
+            "challenge_rate": args.challenges,
+            "observer_fraction": args.observers,
+            "duration": args.duration,
+            "group_size": GROUP_SIZE,
+            "cpu_count": os.cpu_count()
+        }
+    }
+    if args.churn:
+        # Flat RSS after the first cycles means closed connections leave nothing behind
+        run["churn"] = results
+        run["rss_growth_mb"] = results[-1]["server_rss_mb"] - results[min(1, len(results) - 1)]["server_rss_mb"]
+        print(f"Server RSS grew {run['rss_growth_mb']:.1f} MB after the first cycle")
+    else:
+        run["steps"] = results
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(run) + '\n')
+    print(f"Results appended to {args.output} (server log in {benchmark.workdir})")
+
+    if args.churn and args.max_rss_growth is not None and run["rss_growth_mb"] > args.max_rss_growth:
+        print(f"Server RSS grew more than {args.max_rss_growth:.1f} MB across churn cycles")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
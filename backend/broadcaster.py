@@ -0,0 +1,198 @@
+# broadcaster.py
+
+import asyncio
+import json
+import time
+from collections import deque
+
+try:
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    # The queues run without websockets installed, e.g. in tests against fake sockets
+    ConnectionClosed = ConnectionError
+
+from metrics import Counter, Histogram
+
+# Outbound queue configuration
+CLIENT_QUEUE_SIZE = 64     # Frames buffered per client before it counts as backlogged and movement is held back
+CLIENT_QUEUE_LIMIT = 1024  # Frames buffered per client before it is disconnected as stalled
+STALLED_CLOSE_CODE = 1013  # Websocket close code sent to a stalled client ("try again later")
+
+FRAMES_SENT = Counter('ordinooki_messages_sent_total', "Frames queued for clients, per message type", ('type',))
+FRAMES_DROPPED = Counter('ordinooki_frames_dropped_total', "Outbound frames dropped, per reason", ('reason',))
+BROADCAST_SECONDS = Histogram('ordinooki_broadcast_duration_seconds',
+                              "Time spent serializing and queueing one fan-out", ('type',))
+
+
+class ClientChannel:
+    def __init__(self, websocket, max_queue=CLIENT_QUEUE_SIZE, queue_limit=CLIENT_QUEUE_LIMIT):
+        """
+        Bounded outbound queue for a single websocket client.
+
+        A dedicated writer task drains the queue, so a slow socket only ever
+        delays its own frames and never the sender or the other clients.
+
+        Frames are never dropped one by one, a client that missed one would
+        show stale state. Beyond `max_queue` frames the client is backlogged:
+        the world ticker holds its movement updates back and merges them into
+        a later delta, which is the only backpressure on movement. Beyond
+        `queue_limit` frames the client is not keeping up at all and is
+        disconnected, so a stalled socket cannot grow the queue without bound.
+
+        :param websocket: The client connection frames are written to
+        :param max_queue: Queued frames after which the client counts as backlogged
+        :param queue_limit: Queued frames after which the client is disconnected
+        """
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.queue_limit = max(queue_limit, max_queue)
+        self.queue = deque()  # serialized frames, oldest first
+        self.dropped = 0
+        self.closed = False
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.ensure_future(self._writer())
+
+    def push(self, frame):
+        """
+        Queue an already serialized frame without waiting for the socket.
+
+        :return: False if the channel is closed, or was closed because the client stalled
+        """
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.queue_limit:
+            self.stall()
+            return False
+
+        self.queue.append(frame)
+        self.wakeup.set()
+        return True
+
+    def stall(self):
+        """
+        Disconnect a client that stopped reading, its queued frames are discarded.
+        """
+        self.dropped += len(self.queue) + 1
+        FRAMES_DROPPED.inc('client_stalled', amount=len(self.queue) + 1)
+        self.close()
+        asyncio.ensure_future(self.websocket.close(code=STALLED_CLOSE_CODE, reason="client too slow"))
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                frame = self.queue.popleft()
+                await self.websocket.send(frame)
+        except ConnectionClosed:
+            pass
+        finally:
+            self.closed = True
+            self.queue.clear()
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.task.cancel()
+
+
+class Broadcaster:
+    def __init__(self, max_queue=CLIENT_QUEUE_SIZE, queue_limit=CLIENT_QUEUE_LIMIT):
+        """
+        Fan-out of server frames to every connected client.
+
+        Each message is serialized once and handed to the per-client channels,
+        which write to their sockets concurrently.
+
+        :param max_queue: Backlog threshold of every client channel
+        :param queue_limit: Queue length at which a client channel disconnects its client
+        """
+        self.max_queue = max_queue
+        self.queue_limit = queue_limit
+        self.channels = {}  # websocket -> ClientChannel
+
+    def register(self, websocket):
+        channel = ClientChannel(websocket, self.max_queue, self.queue_limit)
+        self.channels[websocket] = channel
+        return channel
+
+    def unregister(self, websocket):
+        channel = self.channels.pop(websocket, None)
+        if channel:
+            channel.close()
+
+    @staticmethod
+    def encode(message):
+        # Frames that are already serialized are passed through untouched
+        if isinstance(message, (str, bytes)):
+            return message
+        return json.dumps(message)
+
+    @staticmethod
+    def kind_of(message, kind):
+        # Metrics label, serialized frames name their type through `kind`
+        if kind is None:
+            kind = message.get("type", "unknown") if isinstance(message, dict) else "raw"
+        return kind
+
+    def send(self, websocket, message, kind=None):
+        """
+        Queue a message for a single client.
+
+        :param kind: Message type counted in the metrics, taken from the message's "type" if None
+        """
+        channel = self.channels.get(websocket)
+        if not channel:
+            return False
+        FRAMES_SENT.inc(self.kind_of(message, kind))
+        return channel.push(self.encode(message))
+
+    def send_many(self, websockets_, message, kind=None):
+        """
+        Queue the same message for a group of clients, serializing it once.
+        """
+        started = time.perf_counter()
+        kind = self.kind_of(message, kind)
+        frame = self.encode(message)
+        sent = 0
+        for websocket in websockets_:
+            channel = self.channels.get(websocket)
+            if channel:
+                channel.push(frame)
+                sent += 1
+        FRAMES_SENT.inc(kind, amount=sent)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started, kind)
+
+    def broadcast(self, message, exclude=None, kind=None):
+        """
+        Queue a message for every registered client except `exclude`.
+        """
+        started = time.perf_counter()
+        kind = self.kind_of(message, kind)
+        frame = self.encode(message)
+        sent = 0
+        for websocket, channel in self.channels.items():
+            if websocket is not exclude:
+                channel.push(frame)
+                sent += 1
+        FRAMES_SENT.inc(kind, amount=sent)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started, kind)
+
+    def backlogged(self, websocket):
+        """
+        True if the client's queue is past its backlog threshold.
+
+        The world ticker holds movement back from backlogged clients, this is
+        the only backpressure before the hard queue limit disconnects them.
+        """
+        channel = self.channels.get(websocket)
+        return channel is not None and len(channel.queue) >= channel.max_queue
+
+    def queue_depth(self):
+        """
+        Total and largest number of frames waiting in the client queues.
+        """
+        depths = [len(channel.queue) for channel in self.channels.values()]
+        return sum(depths), max(depths, default=0)
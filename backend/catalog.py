@@ -0,0 +1,364 @@
+# catalog.py
+
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import time
+from array import array
+
+from logger import log
+
+# Ordinooki catalog configuration
+ORDINOOKI_JSON_PATH = os.path.join(os.path.dirname(__file__), 'ordinooki.json')  # Source data
+CATALOG_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'ordinooki.catalog')  # Precompiled store
+CATALOG_FORMAT_VERSION = 1
+CATALOG_BUNDLE_FORMAT = 1  # Layout of the client bundle, part of its version
+CATALOG_CHECK_INTERVAL = float(os.environ.get('CATALOG_CHECK_INTERVAL', 5))  # Seconds between checks of the source JSON
+
+# Numeric stats kept in typed arrays, in this order
+STAT_NAMES = ('HP', 'Attack', 'Defense', 'Speed', 'Critical Chance')
+INT_STATS = ('HP', 'Attack', 'Defense', 'Speed')
+
+
+class OrdinookiCatalog:
+    __slots__ = (
+        'source_hash', 'ids', 'names', 'hp', 'attack', 'defense', 'speed', 'critical_chance',
+        'special_attack', 'special_attacks', 'trait_types', 'trait_values', 'attribute_values',
+        'id_index'
+    )
+
+    def __init__(self, source_hash, ids, names, stats, special_attack, special_attacks,
+                 trait_types, trait_values, attribute_values):
+        """
+        Compact, read-only store of every Ordinooki.
+
+        Entries are addressed by their position. Numeric stats live in typed
+        arrays, strings that repeat (traits, special attacks) are stored once
+        and referenced by index.
+
+        :param source_hash: sha256 of the JSON file the catalog was compiled from
+        :param ids: Inscription id per entry
+        :param names: Display name per entry
+        :param stats: Stat name -> typed array with one value per entry
+        :param special_attack: Index into special_attacks per entry
+        :param special_attacks: Distinct special attack descriptions
+        :param trait_types: Distinct trait types, in attribute order
+        :param trait_values: Distinct (trait_type, value) pairs
+        :param attribute_values: Per entry, one index into trait_values per trait type
+        """
+        self.source_hash = source_hash
+        self.ids = ids
+        self.names = names
+        self.hp = stats['HP']
+        self.attack = stats['Attack']
+        self.defense = stats['Defense']
+        self.speed = stats['Speed']
+        self.critical_chance = stats['Critical Chance']
+        self.special_attack = special_attack
+        self.special_attacks = special_attacks
+        self.trait_types = trait_types
+        self.trait_values = trait_values
+        self.attribute_values = attribute_values
+        self._build_indexes()
+
+    def _build_indexes(self):
+        # Later duplicates win, like the dict comprehension this replaced
+        self.id_index = {ordinooki_id: index for index, ordinooki_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, ordinooki_id):
+        return ordinooki_id in self.id_index
+
+    def index_of(self, ordinooki_id):
+        return self.id_index.get(ordinooki_id)
+
+    def stats(self, index):
+        return {
+            'HP': self.hp[index],
+            'Defense': self.defense[index],
+            'Speed': self.speed[index],
+            'Special Attack': self.special_attacks[self.special_attack[index]],
+            'Critical Chance': self.critical_chance[index],
+            'Attack': self.attack[index]
+        }
+
+    def attributes(self, index):
+        width = len(self.trait_types)
+        return [
+            {'value': self.trait_values[value_index][1], 'trait_type': self.trait_values[value_index][0]}
+            for value_index in self.attribute_values[index * width:(index + 1) * width]
+            if value_index != 0xFFFF
+        ]
+
+    def entry(self, index):
+        """
+        Rebuild an entry in the shape of ordinooki.json.
+        """
+        return {
+            'id': self.ids[index],
+            'meta': {
+                'name': self.names[index],
+                'attributes': self.attributes(index),
+                'stats': self.stats(index)
+            }
+        }
+
+    def project(self, index, fields=None):
+        """
+        Build an entry with only some of its meta fields.
+
+        :param fields: Iterable of 'name', 'attributes' and/or 'stats', all if None
+        """
+        if fields is None:
+            return self.entry(index)
+        meta = {}
+        if 'name' in fields:
+            meta['name'] = self.names[index]
+        if 'attributes' in fields:
+            meta['attributes'] = self.attributes(index)
+        if 'stats' in fields:
+            meta['stats'] = self.stats(index)
+        return {'id': self.ids[index], 'meta': meta}
+
+    def resolve(self, ordinooki_ids):
+        """
+        Map a batch of ids to entry indexes.
+
+        :return: (list of indexes in input order, list of unknown ids)
+        """
+        indexes = []
+        missing = []
+        id_index = self.id_index
+        for ordinooki_id in ordinooki_ids:
+            index = id_index.get(ordinooki_id)
+            if index is None:
+                missing.append(ordinooki_id)
+            else:
+                indexes.append(index)
+        return indexes, missing
+
+    def get(self, ordinooki_id):
+        index = self.id_index.get(ordinooki_id)
+        return None if index is None else self.entry(index)
+
+    def __getstate__(self):
+        # The index is rebuilt on load, only the compact columns are stored
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != 'id_index'}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self._build_indexes()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_fingerprint(source_path=ORDINOOKI_JSON_PATH):
+    """
+    Cheap change check of the source JSON: (size, mtime in ns).
+    """
+    stat = os.stat(source_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def compile_catalog(source_path=ORDINOOKI_JSON_PATH, source_hash=None):
+    """
+    Parse the Ordinooki JSON into an OrdinookiCatalog.
+    """
+    with open(source_path, 'r') as f:
+        entries = json.load(f)
+
+    ids = []
+    names = []
+    stats = {name: array('H') if name in INT_STATS else array('d') for name in STAT_NAMES}
+    special_attack = array('B')
+    special_attacks = []
+    special_attack_index = {}
+    trait_types = []
+    trait_values = []
+    trait_value_index = {}
+
+    # Trait types are collected first so every entry gets the same column layout
+    for entry in entries:
+        for attribute in entry['meta'].get('attributes', []):
+            if attribute['trait_type'] not in trait_types:
+                trait_types.append(attribute['trait_type'])
+
+    attribute_values = array('H', [0xFFFF]) * (len(entries) * len(trait_types))
+    for index, entry in enumerate(entries):
+        meta = entry['meta']
+        entry_stats = meta.get('stats', {})
+        ids.append(entry['id'])
+        names.append(meta.get('name', ''))
+        for name in STAT_NAMES:
+            stats[name].append(entry_stats.get(name, 0))
+
+        description = entry_stats.get('Special Attack', '')
+        if description not in special_attack_index:
+            special_attack_index[description] = len(special_attacks)
+            special_attacks.append(description)
+        special_attack.append(special_attack_index[description])
+
+        for attribute in meta.get('attributes', []):
+            key = (attribute['trait_type'], attribute['value'])
+            if key not in trait_value_index:
+                trait_value_index[key] = len(trait_values)
+                trait_values.append(key)
+            column = trait_types.index(attribute['trait_type'])
+            attribute_values[index * len(trait_types) + column] = trait_value_index[key]
+
+    return OrdinookiCatalog(
+        source_hash or hash_file(source_path), ids, names, stats, special_attack, special_attacks,
+        tuple(trait_types), trait_values, attribute_values
+    )
+
+
+def load_catalog(source_path=ORDINOOKI_JSON_PATH, cache_path=CATALOG_CACHE_PATH):
+    """
+    Load the precompiled catalog, recompiling it only when the source JSON changed.
+    """
+    fingerprint = source_fingerprint(source_path)
+
+    cached = None
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('version') != CATALOG_FORMAT_VERSION:
+            cached = None
+    except (OSError, pickle.PickleError, EOFError, AttributeError):
+        cached = None
+
+    if cached and cached['fingerprint'] == fingerprint:
+        return cached['catalog']
+
+    # The file was touched, only its content hash decides whether to recompile
+    source_hash = hash_file(source_path)
+    if cached and cached['catalog'].source_hash == source_hash:
+        catalog = cached['catalog']
+    else:
+        catalog = compile_catalog(source_path, source_hash)
+        log.info("Compiled Ordinooki catalog with %d entries.", len(catalog))
+
+    try:
+        with open(cache_path + '.tmp', 'wb') as f:
+            pickle.dump({
+                'version': CATALOG_FORMAT_VERSION,
+                'fingerprint': fingerprint,
+                'catalog': catalog
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_path + '.tmp', cache_path)
+    except OSError as e:
+        log.warning("Failed to write Ordinooki catalog cache: %s", e)
+    return catalog
+
+
+class CatalogBundle:
+    __slots__ = ('version', 'data', 'size')
+
+    def __init__(self, version, data, size):
+        """
+        Gzipped JSON of every catalog entry, downloaded once by clients.
+
+        :param version: bundle_version() of the catalog it was built from
+        :param data: gzip compressed bytes
+        :param size: Uncompressed size in bytes
+        """
+        self.version = version
+        self.data = data
+        self.size = size
+
+
+def bundle_version(catalog):
+    """
+    Content version of the client bundle of `catalog`.
+
+    The bundle only depends on the source JSON and the bundle layout, so the
+    version is derived from those without building the bundle.
+    """
+    return hashlib.sha256(f"{catalog.source_hash}:{CATALOG_BUNDLE_FORMAT}".encode('ascii')).hexdigest()[:16]
+
+
+def build_bundle(catalog):
+    version = bundle_version(catalog)
+    payload = json.dumps({
+        'version': version,
+        'ordinookis': [catalog.entry(index) for index in range(len(catalog))]
+    }, separators=(',', ':')).encode('utf-8')
+    # mtime=0 keeps the bytes identical between builds of the same version
+    return CatalogBundle(version, gzip.compress(payload, compresslevel=9, mtime=0), len(payload))
+
+
+_catalog = None
+_catalog_fingerprint = None  # source_fingerprint() the process wide catalog was loaded at
+_catalog_checked = 0.0       # time.monotonic() of the last check for changes
+_bundle = None
+
+
+def get_catalog():
+    """
+    Return the process wide catalog, loading it on first use.
+
+    The source JSON is checked at most every CATALOG_CHECK_INTERVAL seconds,
+    so a running server picks up an edited file without a restart.
+    """
+    global _catalog_checked
+    now = time.monotonic()
+    if _catalog is None:
+        _catalog_checked = now
+        return reload_catalog()
+    if now - _catalog_checked >= CATALOG_CHECK_INTERVAL:
+        _catalog_checked = now
+        try:
+            changed = source_fingerprint(ORDINOOKI_JSON_PATH) != _catalog_fingerprint
+        except OSError as e:
+            log.warning("Cannot check the Ordinooki catalog source, keeping the loaded catalog: %s", e)
+            changed = False
+        if changed:
+            reload_catalog()
+    return _catalog
+
+
+def get_bundle():
+    """
+    Return the client bundle of the process wide catalog, building it on first use.
+    """
+    global _bundle
+    catalog = get_catalog()
+    if _bundle is None or _bundle.version != bundle_version(catalog):
+        _bundle = build_bundle(catalog)
+    return _bundle
+
+
+def reload_catalog():
+    """
+    Reload the process wide catalog if the source JSON changed since it was loaded.
+
+    A file that was only touched keeps the loaded catalog, the content hash decides.
+    """
+    global _catalog, _catalog_fingerprint
+    fingerprint = source_fingerprint(ORDINOOKI_JSON_PATH)
+    catalog = load_catalog(ORDINOOKI_JSON_PATH, CATALOG_CACHE_PATH)
+    _catalog_fingerprint = fingerprint
+    if _catalog is None or catalog.source_hash != _catalog.source_hash:
+        if _catalog is not None:
+            log.info("Reloaded Ordinooki catalog with %d entries.", len(catalog))
+        _catalog = catalog
+    return _catalog
+
+
+if __name__ == '__main__':
+    # Import through the module name so the pickled class path is "catalog", not "__main__"
+    import catalog as catalog_module
+
+    compiled = catalog_module.load_catalog()
+    log.info("Ordinooki catalog ready: %d entries, source %s", len(compiled), compiled.source_hash[:12])
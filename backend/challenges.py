@@ -0,0 +1,175 @@
+# challenges.py
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+# Challenge configuration
+CHALLENGE_TTL = float(os.environ.get('CHALLENGE_TTL', 30))                    # Seconds a challenge stays open
+MAX_OUTGOING_CHALLENGES = int(os.environ.get('MAX_OUTGOING_CHALLENGES', 3))   # Open challenges a player may send
+MAX_INCOMING_CHALLENGES = int(os.environ.get('MAX_INCOMING_CHALLENGES', 10))  # Open challenges a player may receive
+CHALLENGE_SWEEP_INTERVAL = 0.5  # Seconds between expiry checks
+
+
+class ChallengeError(Exception):
+    """
+    A challenge that cannot be opened, the message is meant for the challenger.
+    """
+
+
+class Challenge:
+    __slots__ = ('challenger', 'target', 'ordinooki_id', 'expires_at', 'open')
+
+    def __init__(self, challenger, target, ordinooki_id, expires_at):
+        """
+        A challenge waiting for the target's answer.
+
+        :param ordinooki_id: Ordinooki the challenger selected, None if it must be looked up again
+        :param expires_at: time.monotonic() after which the challenge expires
+        """
+        self.challenger = challenger
+        self.target = target
+        self.ordinooki_id = ordinooki_id
+        self.expires_at = expires_at
+        self.open = True
+
+    def ttl(self, now=None):
+        return max(self.expires_at - (time.monotonic() if now is None else now), 0.0)
+
+
+class ChallengeRegistry:
+    def __init__(self, ttl=CHALLENGE_TTL, max_outgoing=MAX_OUTGOING_CHALLENGES, max_incoming=MAX_INCOMING_CHALLENGES,
+                 interval=CHALLENGE_SWEEP_INTERVAL):
+        """
+        Open challenges indexed by challenger and by target.
+
+        Lookups by either side are dict accesses. Every challenge gets one
+        entry in a heap ordered by expiry, closed challenges are skipped when
+        they surface instead of being searched for, and the heap is rebuilt
+        once they outnumber the open ones.
+
+        In a cluster every node holds the challenges involving its own
+        players, a challenge between players of two nodes is held by both.
+
+        :param ttl: Seconds a challenge stays open
+        :param max_outgoing: Open challenges one player may have sent
+        :param max_incoming: Open challenges one player may have received
+        :param interval: Seconds between expiry checks in run()
+        """
+        self.ttl = ttl
+        self.max_outgoing = max_outgoing
+        self.max_incoming = max_incoming
+        self.interval = interval
+        self.by_challenger = {}  # challenger -> {target: Challenge}
+        self.by_target = {}      # target -> {challenger: Challenge}
+        self.timers = []         # heap of (expires_at, sequence, Challenge)
+        self.sequence = itertools.count()
+        self.count = 0
+        self.expired = 0
+
+    def __len__(self):
+        return self.count
+
+    def get(self, challenger, target):
+        return self.by_challenger.get(challenger, {}).get(target)
+
+    def check(self, challenger, target):
+        """
+        Raise ChallengeError if `challenger` may not challenge `target` right now.
+        """
+        if challenger == target:
+            raise ChallengeError("You cannot challenge yourself.")
+        if self.get(challenger, target) is not None:
+            raise ChallengeError(f"You already challenged {target}.")
+        if self.get(target, challenger) is not None:
+            raise ChallengeError(f"{target} already challenged you.")
+        if len(self.by_challenger.get(challenger, ())) >= self.max_outgoing:
+            raise ChallengeError(f"You can have at most {self.max_outgoing} open challenges.")
+        if len(self.by_target.get(target, ())) >= self.max_incoming:
+            raise ChallengeError(f"{target} has too many open challenges.")
+
+    def add(self, challenger, target, ordinooki_id=None, ttl=None, now=None):
+        """
+        Open a challenge and return it.
+
+        :param ttl: Seconds until it expires, the registry's ttl if None
+        :raises ChallengeError: See check()
+        """
+        self.check(challenger, target)
+        now = time.monotonic() if now is None else now
+        challenge = Challenge(challenger, target, ordinooki_id, now + (self.ttl if ttl is None else ttl))
+        self.by_challenger.setdefault(challenger, {})[target] = challenge
+        self.by_target.setdefault(target, {})[challenger] = challenge
+        heapq.heappush(self.timers, (challenge.expires_at, next(self.sequence), challenge))
+        self.count += 1
+        return challenge
+
+    def remove(self, challenger, target):
+        """
+        Close a challenge, returning it or None if it was not open.
+        """
+        challenge = self.get(challenger, target)
+        if challenge is None:
+            return None
+        self._close(challenge)
+        if len(self.timers) > 2 * self.count + 64:
+            self.timers = [timer for timer in self.timers if timer[2].open]
+            heapq.heapify(self.timers)
+        return challenge
+
+    def _close(self, challenge):
+        challenge.open = False
+        self.count -= 1
+        for index, first, second in ((self.by_challenger, challenge.challenger, challenge.target),
+                                     (self.by_target, challenge.target, challenge.challenger)):
+            entries = index[first]
+            del entries[second]
+            if not entries:
+                del index[first]
+
+    def remove_user(self, username):
+        """
+        Close every challenge sent or received by a player, returning them.
+        """
+        removed = list(self.by_challenger.get(username, {}).values())
+        removed += self.by_target.get(username, {}).values()
+        for challenge in removed:
+            self._close(challenge)
+        return removed
+
+    def forget_ordinooki(self, username):
+        """
+        Drop the cached Ordinooki of the challenges a player sent, its selection may have changed.
+        """
+        for challenge in self.by_challenger.get(username, {}).values():
+            challenge.ordinooki_id = None
+
+    def expire(self, now=None):
+        """
+        Close and return the challenges whose time ran out.
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self.timers and self.timers[0][0] <= now:
+            challenge = heapq.heappop(self.timers)[2]
+            if challenge.open:
+                self._close(challenge)
+                expired.append(challenge)
+        self.expired += len(expired)
+        return expired
+
+    def stats(self):
+        return {"open": self.count, "timers": len(self.timers), "expired": self.expired}
+
+    async def run(self, on_expired):
+        """
+        Expire challenges every `interval` seconds.
+
+        :param on_expired: Callable run with every expired Challenge
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            for challenge in self.expire():
+                on_expired(challenge)
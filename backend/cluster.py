@@ -0,0 +1,312 @@
+# cluster.py
+
+import asyncio
+import os
+import socket
+import time
+
+from logger import log
+
+# Cluster configuration
+NODE_ID = os.environ.get('NODE_ID', f"{socket.gethostname()}-{os.getpid()}")
+CLUSTER_HEARTBEAT_INTERVAL = float(os.environ.get('CLUSTER_HEARTBEAT_INTERVAL', 2))  # Seconds between heartbeats
+CLUSTER_NODE_TIMEOUT = 3 * CLUSTER_HEARTBEAT_INTERVAL  # Silence after which a node's players are dropped
+CLUSTER_DELTA_RATE_HZ = float(os.environ.get('CLUSTER_DELTA_RATE_HZ', 20))  # Player delta batches per second
+
+# Backplane channels
+PRESENCE_CHANNEL = 'ordinooki:presence'
+PLAYERS_CHANNEL = 'ordinooki:players'
+STATS_CHANNEL = 'ordinooki:stats'
+NODE_CHANNEL_PREFIX = 'ordinooki:node:'
+
+
+class ClusterNode:
+    def __init__(self, backplane, game_state, username_to_client, broadcaster, world_ticker, interest,
+                 session_ids, node_id=NODE_ID, delta_rate_hz=CLUSTER_DELTA_RATE_HZ):
+        """
+        Shares presence and player movement with the other websocket_server nodes.
+
+        Local clients are served exactly as on a single node. Players connected
+        elsewhere are mirrored into `game_state` and the interest manager, so
+        the local world ticker fans them out like any other player. Local moves
+        are published once per delta tick as one batch per node, and messages
+        for players on other nodes are routed to the node holding them.
+
+        :param backplane: Backplane shared by the nodes
+        :param game_state: Shared game state holding the "players" dict
+        :param username_to_client: username -> websocket mapping of local clients
+        :param broadcaster: Broadcaster of the local clients
+        :param world_ticker: WorldTicker that sends worldDelta frames to local clients
+        :param interest: InterestManager of this node
+        :param session_ids: protocol.SessionIds, remote players get local ids as well
+        :param node_id: Unique name of this node
+        :param delta_rate_hz: Number of player delta batches published per second
+        """
+        self.backplane = backplane
+        self.game_state = game_state
+        self.username_to_client = username_to_client
+        self.broadcaster = broadcaster
+        self.world_ticker = world_ticker
+        self.interest = interest
+        self.session_ids = session_ids
+        self.node_id = node_id
+        self.node_channel = NODE_CHANNEL_PREFIX + node_id
+        self.delta_interval = 1.0 / delta_rate_hz
+        self.remote_players = {}  # username -> node id
+        self.node_players = {}    # node id -> set of usernames
+        self.last_seen = {}       # node id -> monotonic time of its last message
+        self.dirty = set()        # Local players moved since the last delta batch
+        self.local_battles = set()   # Players in a fight run by this node
+        self.remote_battles = {}     # username -> node id running the player's fight
+        self.on_leave = []        # callables(username) run when a remote player leaves
+        self.on_invalidate = []   # callables(username) run when a user document changed
+        self.on_event = []        # callables(username, event) run for events sent to a local player's node
+        self.localize = None      # callable(websocket, message) adapting a routed message to one local client
+
+    def is_online(self, username):
+        return username in self.username_to_client or username in self.remote_players
+
+    def node_of(self, username):
+        if username in self.username_to_client:
+            return self.node_id
+        return self.remote_players.get(username)
+
+    def in_battle(self, username):
+        """
+        Whether another node runs a fight of this player.
+
+        Starts are announced over the backplane, two nodes starting a fight for
+        the same player within one round trip can still both succeed.
+        """
+        return username in self.remote_battles
+
+    # Local events, called by the websocket server
+
+    def player_joined(self, username):
+        self._publish(PRESENCE_CHANNEL, {
+            "op": "join",
+            "username": username,
+            "state": self.game_state["players"].get(username)
+        })
+
+    def player_moved(self, username):
+        self.dirty.add(username)
+
+    def player_left(self, username):
+        self.dirty.discard(username)
+        self._publish(PRESENCE_CHANNEL, {"op": "leave", "username": username})
+
+    def battle_started(self, usernames):
+        self.local_battles.update(usernames)
+        self._publish(PRESENCE_CHANNEL, {"op": "battle_start", "players": list(usernames)})
+
+    def battle_finished(self, usernames):
+        self.local_battles.difference_update(usernames)
+        self._publish(PRESENCE_CHANNEL, {"op": "battle_end", "players": list(usernames)})
+
+    def invalidate(self, username):
+        """
+        Drop a changed user from the caches of every node.
+        """
+        for callback in self.on_invalidate:
+            callback(username)
+        self._publish(PRESENCE_CHANNEL, {"op": "invalidate", "username": username})
+
+    def publish_stats(self, stats):
+        self._publish(STATS_CHANNEL, {"op": "stats", "stats": stats})
+
+    def send_to(self, username, message):
+        """
+        Deliver a message to a player on any node.
+
+        :return: False if the player is not connected anywhere
+        """
+        websocket = self.username_to_client.get(username)
+        if websocket is not None:
+            self._deliver(websocket, message)
+            return True
+        node_id = self.remote_players.get(username)
+        if node_id is None:
+            return False
+        self._publish(NODE_CHANNEL_PREFIX + node_id, {"op": "deliver", "to": username, "message": message})
+        return True
+
+    def send_many(self, usernames, message):
+        """
+        Deliver a message to several players, serializing it once for the local ones.
+        """
+        local = []
+        for username in usernames:
+            websocket = self.username_to_client.get(username)
+            if websocket is not None:
+                local.append(websocket)
+            elif username in self.remote_players:
+                self.send_to(username, message)
+        self.broadcaster.send_many(local, message)
+
+    def send_event(self, username, event):
+        """
+        Run the on_event callbacks of the node holding a remote player.
+
+        Unlike send_to the event is handled by the server, not sent to the client.
+
+        :return: False if the player is not connected to another node
+        """
+        node_id = self.remote_players.get(username)
+        if node_id is None:
+            return False
+        self._publish(NODE_CHANNEL_PREFIX + node_id, {"op": "event", "to": username, "event": event})
+        return True
+
+    def _deliver(self, websocket, message):
+        if self.localize is not None:
+            message = self.localize(websocket, message)
+        self.broadcaster.send(websocket, message)
+
+    def _publish(self, channel, payload):
+        payload["node"] = self.node_id
+        asyncio.ensure_future(self.backplane.publish(channel, payload))
+
+    # Remote events
+
+    def _handle(self, channel, payload):
+        node_id = payload.get("node")
+        if node_id == self.node_id:
+            return
+        op = payload.get("op")
+        if node_id not in self.last_seen:
+            log.info("Cluster node joined: %s", node_id)
+            if op not in ("hello", "bye"):
+                # Seen again after a timeout, ask for its players
+                self._publish(NODE_CHANNEL_PREFIX + node_id, {"op": "hello"})
+        self.last_seen[node_id] = time.monotonic()
+
+        if channel == PLAYERS_CHANNEL:
+            for username, state in payload.get("players", {}).items():
+                self._mirror(node_id, username, state)
+        elif op == "join":
+            self._mirror(node_id, payload["username"], payload.get("state"))
+        elif op == "leave":
+            self._drop(payload["username"])
+        elif op == "hello":
+            # A new node asks for everybody's players
+            self._publish(NODE_CHANNEL_PREFIX + node_id, {
+                "op": "snapshot",
+                "players": self._local_players(),
+                "battles": list(self.local_battles)
+            })
+        elif op == "snapshot":
+            for username, state in payload.get("players", {}).items():
+                self._mirror(node_id, username, state)
+            for username in payload.get("battles", ()):
+                self.remote_battles[username] = node_id
+        elif op == "battle_start":
+            for username in payload.get("players", ()):
+                self.remote_battles[username] = node_id
+        elif op == "battle_end":
+            for username in payload.get("players", ()):
+                if self.remote_battles.get(username) == node_id:
+                    del self.remote_battles[username]
+        elif op == "invalidate":
+            for callback in self.on_invalidate:
+                callback(payload["username"])
+        elif op == "bye":
+            self._drop_node(node_id)
+        elif op == "deliver":
+            websocket = self.username_to_client.get(payload.get("to"))
+            if websocket is not None:
+                # Adapted by the node holding the client, which knows what it acknowledged
+                self._deliver(websocket, payload.get("message"))
+        elif op == "event":
+            if payload.get("to") in self.username_to_client:
+                for callback in self.on_event:
+                    callback(payload["to"], payload.get("event") or {})
+
+    def _mirror(self, node_id, username, state):
+        if username in self.username_to_client:
+            # Logged in here as well, the local connection wins
+            return
+        players = self.game_state["players"]
+        if self.remote_players.get(username) != node_id:
+            if username in self.remote_players:
+                self._drop(username)
+            self.remote_players[username] = node_id
+            self.node_players.setdefault(node_id, set()).add(username)
+            self.session_ids.assign(username)
+            state = state or {}
+            self.interest.join(username, state.get("x"), state.get("y"))
+        if state:
+            players[username] = state
+            self.world_ticker.mark_dirty(username)
+
+    def _drop(self, username):
+        node_id = self.remote_players.pop(username, None)
+        if node_id is None:
+            return
+        self.node_players.get(node_id, set()).discard(username)
+        self.world_ticker.discard(username)
+        self.interest.remove(username)
+        self.session_ids.release(username)
+        self.game_state["players"].pop(username, None)
+        for callback in self.on_leave:
+            callback(username)
+        self.broadcaster.broadcast({"type": "playerDisconnect", "username": username})
+
+    def _drop_node(self, node_id):
+        for username in list(self.node_players.pop(node_id, ())):
+            self._drop(username)
+        # Fights of a node that is gone will never report their end
+        for username in [name for name, node in self.remote_battles.items() if node == node_id]:
+            del self.remote_battles[username]
+        self.last_seen.pop(node_id, None)
+        log.info("Cluster node left: %s", node_id)
+
+    def _local_players(self):
+        players = self.game_state["players"]
+        return {username: players[username] for username in self.username_to_client if username in players}
+
+    def flush(self):
+        """
+        Publish the latest state of the local players that moved, as one batch.
+        """
+        if not self.dirty:
+            return
+        changed, self.dirty = self.dirty, set()
+        players = self.game_state["players"]
+        self._publish(PLAYERS_CHANNEL, {
+            "players": {username: players[username] for username in changed if username in players}
+        })
+
+    def stats(self):
+        return {
+            "node": self.node_id,
+            "nodes": len(self.last_seen),
+            "remote_players": len(self.remote_players),
+            "remote_battles": len(self.remote_battles),
+            "published": self.backplane.published,
+            "received": self.backplane.received
+        }
+
+    async def start(self):
+        await self.backplane.start(self._handle)
+        await self.backplane.subscribe(PRESENCE_CHANNEL, PLAYERS_CHANNEL, self.node_channel)
+        self._publish(PRESENCE_CHANNEL, {"op": "hello"})
+
+    async def stop(self):
+        await self.backplane.publish(PRESENCE_CHANNEL, {"op": "bye", "node": self.node_id})
+        await self.backplane.close()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_heartbeat = loop.time()
+        while True:
+            self.flush()
+            if loop.time() >= next_heartbeat:
+                next_heartbeat = loop.time() + CLUSTER_HEARTBEAT_INTERVAL
+                self._publish(PRESENCE_CHANNEL, {"op": "heartbeat"})
+                # Nodes that went silent crashed or lost their backplane connection
+                now = time.monotonic()
+                for node_id, seen in list(self.last_seen.items()):
+                    if now - seen > CLUSTER_NODE_TIMEOUT:
+                        self._drop_node(node_id)
+            await asyncio.sleep(self.delta_interval)
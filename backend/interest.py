@@ -0,0 +1,162 @@
+# interest.py
+
+import os
+
+# Area-of-interest configuration
+VIEW_RADIUS = float(os.environ.get('VIEW_RADIUS', 600))     # Distance in map pixels a player can see
+AOI_CELL_SIZE = float(os.environ.get('AOI_CELL_SIZE', 150))  # Side of a grid cell in map pixels
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class SpatialGrid:
+    def __init__(self, cell_size=AOI_CELL_SIZE):
+        """
+        Uniform grid over map coordinates for radius queries.
+
+        :param cell_size: Side length of a grid cell
+        """
+        self.cell_size = cell_size
+        self.cells = {}      # (cell_x, cell_y) -> set of player ids
+        self.positions = {}  # player id -> (x, y, cell)
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def update(self, player_id, x, y):
+        cell = self._cell(x, y)
+        previous = self.positions.get(player_id)
+        if previous and previous[2] != cell:
+            self._discard(player_id, previous[2])
+        if not previous or previous[2] != cell:
+            self.cells.setdefault(cell, set()).add(player_id)
+        self.positions[player_id] = (x, y, cell)
+
+    def remove(self, player_id):
+        previous = self.positions.pop(player_id, None)
+        if previous:
+            self._discard(player_id, previous[2])
+
+    def _discard(self, player_id, cell):
+        members = self.cells.get(cell)
+        if members is not None:
+            members.discard(player_id)
+            if not members:
+                del self.cells[cell]
+
+    def query(self, x, y, radius):
+        """
+        Return the ids of all players within `radius` of (x, y).
+        """
+        min_x, min_y = self._cell(x - radius, y - radius)
+        max_x, max_y = self._cell(x + radius, y + radius)
+        radius_sq = radius * radius
+        found = set()
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                for player_id in self.cells.get((cell_x, cell_y), ()):
+                    px, py, _ = self.positions[player_id]
+                    if (px - x) * (px - x) + (py - y) * (py - y) <= radius_sq:
+                        found.add(player_id)
+        return found
+
+
+class InterestManager:
+    def __init__(self, view_radius=VIEW_RADIUS, cell_size=AOI_CELL_SIZE):
+        """
+        Tracks which players every player can currently see.
+
+        Visibility is kept per viewer together with a reverse index, so a move
+        only touches the players around the mover instead of every client.
+
+        :param view_radius: Distance within which other players are visible
+        :param cell_size: Cell size of the underlying spatial grid
+        """
+        self.view_radius = view_radius
+        self.grid = SpatialGrid(cell_size)
+        self.visible = {}   # viewer -> set of players the viewer knows about
+        self.watchers = {}  # player -> set of viewers that know about the player
+
+    def nearby(self, player_id):
+        position = self.grid.positions.get(player_id)
+        if not position:
+            return set()
+        found = self.grid.query(position[0], position[1], self.view_radius)
+        found.discard(player_id)
+        return found
+
+    def join(self, player_id, x, y):
+        """
+        Place a new player and return the players it can see right away.
+
+        The players around it only learn about the newcomer on the next
+        update(), where it shows up as entered.
+        """
+        if _is_number(x) and _is_number(y):
+            self.grid.update(player_id, x, y)
+        self.visible[player_id] = set()
+        self.watchers.setdefault(player_id, set())
+        for other in self.nearby(player_id):
+            self._enter(player_id, other)
+        return set(self.visible[player_id])
+
+    def remove(self, player_id):
+        self.grid.remove(player_id)
+        for other in self.visible.pop(player_id, ()):
+            self.watchers.get(other, set()).discard(player_id)
+        for viewer in self.watchers.pop(player_id, ()):
+            self.visible.get(viewer, set()).discard(player_id)
+
+    def _enter(self, viewer, player_id):
+        self.visible[viewer].add(player_id)
+        self.watchers.setdefault(player_id, set()).add(viewer)
+
+    def _leave(self, viewer, player_id):
+        self.visible[viewer].discard(player_id)
+        self.watchers.get(player_id, set()).discard(viewer)
+
+    def update(self, positions):
+        """
+        Apply a batch of moves and work out what every affected viewer needs.
+
+        :param positions: player id -> (x, y) for the players that changed
+        :return: viewer -> (updated, entered, left) sets of player ids
+        """
+        for player_id, (x, y) in positions.items():
+            if player_id in self.visible and _is_number(x) and _is_number(y):
+                self.grid.update(player_id, x, y)
+
+        events = {}
+
+        def viewer_events(viewer):
+            if viewer not in events:
+                events[viewer] = (set(), set(), set())
+            return events[viewer]
+
+        for player_id in positions:
+            if player_id not in self.visible:
+                continue
+            near = self.nearby(player_id)
+
+            # The mover as a viewer of the players around it
+            for other in near - self.visible[player_id]:
+                self._enter(player_id, other)
+                viewer_events(player_id)[1].add(other)
+            for other in self.visible[player_id] - near:
+                self._leave(player_id, other)
+                viewer_events(player_id)[2].add(other)
+
+            # The mover as seen by the players around it
+            for viewer in near:
+                if player_id in self.visible[viewer]:
+                    viewer_events(viewer)[0].add(player_id)
+                else:
+                    self._enter(viewer, player_id)
+                    viewer_events(viewer)[1].add(player_id)
+            for viewer in self.watchers.get(player_id, set()) - near:
+                self._leave(viewer, player_id)
+                viewer_events(viewer)[2].add(player_id)
+
+        return events
@@ -0,0 +1,177 @@
+# launcher.py
+
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import time
+
+import backplane
+from backplane import LocalBroker, RespBackplane
+
+# Launcher configuration
+WEBSOCKET_WORKERS = int(os.environ.get('WEBSOCKET_WORKERS', os.cpu_count() or 1))  # Worker processes to fork
+WORKER_RESTART_DELAY = 1.0  # Seconds before a crashed worker is started again
+
+
+def run_worker(index, host, port, backplane_url):
+    """
+    Body of a forked worker: import the server fresh and serve until SIGTERM.
+
+    The server module is only imported here, after the fork, so database
+    clients and their threads are never shared between processes.
+    """
+    # Drop the launcher's signal setup, the worker installs its own
+    signal.set_wakeup_fd(-1)
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD, signal.SIGUSR1):
+        signal.signal(signum, signal.SIG_DFL)
+    asyncio.set_event_loop(None)
+
+    os.environ['NODE_ID'] = f"{socket.gethostname()}-w{index}"
+    os.environ['BACKPLANE_URL'] = backplane_url
+    # Each worker serves its own metrics endpoint, on consecutive ports
+    metrics_port = int(os.environ.get('METRICS_PORT', 9100))
+    if metrics_port:
+        os.environ['METRICS_PORT'] = str(metrics_port + index)
+    # The launcher imported backplane before the URL was known
+    backplane.BACKPLANE_URL = backplane_url
+    import websocket_server
+    websocket_server.main(host, port, reuse_port=True, listen_invalidations=index == 0)
+
+
+class Launcher:
+    def __init__(self, workers, host, port, backplane_url=None):
+        """
+        Forks websocket_server workers that share one port with SO_REUSEPORT.
+
+        Workers share presence over a backplane: an external one if a URL is
+        given, otherwise a LocalBroker on a Unix socket run by the launcher.
+        Crashed workers are restarted. SIGTERM is passed on to every worker,
+        which drains its clients and flushes player progress before exiting.
+
+        :param workers: Number of worker processes
+        :param host: Address the workers listen on
+        :param port: Port the workers share
+        :param backplane_url: redis:// or unix:// URL of an external backplane
+        """
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.external_backplane = backplane_url
+        self.socket_path = f"/tmp/ordinooki-backplane-{os.getpid()}.sock"
+        self.backplane_url = backplane_url or f"unix://{self.socket_path}"
+        self.pids = {}          # pid -> worker index
+        self.stats = {}         # node id -> (received at, latest stats of the worker)
+        self.stopping = False
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(index, self.host, self.port, self.backplane_url)
+            except BaseException as e:
+                print(f"Worker {index} failed: {e}")
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        self.pids[pid] = index
+        print(f"Started worker {index} (pid {pid})")
+
+    def reap(self):
+        """
+        Collect exited workers and restart the ones that were not asked to stop.
+        """
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.pids.clear()
+                return
+            if pid == 0:
+                return
+            index = self.pids.pop(pid, None)
+            if index is None:
+                continue
+            print(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}")
+            if not self.stopping:
+                asyncio.get_running_loop().call_later(WORKER_RESTART_DELAY, self.spawn, index)
+
+    def _collect_stats(self, channel, payload):
+        if payload.get("op") == "stats":
+            self.stats[payload["node"]] = (time.time(), payload["stats"])
+
+    def print_stats(self):
+        now = time.time()
+        for node_id, (received_at, stats) in sorted(self.stats.items()):
+            battles = stats.get("battles", {})
+            print(f"{node_id}: pid {stats.get('pid')}, {stats.get('clients', 0)} clients, "
+                  f"{stats.get('players', 0)} players, {battles.get('active_battles', 0)} battles, "
+                  f"{stats.get('dropped_frames', 0)} dropped frames ({now - received_at:.0f}s ago)")
+
+    async def run(self, broker_socket):
+        loop = asyncio.get_running_loop()
+        broker = None
+        if broker_socket is not None:
+            broker = await asyncio.start_unix_server(LocalBroker().handle, sock=broker_socket)
+
+        stop = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+        loop.add_signal_handler(signal.SIGCHLD, self.reap)
+        loop.add_signal_handler(signal.SIGUSR1, self.print_stats)
+
+        stats_backplane = RespBackplane(self.backplane_url)
+        await stats_backplane.start(self._collect_stats)
+        await stats_backplane.subscribe('ordinooki:stats')
+
+        for index in range(self.workers):
+            self.spawn(index)
+        await stop.wait()
+
+        # Let every worker drain its clients and flush progress, the broker stays up meanwhile
+        self.stopping = True
+        print("Stopping workers...")
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        while self.pids:
+            await asyncio.sleep(0.1)
+            self.reap()
+
+        self.print_stats()
+        await stats_backplane.close()
+        if broker:
+            broker.close()
+            os.unlink(self.socket_path)
+        print("All workers stopped.")
+
+    def start(self):
+        broker_socket = None
+        if not self.external_backplane:
+            # Bound before forking so workers can connect right away
+            broker_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            broker_socket.bind(self.socket_path)
+            broker_socket.listen(128)
+        asyncio.run(self.run(broker_socket))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run websocket_server on several cores.")
+    parser.add_argument('--workers', type=int, default=WEBSOCKET_WORKERS, help="number of worker processes")
+    parser.add_argument('--host', default=os.environ.get('WEBSOCKET_HOST', 'localhost'), help="listen address")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('WEBSOCKET_PORT', 6789)), help="listen port")
+    parser.add_argument('--backplane', default=None,
+                        help="redis:// or unix:// URL of a shared backplane, a local broker is started if omitted")
+    args = parser.parse_args()
+
+    Launcher(args.workers, args.host, args.port, args.backplane).start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# logger.py
+
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+
+# Logging configuration
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()                      # DEBUG, INFO, WARNING or ERROR
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', 0.25))      # Seconds between batched writes
+LOG_BUFFER_SIZE = int(os.environ.get('LOG_BUFFER_SIZE', 10000))             # Lines kept before the oldest are dropped
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+
+class AsyncLogger:
+    def __init__(self, level=LOG_LEVEL, stream=None, flush_interval=LOG_FLUSH_INTERVAL, max_buffer=LOG_BUFFER_SIZE):
+        """
+        Level-filtered logger that never writes on the event loop.
+
+        Records below the level are discarded before their message is
+        formatted. The rest are buffered and written in batches from a thread
+        by run(). Until run() is started, for instance during startup or in
+        scripts, records are written right away.
+
+        :param level: Minimum level name that is kept
+        :param stream: File object written to, stdout if None
+        :param flush_interval: Seconds between two batched writes
+        :param max_buffer: Buffered records before the oldest are dropped
+        """
+        self.level = LEVELS.get(level, LEVELS['INFO'])
+        self.stream = stream
+        self.flush_interval = flush_interval
+        self.buffer = deque(maxlen=max_buffer)
+        self.running = False
+        self.written = 0
+        self.dropped = 0
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, message, *args):
+        """
+        Queue a record, `message` is %-formatted with `args` when it is written.
+        """
+        if level < self.level:
+            return
+        if not self.running:
+            self._write([(time.time(), level, message, args)])
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((time.time(), level, message, args))
+
+    def debug(self, message, *args):
+        self.log(10, message, *args)
+
+    def info(self, message, *args):
+        self.log(20, message, *args)
+
+    def warning(self, message, *args):
+        self.log(30, message, *args)
+
+    def error(self, message, *args):
+        self.log(40, message, *args)
+
+    @staticmethod
+    def _format(record):
+        created, level, message, args = record
+        if args:
+            try:
+                message = message % args
+            except (TypeError, ValueError):
+                message = f"{message} {args}"
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))
+        return f"{stamp}.{int(created % 1 * 1000):03d} {LEVEL_NAMES[level]} {message}\n"
+
+    def _write(self, records):
+        stream = self.stream or sys.stdout
+        stream.write(''.join(self._format(record) for record in records))
+        stream.flush()
+        self.written += len(records)
+
+    def _take(self):
+        records = list(self.buffer)
+        self.buffer.clear()
+        return records
+
+    def flush(self):
+        """
+        Write every buffered record now, for shutdown.
+        """
+        records = self._take()
+        if records:
+            self._write(records)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.running = True
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                records = self._take()
+                if records:
+                    # Formatting and the write itself happen off the loop
+                    await loop.run_in_executor(None, self._write, records)
+        finally:
+            self.running = False
+            self.flush()
+
+
+# Process wide logger
+log = AsyncLogger()
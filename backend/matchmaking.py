@@ -0,0 +1,246 @@
+# matchmaking.py
+
+import asyncio
+import os
+import time
+from array import array
+from collections import OrderedDict
+
+from battle_logic import CRITICAL_MULTIPLIER
+
+# Rating configuration (Elo)
+DEFAULT_RATING = 1500.0                                       # Rating of a player that never fought ranked
+RATING_K_FACTOR = float(os.environ.get('RATING_K_FACTOR', 32))  # Largest rating change of one fight
+
+# Matchmaking configuration
+RATING_BUCKET = 100            # Rating points per index bucket
+POWER_BUCKET = 50              # Power score points per index bucket
+MATCH_RATING_WINDOW = 100      # Rating difference accepted right after joining the queue
+MATCH_POWER_WINDOW = 50        # Power score difference accepted right after joining the queue
+MATCH_RATING_WIDEN = 50        # Rating window growth per widening step
+MATCH_POWER_WIDEN = 25         # Power window growth per widening step
+MATCH_MAX_RATING_WINDOW = 600  # Rating window after waiting long enough
+MATCH_MAX_POWER_WINDOW = 300   # Power window after waiting long enough
+MATCH_WIDEN_INTERVAL = float(os.environ.get('MATCH_WIDEN_INTERVAL', 5))  # Seconds of waiting per widening step
+MATCH_INTERVAL = float(os.environ.get('MATCH_INTERVAL', 1))              # Seconds between pairing rounds
+MATCH_PROBE = 4                # Tickets looked at per bucket before moving on
+
+
+def expected_score(rating, opponent_rating):
+    """
+    Chance of `rating` beating `opponent_rating`, a draw counting half.
+    """
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / 400.0))
+
+
+def rate(rating1, rating2, score1, k=RATING_K_FACTOR):
+    """
+    Ratings of two players after a fight.
+
+    :param score1: 1 if the first player won, 0.5 for a draw, 0 if it lost
+    :return: (new rating1, new rating2)
+    """
+    delta = k * (score1 - expected_score(rating1, rating2))
+    return rating1 + delta, rating2 - delta
+
+
+_power_tables = {}  # catalog source hash -> power score per entry
+
+
+def power_table(catalog):
+    """
+    Power score of every catalog entry, computed once per catalog.
+
+    Damage is Attack minus the opponent's Defense, so an Ordinooki is scored
+    by the expected damage of its hits times the hits it survives, both
+    against the average Ordinooki of the catalog.
+    """
+    table = _power_tables.get(catalog.source_hash)
+    if table is not None:
+        return table
+
+    count = len(catalog) or 1
+    average_defense = sum(catalog.defense) / count
+    average_hit = sum(catalog.attack) / count * (1 + sum(catalog.critical_chance) / count * (CRITICAL_MULTIPLIER - 1))
+    table = array('f')
+    for index in range(len(catalog)):
+        damage = max(catalog.attack[index] - average_defense, 0)
+        damage *= 1 + catalog.critical_chance[index] * (CRITICAL_MULTIPLIER - 1)
+        hits_survived = catalog.hp[index] / max(average_hit - catalog.defense[index], 1)
+        table.append(damage * hits_survived)
+    _power_tables.clear()
+    _power_tables[catalog.source_hash] = table
+    return table
+
+
+class MatchTicket:
+    __slots__ = ('username', 'rating', 'power', 'joined_at', 'step', 'key')
+
+    def __init__(self, username, rating, power, joined_at, key):
+        """
+        A player waiting in the matchmaking queue.
+
+        :param rating: Rating of the player
+        :param power: Power score of the player's selected Ordinooki
+        :param joined_at: time.monotonic() when the player joined
+        :param key: (rating bucket, power bucket) the ticket is indexed under
+        """
+        self.username = username
+        self.rating = rating
+        self.power = power
+        self.joined_at = joined_at
+        self.step = 0  # Widening step of the last search
+        self.key = key
+
+
+class MatchQueue:
+    def __init__(self, rating_bucket=RATING_BUCKET, power_bucket=POWER_BUCKET, widen_interval=MATCH_WIDEN_INTERVAL,
+                 interval=MATCH_INTERVAL):
+        """
+        Players waiting for an automatic opponent, indexed by rating and power score.
+
+        Tickets live in a grid of (rating, power) buckets, oldest first in
+        each bucket. A search only looks at the buckets covering the player's
+        windows and a few tickets per bucket, so its cost depends on the
+        window sizes and not on how many players wait. Windows widen every
+        `widen_interval` seconds a player waits, a waiting player is only
+        searched for again when its windows grew, new players search once when
+        they join.
+
+        :param rating_bucket: Rating points per bucket
+        :param power_bucket: Power score points per bucket
+        :param widen_interval: Seconds of waiting per widening step
+        :param interval: Seconds between pairing rounds in run()
+        """
+        self.rating_bucket = rating_bucket
+        self.power_bucket = power_bucket
+        self.widen_interval = widen_interval
+        self.interval = interval
+        self.buckets = {}             # (rating bucket, power bucket) -> OrderedDict username -> MatchTicket
+        self.tickets = OrderedDict()  # username -> MatchTicket, oldest first
+        self.matched = 0
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def __contains__(self, username):
+        return username in self.tickets
+
+    def _key(self, rating, power):
+        return int(rating // self.rating_bucket), int(power // self.power_bucket)
+
+    def add(self, username, rating, power, now=None):
+        """
+        Queue a player, replacing its previous ticket, and return the new ticket.
+        """
+        self.remove(username)
+        ticket = MatchTicket(username, rating, power, time.monotonic() if now is None else now,
+                             self._key(rating, power))
+        self.tickets[username] = ticket
+        self.buckets.setdefault(ticket.key, OrderedDict())[username] = ticket
+        return ticket
+
+    def remove(self, username):
+        """
+        Take a player out of the queue, returning its ticket or None.
+        """
+        ticket = self.tickets.pop(username, None)
+        if ticket is None:
+            return None
+        bucket = self.buckets[ticket.key]
+        del bucket[username]
+        if not bucket:
+            del self.buckets[ticket.key]
+        return ticket
+
+    def _step(self, ticket, now):
+        return int((now - ticket.joined_at) // self.widen_interval)
+
+    def windows(self, ticket, now=None):
+        """
+        Return the (rating, power) differences `ticket` accepts after its wait so far.
+        """
+        step = self._step(ticket, time.monotonic() if now is None else now)
+        return (min(MATCH_RATING_WINDOW + step * MATCH_RATING_WIDEN, MATCH_MAX_RATING_WINDOW),
+                min(MATCH_POWER_WINDOW + step * MATCH_POWER_WIDEN, MATCH_MAX_POWER_WINDOW))
+
+    def find(self, ticket, now=None):
+        """
+        Return the closest waiting opponent within the windows of `ticket`, None if there is none.
+        """
+        rating_window, power_window = self.windows(ticket, now)
+        low = self._key(ticket.rating - rating_window, ticket.power - power_window)
+        high = self._key(ticket.rating + rating_window, ticket.power + power_window)
+        best = None
+        best_distance = 2.0
+        for rating_key in range(low[0], high[0] + 1):
+            for power_key in range(low[1], high[1] + 1):
+                bucket = self.buckets.get((rating_key, power_key))
+                if not bucket:
+                    continue
+                probed = 0
+                for candidate in bucket.values():
+                    if probed == MATCH_PROBE:
+                        break
+                    if candidate is ticket:
+                        continue
+                    probed += 1
+                    rating_distance = abs(candidate.rating - ticket.rating) / rating_window
+                    power_distance = abs(candidate.power - ticket.power) / power_window
+                    if rating_distance > 1 or power_distance > 1:
+                        continue
+                    if rating_distance + power_distance < best_distance:
+                        best = candidate
+                        best_distance = rating_distance + power_distance
+        return best
+
+    def match(self, username, now=None):
+        """
+        Search an opponent for a waiting player and take both out of the queue if one is found.
+
+        :return: (ticket, opponent ticket) or None
+        """
+        ticket = self.tickets.get(username)
+        if ticket is None:
+            return None
+        opponent = self.find(ticket, now)
+        if opponent is None:
+            return None
+        self.remove(ticket.username)
+        self.remove(opponent.username)
+        self.matched += 1
+        return ticket, opponent
+
+    def pair(self, now=None):
+        """
+        Search again for every player whose windows widened since its last search, oldest first.
+
+        :return: List of matched (ticket, opponent ticket) pairs, already out of the queue
+        """
+        now = time.monotonic() if now is None else now
+        pairs = []
+        for ticket in list(self.tickets.values()):
+            if ticket.username not in self.tickets:
+                continue  # Matched earlier in this round
+            step = self._step(ticket, now)
+            if step == ticket.step:
+                continue
+            ticket.step = step
+            pair = self.match(ticket.username, now)
+            if pair is not None:
+                pairs.append(pair)
+        return pairs
+
+    def stats(self):
+        return {"waiting": len(self.tickets), "buckets": len(self.buckets), "matched": self.matched}
+
+    async def run(self, on_match):
+        """
+        Pair waiting players every `interval` seconds.
+
+        :param on_match: Coroutine function called as on_match(ticket, opponent) for every pair
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            for ticket, opponent in self.pair():
+                asyncio.ensure_future(on_match(ticket, opponent))
@@ -0,0 +1,321 @@
+# messages.py
+
+import json
+import math
+import os
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import protocol
+from logger import log
+from metrics import Counter, Histogram
+
+# Inbound frame limits
+MAX_FRAME_SIZE = int(os.environ.get('MAX_FRAME_SIZE', 4096))  # Bytes, larger frames are refused unparsed
+MAX_STRING_LENGTH = 64                                        # Characters allowed in a string field
+MAX_TOKEN_LENGTH = 2048                                       # Characters allowed in an auth token
+MAX_COORDINATE = 1e6                                          # Largest accepted absolute position
+MAX_SCALE = protocol.MAX_FIXED_SCALE / protocol.SCALE_FACTOR  # Largest sprite scale the binary format can carry
+
+MESSAGES_RECEIVED = Counter('ordinooki_messages_received_total', "Client messages received, per type", ('type',))
+MESSAGES_DROPPED = Counter('ordinooki_messages_dropped_total', "Client messages dropped unhandled, per type and reason",
+                           ('type', 'reason'))
+HANDLER_SECONDS = Histogram('ordinooki_handler_duration_seconds', "Time spent in a message handler, per type",
+                            ('type',))
+
+# JSON decoding, orjson when it is installed
+if orjson is not None:
+    _loads = orjson.loads
+else:
+    _loads = json.loads
+
+REQUIRED = object()
+
+
+class MessageError(ValueError):
+    def __init__(self, reason, detail=None, message_type=None):
+        """
+        A client frame that cannot be handled.
+
+        :param reason: Metrics label, 'oversized', 'malformed', 'invalid' or 'unknown'
+        :param detail: What was wrong, for the logs
+        :param message_type: Type of the message if it was known
+        """
+        super().__init__(detail or reason)
+        self.reason = reason
+        self.message_type = message_type
+
+
+def decode(frame, max_size=MAX_FRAME_SIZE):
+    """
+    Parse a JSON text frame into a dict. The size is checked before anything is decoded.
+    """
+    if len(frame) > max_size:
+        raise MessageError('oversized', f"{len(frame)} byte frame")
+    try:
+        data = _loads(frame)
+    except ValueError as e:
+        raise MessageError('malformed', str(e))
+    if not isinstance(data, dict):
+        raise MessageError('malformed', "frame is not an object")
+    return data
+
+
+def _number(value):
+    # bool is an int subclass, but true is not a coordinate
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise TypeError("expected a number")
+    return value
+
+
+def _integer(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError("expected an integer")
+    return value
+
+
+def _string(value):
+    if not isinstance(value, str):
+        raise TypeError("expected a string")
+    if len(value) > MAX_STRING_LENGTH:
+        raise TypeError("string too long")
+    return value
+
+
+def _token(value):
+    if not isinstance(value, str) or len(value) > MAX_TOKEN_LENGTH:
+        raise TypeError("expected a token")
+    return value
+
+
+def _boolean(value):
+    if not isinstance(value, bool):
+        raise TypeError("expected a boolean")
+    return value
+
+
+class Field:
+    __slots__ = ('key', 'attr', 'check', 'default')
+
+    def __init__(self, key, check, default=REQUIRED, attr=None):
+        """
+        One field of a message struct.
+
+        :param key: Key in the JSON object
+        :param check: Callable returning the value or raising TypeError
+        :param default: Value used when the key is missing or null, the field is required if omitted
+        :param attr: Attribute name on the struct, `key` if None
+        """
+        self.key = key
+        self.check = check
+        self.default = default
+        self.attr = attr or key
+
+
+class Message:
+    """
+    Base of the typed client messages. Subclasses set `type`, `fields` and
+    matching `__slots__`, unknown keys in the frame are ignored.
+    """
+
+    __slots__ = ()
+    type = None
+    fields = ()
+
+    @classmethod
+    def parse(cls, data):
+        message = cls.__new__(cls)
+        for field in cls.fields:
+            value = data.get(field.key)
+            if value is None:
+                if field.default is REQUIRED:
+                    raise MessageError('invalid', f"{cls.type}: missing {field.key}", cls.type)
+                value = field.default
+            else:
+                try:
+                    value = field.check(value)
+                except TypeError as e:
+                    raise MessageError('invalid', f"{cls.type}.{field.key}: {e}", cls.type)
+            setattr(message, field.attr, value)
+        return message
+
+
+class PlayerUpdate(Message):
+    __slots__ = ('x', 'y', 'animation', 'flip_x', 'scale')
+    type = "playerUpdate"
+    fields = (
+        Field('x', _number),
+        Field('y', _number),
+        Field('animation', _string, 'stand'),
+        Field('flipX', _boolean, False, attr='flip_x'),
+        Field('scale', _number, 1),
+    )
+
+    @classmethod
+    def parse(cls, data):
+        message = super().parse(data)
+        if abs(message.x) > MAX_COORDINATE or abs(message.y) > MAX_COORDINATE:
+            raise MessageError('invalid', "playerUpdate: position out of range", cls.type)
+        if not 0 <= message.scale <= MAX_SCALE:
+            raise MessageError('invalid', "playerUpdate: scale out of range", cls.type)
+        return message
+
+    def state(self):
+        """
+        The player entry stored in game_state["players"].
+        """
+        return {"x": self.x, "y": self.y, "animation": self.animation, "flipX": self.flip_x, "scale": self.scale}
+
+
+class ChallengeMessage(Message):
+    """
+    Challenge traffic between two players: request, accept, decline and cancel.
+    """
+
+    __slots__ = ('sender', 'target')
+    fields = (
+        Field('from', _string, attr='sender'),
+        Field('to', _string, attr='target'),
+    )
+
+
+class ChallengeRequest(ChallengeMessage):
+    __slots__ = ()
+    type = "challenge_request"
+
+
+class ChallengeAccept(ChallengeMessage):
+    __slots__ = ()
+    type = "challenge_accept"
+
+
+class ChallengeDecline(ChallengeMessage):
+    __slots__ = ()
+    type = "challenge_decline"
+
+
+class ChallengeCancel(ChallengeMessage):
+    __slots__ = ()
+    type = "challenge_cancel"
+
+
+class BattlePreview(Message):
+    __slots__ = ('target',)
+    type = "battle_preview"
+    fields = (Field('to', _string, attr='target'),)
+
+
+class BattleLogRequest(Message):
+    __slots__ = ('battle_id',)
+    type = "battle_log"
+    fields = (Field('battleId', _integer, attr='battle_id'),)
+
+
+class CatalogAck(Message):
+    __slots__ = ('version',)
+    type = "catalog_ack"
+    fields = (Field('version', _string),)
+
+
+class MatchmakingJoin(Message):
+    __slots__ = ()
+    type = "matchmaking_join"
+
+
+class MatchmakingLeave(Message):
+    __slots__ = ()
+    type = "matchmaking_leave"
+
+
+class Authenticate(Message):
+    __slots__ = ('token', 'protocol', 'resume', 'tick', 'catalog_version')
+    type = "authenticate"
+    fields = (
+        Field('token', _token),
+        Field('protocol', _string, protocol.PROTOCOL_JSON),
+        Field('resume', _string, None),
+        Field('tick', _integer, None),
+        Field('catalogVersion', _string, None, attr='catalog_version'),
+    )
+
+
+class Dispatcher:
+    def __init__(self):
+        """
+        Table of message handlers keyed by message type.
+
+        Handlers are registered with `on` and called as
+        handler(websocket, username, message) with the parsed struct. They may
+        be plain functions or coroutines. Frames that are too large, not JSON,
+        of an unknown type, failing their struct or over the sender's rate
+        limits are counted and dropped without reaching a handler.
+        """
+        self.handlers = {}  # message type -> (Message subclass, handler)
+
+    def on(self, message_class):
+        """
+        Decorator registering the handler of `message_class`.
+        """
+        def register(handler):
+            self.handlers[message_class.type] = (message_class, handler)
+            return handler
+        return register
+
+    def parse(self, frame):
+        """
+        Turn a text or binary frame into (message struct, handler).
+
+        :raises MessageError: The frame must be dropped
+        """
+        if isinstance(frame, bytes):
+            # Binary frames are always movement updates
+            data = protocol.decode_player_update(frame)
+            if data is None:
+                raise MessageError('malformed', "bad binary frame")
+        else:
+            data = decode(frame)
+
+        message_type = data.get("type", PlayerUpdate.type)
+        if not isinstance(message_type, str):
+            raise MessageError('malformed', "type must be a string")
+        entry = self.handlers.get(message_type)
+        if entry is None:
+            raise MessageError('unknown', f"unknown type {str(message_type)[:MAX_STRING_LENGTH]}")
+        message_class, handler = entry
+        return message_class.parse(data), handler
+
+    async def dispatch(self, websocket, username, frame, session=None):
+        """
+        Parse a frame and run its handler.
+
+        :param session: sessions.Session whose byte and per-type rate limits the frame is charged to, unlimited if None
+        """
+        if session is not None and not session.allow_bytes(len(frame)):
+            MESSAGES_DROPPED.inc('binary' if isinstance(frame, bytes) else 'text', 'rate_limited')
+            log.debug("Dropped message from %s: byte rate exceeded", username)
+            return
+        try:
+            message, handler = self.parse(frame)
+        except MessageError as e:
+            # A frame that failed before its type was known is labelled by its kind
+            message_type = e.message_type or ('binary' if isinstance(frame, bytes) else 'text')
+            MESSAGES_DROPPED.inc(message_type, e.reason)
+            log.debug("Dropped message from %s: %s", username, e)
+            return
+        if session is not None and not session.allow(message.type):
+            MESSAGES_DROPPED.inc(message.type, 'rate_limited')
+            log.debug("Dropped message from %s: %s rate exceeded", username, message.type)
+            return
+
+        MESSAGES_RECEIVED.inc(message.type)
+        started = time.perf_counter()
+        try:
+            result = handler(websocket, username, message)
+            if result is not None:
+                await result
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, message.type)
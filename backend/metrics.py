@@ -0,0 +1,172 @@
+# metrics.py
+
+import asyncio
+import bisect
+import math
+import os
+
+# Metrics endpoint configuration
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9100))  # 0 disables the endpoint
+
+# Histogram buckets in seconds, from sub-millisecond loop work to slow database calls
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Registry:
+    def __init__(self):
+        """
+        Collection of metrics rendered together in the Prometheus text format.
+        """
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        """
+        Monotonic count, optionally split by label values.
+
+        :param labels: Label names, inc() takes one value per name
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # label values -> count
+        registry.register(self)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        """
+        Distribution of observed values in cumulative buckets.
+
+        :param labels: Label names, observe() takes one value per name after the value
+        :param buckets: Increasing upper bounds, +Inf is added
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [per bucket counts..., +Inf count, sum]
+        registry.register(self)
+
+    def observe(self, value, *label_values):
+        state = self.values.get(label_values)
+        if state is None:
+            state = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        # Counts are stored per bucket and made cumulative when rendered
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def samples(self):
+        label_names = self.labels + ('le',)
+        for label_values, state in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                labels = _format_labels(label_names, label_values + (_format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {state[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CallbackMetric:
+    def __init__(self, name, help, callback, kind='gauge', labels=(), registry=REGISTRY):
+        """
+        Metric read from existing state when scraped, for values other objects already keep.
+
+        :param callback: Returns a number, or a dict of label values tuple -> number
+        :param kind: 'gauge' or 'counter'
+        """
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.kind = kind
+        self.labels = tuple(labels)
+        registry.register(self)
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+async def _handle_scrape(reader, writer, registry):
+    try:
+        request_line = await reader.readline()
+        # Headers are not needed, read up to the blank line
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status = '200 OK'
+            body = registry.render().encode('utf-8')
+        else:
+            status = '404 Not Found'
+            body = b'Not Found\n'
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT, registry=REGISTRY):
+    """
+    Serve GET /metrics over plain HTTP on the event loop. Returns the asyncio server.
+    """
+    return await asyncio.start_server(lambda reader, writer: _handle_scrape(reader, writer, registry), host, port)
@@ -0,0 +1,191 @@
+# ownership.py
+
+import argparse
+import datetime
+import os
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from logger import log
+from user_store import DATABASE_NAME, USERS_COLLECTION
+
+# Ownership index configuration
+OWNERS_COLLECTION = 'ordinooki_owners'  # ordinooki id -> owner, keyed by _id so each id has one owner
+BULK_CLAIM_BATCH_SIZE = 1000            # Ordinookis claimed per bulk write
+MAX_BULK_CLAIM = int(os.environ.get('MAX_BULK_CLAIM', 10000))  # Ordinookis one request may claim
+
+ILLEGAL_OPERATION = 20  # MongoDB error code of a transaction on a standalone server
+
+
+class OwnershipIndex:
+    def __init__(self, client, users, owners):
+        """
+        Unique ordinooki id -> owner mapping kept next to the user documents.
+
+        Claiming an Ordinooki is a keyed upsert on the owners collection plus
+        a $pull on the previous owner's document, instead of a scan over every
+        other user. Both writes run in one transaction where the deployment
+        supports it (replica set or mongos). On a standalone server they run
+        in sequence, index first, so the index stays authoritative.
+
+        :param client: MongoClient the collections belong to, used for sessions
+        :param users: The usuarios collection
+        :param owners: The ordinooki_owners collection
+        """
+        self.client = client
+        self.users = users
+        self.owners = owners
+        self.transactions = True
+
+    def ensure_indexes(self):
+        # _id is the ordinooki id and already unique, owners are looked up per user
+        self.owners.create_index([('owner', ASCENDING)])
+
+    def _run(self, operation):
+        if self.transactions:
+            try:
+                with self.client.start_session() as session:
+                    return session.with_transaction(operation)
+            except OperationFailure as e:
+                if e.code != ILLEGAL_OPERATION:
+                    raise
+                log.warning("Transactions are not supported by this deployment, claiming without them.")
+                self.transactions = False
+        return operation(None)
+
+    def owner_of(self, ordinooki_id):
+        entry = self.owners.find_one({'_id': ordinooki_id}, {'owner': 1})
+        return entry['owner'] if entry else None
+
+    def claim(self, username, claimed_ids, selected_id=None):
+        """
+        Make `username` the owner of `claimed_ids` and add them to its user document.
+
+        :param claimed_ids: Ordinooki ids transferred to the user, taken from their previous owners
+        :param selected_id: Ordinooki to select, if any
+        :return: Usernames of the previous owners, whose documents changed as well
+        """
+        claimed_ids = list(dict.fromkeys(claimed_ids))
+
+        def operation(session):
+            if len(claimed_ids) == 1:
+                previous = self._claim_one(username, claimed_ids[0], session)
+            else:
+                previous = self._claim_many(username, claimed_ids, session)
+
+            update = {'$addToSet': {'ordinookiIds': {'$each': claimed_ids}}}
+            if selected_id:
+                update['$set'] = {'selected_ordinooki': selected_id}
+            self.users.update_one({'username': username}, update, session=session)
+
+            for owner, ids in previous.items():
+                self.users.update_one({'username': owner}, {'$pull': {'ordinookiIds': {'$in': ids}}}, session=session)
+                # A transferred Ordinooki can no longer be fought with by its previous owner
+                self.users.update_one(
+                    {'username': owner, 'selected_ordinooki': {'$in': ids}},
+                    {'$unset': {'selected_ordinooki': ''}},
+                    session=session
+                )
+            return set(previous)
+
+        return self._run(operation)
+
+    def _claim_one(self, username, ordinooki_id, session):
+        previous = self.owners.find_one_and_update(
+            {'_id': ordinooki_id},
+            {'$set': {'owner': username, 'claimed_at': datetime.datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if previous and previous['owner'] != username:
+            return {previous['owner']: [ordinooki_id]}
+        return {}
+
+    def _claim_many(self, username, ordinooki_ids, session):
+        """
+        Bulk claim for wallets importing many inscriptions: one query for the
+        current owners and one unordered bulk write per batch.
+        """
+        previous = {}
+        now = datetime.datetime.utcnow()
+        for start in range(0, len(ordinooki_ids), BULK_CLAIM_BATCH_SIZE):
+            batch = ordinooki_ids[start:start + BULK_CLAIM_BATCH_SIZE]
+            for entry in self.owners.find({'_id': {'$in': batch}, 'owner': {'$ne': username}}, session=session):
+                previous.setdefault(entry['owner'], []).append(entry['_id'])
+            self.owners.bulk_write([
+                UpdateOne({'_id': ordinooki_id}, {'$set': {'owner': username, 'claimed_at': now}}, upsert=True)
+                for ordinooki_id in batch
+            ], ordered=False, session=session)
+        return previous
+
+    def rebuild(self):
+        """
+        Fill the index from the users' Ordinookis, for existing databases.
+        Entries already in the index are kept. An unindexed id goes to the
+        user that has it selected, else to the first user found listing it.
+
+        :return: Number of entries added
+        """
+        self.ensure_indexes()
+        now = datetime.datetime.utcnow()
+        selected = (
+            (user['username'], user['selected_ordinooki'])
+            for user in self.users.find({'selected_ordinooki': {'$exists': True, '$ne': None}},
+                                        {'username': 1, 'selected_ordinooki': 1})
+        )
+        listed = (
+            (user['username'], ordinooki_id)
+            for user in self.users.find({'ordinookiIds.0': {'$exists': True}}, {'username': 1, 'ordinookiIds': 1})
+            for ordinooki_id in user['ordinookiIds']
+        )
+        added = 0
+        for entries in (selected, listed):
+            batch = []
+            for owner, ordinooki_id in entries:
+                batch.append(UpdateOne({'_id': ordinooki_id},
+                                       {'$setOnInsert': {'owner': owner, 'claimed_at': now}}, upsert=True))
+                if len(batch) == BULK_CLAIM_BATCH_SIZE:
+                    added += self._insert_missing(batch)
+                    batch = []
+            if batch:
+                added += self._insert_missing(batch)
+        return added
+
+    def _insert_missing(self, operations):
+        try:
+            return self.owners.bulk_write(operations, ordered=False).upserted_count
+        except BulkWriteError as e:
+            # Two users listing the same id race on the upsert, one of them wins
+            return e.details.get('nUpserted', 0)
+
+
+def create_ownership_index(client, database):
+    return OwnershipIndex(client, database[USERS_COLLECTION], database[OWNERS_COLLECTION])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the Ordinooki ownership index.")
+    parser.add_argument('--database', default=DATABASE_NAME, help="database holding the usuarios collection")
+    parser.add_argument('--rebuild', action='store_true', help="index the Ordinookis of existing users")
+    parser.add_argument('--owner', help="print the owner of an Ordinooki id")
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+
+    connection_string = os.environ.get('MONGODB_CONNECTION_STRING')
+    if not connection_string:
+        print("Please set the MONGODB_CONNECTION_STRING environment variable.")
+        exit(1)
+    client = MongoClient(connection_string)
+    index = create_ownership_index(client, client[args.database])
+
+    if args.rebuild:
+        print(f"Indexed {index.rebuild()} Ordinookis.")
+    if args.owner:
+        print(index.owner_of(args.owner))
+
+
+if __name__ == '__main__':
+    main()
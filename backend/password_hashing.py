@@ -0,0 +1,93 @@
+# password_hashing.py
+
+import os
+import threading
+from concurrent import futures
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing configuration
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', os.cpu_count() or 1))  # Processes deriving password hashes
+HASH_PENDING_PER_WORKER = int(os.environ.get('HASH_PENDING_PER_WORKER', 4))  # Hashes queued or running per process
+HASH_QUEUE_TIMEOUT = float(os.environ.get('HASH_QUEUE_TIMEOUT', 2))  # Seconds a request waits for a free slot
+HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT', 10))              # Seconds a single hash may take
+
+
+class HasherBusyError(Exception):
+    """
+    Every hashing slot stayed taken for the whole queue timeout, or the hash
+    did not finish within its timeout.
+    """
+
+
+class PasswordHasher:
+    def __init__(self, max_workers=HASH_WORKERS, max_pending=None, queue_timeout=HASH_QUEUE_TIMEOUT,
+                 timeout=HASH_TIMEOUT):
+        """
+        Password hashing and checking on a bounded process pool.
+
+        Key derivation is deliberately CPU-heavy, so it runs in other
+        processes and the request threads only wait for the result. At most
+        `max_pending` hashes are queued or running, further requests wait up
+        to `queue_timeout` for a slot and then fail with HasherBusyError
+        instead of piling up behind a burst. A hash that takes longer than
+        `timeout` fails with HasherBusyError as well.
+
+        The pool is started on first use in each process, so a hasher created
+        before a server forks its workers is never shared between them.
+
+        :param max_workers: Number of hashing processes
+        :param max_pending: Hashes queued or running at once, HASH_PENDING_PER_WORKER per process if None
+        :param queue_timeout: Seconds to wait for a free slot
+        :param timeout: Seconds to wait for one hash to finish
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending or max_workers * HASH_PENDING_PER_WORKER
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = futures.ProcessPoolExecutor(max_workers=self.max_workers)
+                self.pid = os.getpid()
+            return self.executor
+
+    def _run(self, func, *args):
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            self.rejected += 1
+            raise HasherBusyError("Password hashing is overloaded")
+        try:
+            future = self._executor().submit(func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        # The slot is held until the hash is done, even if the caller stops waiting
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except futures.TimeoutError:
+            self.timed_out += 1
+            raise HasherBusyError("Password hashing timed out")
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password)
+
+    def check(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def stats(self):
+        return {"workers": self.max_workers, "max_pending": self.max_pending, "rejected": self.rejected,
+                "timed_out": self.timed_out}
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None and self.pid == os.getpid():
+                self.executor.shutdown(wait=True)
+            self.executor = None
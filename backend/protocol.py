@@ -0,0 +1,143 @@
+# protocol.py
+
+import heapq
+import struct
+
+# Compact binary wire protocol for movement frames.
+#
+# Clients opt in by sending "protocol": "binary" along with their token. All
+# integers are little endian, coordinates are fixed point in tenths of a pixel
+# and scale is fixed point in hundredths.
+#
+# Client -> server movement (MSG_PLAYER_UPDATE):
+#   B type, i x, i y, B animation, B flags, H scale
+#
+# Server -> client world delta (MSG_WORLD_DELTA):
+#   B type, I tick, H players, H entered, H left
+#   players x (H session id, i x, i y, B animation, B flags, H scale)
+#   entered x (H session id, B name length, name bytes)
+#   left    x (H session id)
+
+PROTOCOL_JSON = 'json'
+PROTOCOL_BINARY = 'binary'
+
+MSG_PLAYER_UPDATE = 0x01
+MSG_WORLD_DELTA = 0x02
+
+COORD_SCALE = 10   # Coordinates are sent in tenths of a pixel
+SCALE_FACTOR = 100  # Sprite scale is sent in hundredths
+
+FLAG_FLIP_X = 0x01
+
+# Animation keys used by the game client, encoded by index
+ANIMATIONS = ('stand', 'walk', 'runUp', 'runDown')
+ANIMATION_INDEX = {name: index for index, name in enumerate(ANIMATIONS)}
+
+MOVE_STRUCT = struct.Struct('<BiiBBH')
+DELTA_HEADER_STRUCT = struct.Struct('<BIHHH')
+PLAYER_RECORD_STRUCT = struct.Struct('<HiiBBH')
+ENTERED_STRUCT = struct.Struct('<HB')
+LEFT_STRUCT = struct.Struct('<H')
+
+MAX_SESSION_ID = 0xFFFF
+MIN_FIXED_COORD = -0x80000000  # Range of the i coordinate fields
+MAX_FIXED_COORD = 0x7FFFFFFF
+MAX_FIXED_SCALE = 0xFFFF       # Range of the H scale field
+
+
+class SessionIds:
+    def __init__(self):
+        """
+        Small numeric ids handed out to players for the binary protocol.
+
+        Ids are reused after a player leaves, lowest first, so they stay
+        within the 16 bit field of the wire format.
+        """
+        self.ids = {}    # username -> session id
+        self.names = {}  # session id -> username
+        self.free = []   # heap of released ids
+        self.next_id = 1
+
+    def assign(self, username):
+        if username in self.ids:
+            return self.ids[username]
+        if self.free:
+            session_id = heapq.heappop(self.free)
+        elif self.next_id <= MAX_SESSION_ID:
+            session_id = self.next_id
+            self.next_id += 1
+        else:
+            raise RuntimeError("No free session ids left")
+        self.ids[username] = session_id
+        self.names[session_id] = username
+        return session_id
+
+    def release(self, username):
+        session_id = self.ids.pop(username, None)
+        if session_id is not None:
+            del self.names[session_id]
+            heapq.heappush(self.free, session_id)
+
+    def get(self, username):
+        return self.ids.get(username)
+
+
+def _to_fixed(value, factor, low, high):
+    # Clamped to the field's range, so no player state can make a record fail to pack
+    try:
+        return max(low, min(int(round(float(value) * factor)), high))
+    except (TypeError, ValueError):
+        return 0
+    except OverflowError:
+        return high if float(value) > 0 else low
+
+
+def decode_player_update(frame):
+    """
+    Decode a binary movement frame into the same dict a JSON playerUpdate yields.
+
+    :return: The message dict, or None if the frame is malformed
+    """
+    if len(frame) != MOVE_STRUCT.size or frame[0] != MSG_PLAYER_UPDATE:
+        return None
+    _, x, y, animation, flags, scale = MOVE_STRUCT.unpack(frame)
+    return {
+        "type": "playerUpdate",
+        "x": x / COORD_SCALE,
+        "y": y / COORD_SCALE,
+        "animation": ANIMATIONS[animation] if animation < len(ANIMATIONS) else ANIMATIONS[0],
+        "flipX": bool(flags & FLAG_FLIP_X),
+        "scale": scale / SCALE_FACTOR
+    }
+
+
+def encode_player_record(session_id, player):
+    """
+    Pack one player's state as a fixed-width record of a world delta frame.
+    """
+    return PLAYER_RECORD_STRUCT.pack(
+        session_id,
+        _to_fixed(player.get("x"), COORD_SCALE, MIN_FIXED_COORD, MAX_FIXED_COORD),
+        _to_fixed(player.get("y"), COORD_SCALE, MIN_FIXED_COORD, MAX_FIXED_COORD),
+        ANIMATION_INDEX.get(player.get("animation"), 0),
+        FLAG_FLIP_X if player.get("flipX") else 0,
+        _to_fixed(player.get("scale", 1), SCALE_FACTOR, 0, MAX_FIXED_SCALE)
+    )
+
+
+def encode_entered(session_id, username):
+    name = username.encode('utf-8')[:255]
+    return ENTERED_STRUCT.pack(session_id, len(name)) + name
+
+
+def encode_world_delta(tick, records, entered=(), left=()):
+    """
+    Assemble a world delta frame from pre-encoded parts.
+
+    :param tick: Server tick the delta belongs to
+    :param records: Encoded player records (see encode_player_record)
+    :param entered: Encoded entered entries (see encode_entered)
+    :param left: Session ids of players that left the view
+    """
+    header = DELTA_HEADER_STRUCT.pack(MSG_WORLD_DELTA, tick & 0xFFFFFFFF, len(records), len(entered), len(left))
+    return b''.join((header, *records, *entered, *(LEFT_STRUCT.pack(session_id) for session_id in left)))
@@ -0,0 +1,77 @@
+# resume.py
+
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+# Session resume configuration
+RESUME_TTL = float(os.environ.get('RESUME_TTL', 120))  # Seconds a dropped session can be resumed
+
+
+class ResumeRecord:
+    __slots__ = ('username', 'tick', 'visible', 'expires_at')
+
+    def __init__(self, username, tick, visible, expires_at):
+        """
+        What a dropped client last knew of the world.
+
+        :param tick: Last world tick sent to the client
+        :param visible: Players the client had in view
+        :param expires_at: time.monotonic() after which the session cannot be resumed
+        """
+        self.username = username
+        self.tick = tick
+        self.visible = visible
+        self.expires_at = expires_at
+
+
+class ResumeRegistry:
+    def __init__(self, ttl=RESUME_TTL):
+        """
+        One-time resume tokens handed out at authentication.
+
+        A live session holds a token. When the connection drops, the token is
+        suspended along with the client's last tick and view, and a reconnect
+        presenting it within `ttl` seconds can be sent only what it missed.
+        Tokens are single use, a resumed session receives a new one.
+
+        :param ttl: Seconds a suspended token stays valid
+        """
+        self.ttl = ttl
+        self.suspended = OrderedDict()  # token -> ResumeRecord, oldest first
+
+    @staticmethod
+    def issue():
+        return secrets.token_urlsafe(16)
+
+    def suspend(self, username, token, tick, visible):
+        """
+        Keep the state of a dropped session so it can be resumed.
+        """
+        self._expire()
+        self.suspended[token] = ResumeRecord(username, tick, visible, time.monotonic() + self.ttl)
+
+    def claim(self, token, username):
+        """
+        Take the record of a suspended token, once.
+
+        :return: The ResumeRecord, or None if the token is unknown, expired or not the user's
+        """
+        self._expire()
+        record = self.suspended.get(token)
+        if record is None or record.username != username:
+            return None
+        del self.suspended[token]
+        return record
+
+    def _expire(self):
+        now = time.monotonic()
+        while self.suspended:
+            token, record = next(iter(self.suspended.items()))
+            if record.expires_at > now:
+                break
+            del self.suspended[token]
+
+    def __len__(self):
+        return len(self.suspended)
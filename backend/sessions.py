@@ -0,0 +1,177 @@
+# sessions.py
+
+import os
+import time
+from collections.abc import Mapping
+
+# Inbound rate limits per connection, message type -> (messages per second, burst)
+MESSAGE_RATE_LIMITS = {
+    "playerUpdate": (15, 30),  # Movement, sent continuously while a player walks
+    "challenge_request": (1, 5),
+    "challenge_accept": (1, 5),
+    "challenge_decline": (1, 5),
+    "challenge_cancel": (1, 5),
+    "matchmaking_join": (0.5, 3),
+    "matchmaking_leave": (0.5, 3),
+    "battle_preview": (2, 5),
+    "battle_log": (2, 5),
+    "catalog_ack": (0.2, 2),
+}
+DEFAULT_MESSAGE_RATE = (5, 10)  # Message types without their own limit
+CLIENT_BYTE_RATE = int(os.environ.get('CLIENT_BYTE_RATE', 16384))    # Inbound bytes per second per connection
+CLIENT_BYTE_BURST = int(os.environ.get('CLIENT_BYTE_BURST', 65536))  # Inbound bytes a connection may send at once
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now=None):
+        """
+        Token bucket refilled continuously, starting full.
+
+        :param rate: Tokens added per second
+        :param burst: Most tokens the bucket holds
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, cost=1, now=None):
+        """
+        Take `cost` tokens if the bucket holds them, return False otherwise.
+        """
+        now = time.monotonic() if now is None else now
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens < cost:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - cost
+        return True
+
+
+class Session:
+    __slots__ = ('websocket', 'username', 'binary', 'catalog_version', 'resume_token', 'bytes', 'limits')
+
+    def __init__(self, websocket, username, binary=False, catalog_version=None, resume_token=None):
+        """
+        State of one client connection.
+
+        :param binary: The client negotiated the binary protocol for movement frames
+        :param catalog_version: Catalog bundle version the client holds, None if it has none
+        :param resume_token: Token the client can resume this session with after a drop
+        """
+        self.websocket = websocket
+        self.username = username
+        self.binary = binary
+        self.catalog_version = catalog_version
+        self.resume_token = resume_token
+        self.bytes = TokenBucket(CLIENT_BYTE_RATE, CLIENT_BYTE_BURST)
+        self.limits = {}  # message type -> TokenBucket, created on first use
+
+    def allow_bytes(self, size):
+        return self.bytes.take(size)
+
+    def allow(self, message_type):
+        bucket = self.limits.get(message_type)
+        if bucket is None:
+            rate, burst = MESSAGE_RATE_LIMITS.get(message_type, DEFAULT_MESSAGE_RATE)
+            bucket = self.limits[message_type] = TokenBucket(rate, burst)
+        return bucket.take()
+
+
+class _ClientsView(Mapping):
+    # username -> websocket
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def __getitem__(self, username):
+        return self.sessions[username].websocket
+
+    def __contains__(self, username):
+        return username in self.sessions
+
+    def __iter__(self):
+        return iter(self.sessions)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, username, default=None):
+        session = self.sessions.get(username)
+        return default if session is None else session.websocket
+
+
+class _UsernamesView(Mapping):
+    # websocket -> username
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def __getitem__(self, websocket):
+        return self.sessions[websocket].username
+
+    def __contains__(self, websocket):
+        return websocket in self.sessions
+
+    def __iter__(self):
+        return iter(self.sessions)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def items(self):
+        return ((websocket, session.username) for websocket, session in self.sessions.items())
+
+
+class _BinaryView:
+    # websockets that negotiated the binary protocol
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def __contains__(self, websocket):
+        session = self.sessions.get(websocket)
+        return session is not None and session.binary
+
+
+class SessionTable:
+    def __init__(self):
+        """
+        Every open connection of the process, by websocket and by username.
+
+        A connection's state lives on its Session only, so removing the
+        session frees all of it. Modules that only need one mapping get a
+        read-only view: `clients` (username -> websocket), `usernames`
+        (websocket -> username) and `binary` (websockets speaking the binary
+        protocol).
+        """
+        self.by_websocket = {}  # websocket -> Session
+        self.by_username = {}   # username -> Session
+        self.clients = _ClientsView(self.by_username)
+        self.usernames = _UsernamesView(self.by_websocket)
+        self.binary = _BinaryView(self.by_websocket)
+        self.on_remove = []  # callables(Session) run when a connection's session is dropped
+
+    def __len__(self):
+        return len(self.by_websocket)
+
+    def __iter__(self):
+        return iter(self.by_websocket.values())
+
+    def get(self, websocket):
+        return self.by_websocket.get(websocket)
+
+    def find(self, username):
+        return self.by_username.get(username)
+
+    def add(self, session):
+        self.by_websocket[session.websocket] = session
+        self.by_username[session.username] = session
+
+    def remove(self, session):
+        self.by_websocket.pop(session.websocket, None)
+        # A newer connection of the same player keeps its entry
+        if self.by_username.get(session.username) is session:
+            del self.by_username[session.username]
+        for callback in self.on_remove:
+            callback(session)
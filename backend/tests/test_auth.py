@@ -0,0 +1,112 @@
+# test_auth.py
+
+import os
+
+import pytest
+
+for module in ('flask', 'flask_cors', 'jwt', 'pymongo', 'werkzeug'):
+    pytest.importorskip(module)
+
+# No connection is opened at import, database() is replaced below
+os.environ.setdefault('MONGODB_CONNECTION_STRING', 'mongodb://localhost:27017')
+
+import jwt
+
+import auth
+from catalog import get_catalog
+from password_hashing import HasherBusyError
+from user_store import project
+
+
+class FakeUsers:
+    # find_one over a dict of user documents
+    def __init__(self, *users):
+        self.users = {user['username']: user for user in users}
+
+    def find_one(self, query, projection=None):
+        return project(self.users.get(query['username']), projection)
+
+
+class FakeDatabase:
+    def __init__(self, *users):
+        self.users = FakeUsers(*users)
+
+
+@pytest.fixture
+def owned_ids():
+    catalog = get_catalog()
+    return [catalog.ids[index] for index in range(5)]
+
+
+@pytest.fixture
+def client(monkeypatch, owned_ids):
+    database = FakeDatabase({'username': 'alice', 'ordinookiIds': owned_ids + ['unknown-id']})
+    monkeypatch.setattr(auth, 'database', lambda: database)
+    monkeypatch.setattr(auth, 'token_verifier', auth.TokenVerifier(auth.SECRET_KEY))
+    return auth.app.test_client()
+
+
+def headers(username='alice', **extra):
+    token = jwt.encode({'username': username}, auth.SECRET_KEY, algorithm='HS256')
+    return {'Authorization': f'Bearer {token}', **extra}
+
+
+def test_ordinookis_are_paged(client, owned_ids):
+    response = client.get('/api/ordinookis?offset=0&limit=2', headers=headers())
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [entry['id'] for entry in body['ordinookis']] == owned_ids[:2]
+    assert (body['total'], body['offset'], body['limit'], body['nextOffset']) == (6, 0, 2, 2)
+
+    last = client.get('/api/ordinookis?offset=4&limit=2', headers=headers()).get_json()
+    assert [entry['id'] for entry in last['ordinookis']] == owned_ids[4:]
+    assert last['missing'] == ['unknown-id']
+    assert last['nextOffset'] is None
+
+
+def test_ordinookis_projection(client, owned_ids):
+    body = client.get('/api/ordinookis?fields=stats&limit=1', headers=headers()).get_json()
+    assert set(body['ordinookis'][0]['meta']) == {'stats'}
+    assert client.get('/api/ordinookis?fields=secret', headers=headers()).status_code == 400
+    assert client.get('/api/ordinookis?limit=many', headers=headers()).status_code == 400
+
+
+def test_ordinookis_etag_revalidates(client):
+    first = client.get('/api/ordinookis?limit=2', headers=headers())
+    etag = first.headers['ETag']
+    assert etag
+
+    cached = client.get('/api/ordinookis?limit=2', headers=headers(**{'If-None-Match': etag}))
+    assert cached.status_code == 304
+    assert cached.headers['ETag'] == etag
+
+    # Another page or projection is another representation
+    other_page = client.get('/api/ordinookis?offset=2&limit=2', headers=headers(**{'If-None-Match': etag}))
+    assert other_page.status_code == 200 and other_page.headers['ETag'] != etag
+    other_fields = client.get('/api/ordinookis?limit=2&fields=name', headers=headers(**{'If-None-Match': etag}))
+    assert other_fields.status_code == 200
+
+
+def test_ordinookis_require_a_known_user(client):
+    assert client.get('/api/ordinookis').status_code == 401
+    assert client.get('/api/ordinookis', headers=headers('mallory')).status_code == 401
+
+
+class BusyHasher:
+    def hash(self, password):
+        raise HasherBusyError("Password hashing is overloaded")
+
+    def check(self, password_hash, password):
+        raise HasherBusyError("Password hashing is overloaded")
+
+
+def test_overloaded_hashing_answers_503(monkeypatch):
+    database = FakeDatabase({'username': 'alice', 'password_hash': 'hash'})
+    monkeypatch.setattr(auth, 'database', lambda: database)
+    monkeypatch.setattr(auth, 'password_hasher', BusyHasher())
+    client = auth.app.test_client()
+
+    for path in ('/register', '/login'):
+        response = client.post(path, json={'username': 'alice', 'password': 'hunter2'})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(auth.HASHING_RETRY_AFTER)
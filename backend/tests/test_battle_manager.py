@@ -0,0 +1,148 @@
+# test_battle_manager.py
+
+import asyncio
+
+import pytest
+
+from battle_manager import BattleManager, TimerWheel
+from battle_replay import DRAW, BattleLogWriter
+
+
+def advance(wheel, ticks):
+    # Items that became due on each of the next `ticks` advances
+    return [wheel.advance() for _ in range(ticks)]
+
+
+def test_timer_fires_after_its_delay():
+    wheel = TimerWheel(tick=0.1, slots=8)
+    wheel.schedule(0.3, 'a')
+    assert advance(wheel, 3) == [[], [], ['a']]
+    assert advance(wheel, 8) == [[]] * 8
+
+
+def test_delay_is_rounded_up_to_a_tick():
+    wheel = TimerWheel(tick=0.1, slots=8)
+    wheel.schedule(0, 'now')
+    wheel.schedule(0.25, 'later')
+    assert advance(wheel, 3) == [['now'], [], ['later']]
+
+
+def test_timers_beyond_one_rotation_wait_their_rounds():
+    wheel = TimerWheel(tick=1, slots=4)
+    wheel.schedule(2, 'short')
+    wheel.schedule(6, 'long')
+    wheel.schedule(10, 'longer')
+    fired = {}
+    for tick in range(1, 13):
+        for item in wheel.advance():
+            fired[item] = tick
+    assert fired == {'short': 2, 'long': 6, 'longer': 10}
+
+
+def test_timers_sharing_a_slot_fire_together():
+    wheel = TimerWheel(tick=1, slots=4)
+    wheel.schedule(1, 'a')
+    wheel.schedule(1, 'b')
+    assert sorted(wheel.advance()) == ['a', 'b']
+
+
+def ordinooki(ordinooki_id, hp=30, attack=20, defense=10, speed=5):
+    return {'id': ordinooki_id, 'meta': {'stats': {'HP': hp, 'Attack': attack, 'Defense': defense, 'Speed': speed}}}
+
+
+class FakeBroadcaster:
+    def __init__(self):
+        self.sent = []  # (websockets, message)
+
+    def send_many(self, websockets_, message, kind=None):
+        self.sent.append((list(websockets_), message))
+
+
+@pytest.fixture
+def manager(tmp_path):
+    clients = {name: f"ws-{name}" for name in ('alice', 'bob', 'carol', 'dave')}
+    manager = BattleManager(FakeBroadcaster(), clients, turn_interval=0.001, start_delay=0,
+                            log_writer=BattleLogWriter(str(tmp_path / 'battles.log')))
+    manager.wheel = TimerWheel(tick=0.001)
+    return manager
+
+
+def fight(manager, first='alice', second='bob', **stats):
+    return manager.start({'username': first, 'ordinooki': ordinooki('o1', **stats)},
+                         {'username': second, 'ordinooki': ordinooki('o2')})
+
+
+def events(manager):
+    return [event for _, message in manager.broadcaster.sent for event in message['events']]
+
+
+def test_a_player_fights_one_battle_at_a_time(manager):
+    assert fight(manager) == 1
+    assert manager.is_busy('alice') and manager.is_busy('bob')
+    assert fight(manager, 'carol', 'bob') is None
+    assert not manager.is_busy('carol')
+
+
+def test_a_fight_plays_out_on_the_wheel(manager):
+    finished = []
+    manager.on_finish.append(finished.append)
+    battle_id = fight(manager, speed=9)
+    while manager.is_busy('alice'):
+        for due in manager.wheel.advance():
+            manager._play(due)
+    manager.flush()
+
+    # Both need three hits of 10 damage, the faster one lands its third first
+    kinds = [event['event'] for event in events(manager)]
+    assert kinds == ['start'] + ['attack'] * 5 + ['result']
+    assert events(manager)[-1] == {"event": "result", "winner": 'alice', "outcome": "win"}
+    assert manager.broadcaster.sent[0][0] == ['ws-alice', 'ws-bob']
+    assert [log.battle_id for log in finished] == [battle_id]
+    assert manager.get_log(battle_id) is finished[0]
+
+
+def test_forfeit_frees_both_players(manager):
+    fight(manager)
+    manager.forfeit('bob')
+    manager.flush()
+    assert not manager.is_busy('alice') and not manager.is_busy('bob')
+    assert events(manager)[-1] == {"event": "result", "winner": 'alice', "outcome": "forfeit"}
+
+
+def test_failing_callback_does_not_skip_the_others(manager):
+    finished = []
+
+    def broken(battle_log):
+        raise RuntimeError("callback failed")
+
+    manager.on_finish.extend([broken, finished.append])
+    battle_id = fight(manager)
+    manager.forfeit('alice')
+    assert [log.battle_id for log in finished] == [battle_id]
+    assert manager.get_log(battle_id) is not None
+
+
+def test_a_failing_battle_does_not_stop_the_others(manager):
+    broken = fight(manager)
+    healthy = fight(manager, 'carol', 'dave')
+    play = manager._play
+
+    def failing_play(battle_id):
+        if battle_id == broken:
+            raise RuntimeError("bad turn")
+        play(battle_id)
+
+    manager._play = failing_play
+
+    async def scenario():
+        task = asyncio.ensure_future(manager.run())
+        for _ in range(1000):
+            if not manager.sessions:
+                break
+            await asyncio.sleep(0.001)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert manager.sessions == {} and manager.active_by_player == {}
+    assert manager.get_log(broken).outcome == DRAW
+    assert manager.get_log(healthy).outcome is not None
@@ -0,0 +1,78 @@
+# test_battle_odds.py
+
+import random
+
+import pytest
+
+from battle_logic import base_damage, critical_damage
+from battle_odds import hits_to_kill, predict, solve, stats_key
+
+
+def stats(hp, attack, defense, speed, chance=0.0):
+    return stats_key({'HP': hp, 'Attack': attack, 'Defense': defense, 'Speed': speed, 'Critical Chance': chance})
+
+
+def simulate(stats1, stats2, rng):
+    # One fight with the BattleSession rules, True if the first fighter wins
+    hp = [stats1[0], stats2[0]]
+    fighters = (stats1, stats2)
+    attacker = 0 if stats1[3] > stats2[3] else 1 if stats2[3] > stats1[3] else rng.randrange(2)
+    while True:
+        defender = 1 - attacker
+        damage = base_damage(fighters[attacker][1], fighters[defender][2])
+        if rng.random() < fighters[attacker][4]:
+            damage = critical_damage(damage)
+        hp[defender] -= damage
+        if hp[defender] <= 0:
+            return attacker == 0
+        attacker = defender
+
+
+def test_hits_to_kill_without_crits_is_certain():
+    assert hits_to_kill(10, 15, 0.0, 25) == (0.0, 0.0, 1.0)
+    assert hits_to_kill(0, 0, 0.5, 25) == ()
+
+
+def test_hits_to_kill_is_a_distribution():
+    pmf = hits_to_kill(10, 15, 0.3, 100)
+    assert sum(pmf) == pytest.approx(1.0)
+    assert len(pmf) == 10  # No crits at all needs ten hits
+
+
+def test_faster_fighter_wins_an_even_trade():
+    odds = solve(stats(30, 20, 10, 5), stats(30, 20, 10, 4))
+    assert odds == (1.0, 0.0, 0.0, 5.0)
+
+
+def test_speed_tie_is_a_coin_flip():
+    odds = solve(stats(30, 20, 10, 5), stats(30, 20, 10, 5))
+    assert odds.player1_win == pytest.approx(0.5)
+    assert odds.player2_win == pytest.approx(0.5)
+
+
+def test_nobody_deals_damage_is_a_draw():
+    odds = solve(stats(30, 5, 10, 5), stats(30, 5, 10, 4))
+    assert (odds.player1_win, odds.player2_win, odds.draw) == (0.0, 0.0, 1.0)
+
+
+def test_odds_are_symmetric():
+    first, second = stats(120, 30, 12, 7, 0.2), stats(100, 28, 8, 7, 0.35)
+    odds = solve(first, second)
+    mirrored = solve(second, first)
+    assert odds.player1_win + odds.player2_win + odds.draw == pytest.approx(1.0)
+    assert odds.player1_win == pytest.approx(mirrored.player2_win)
+    assert odds.expected_turns == pytest.approx(mirrored.expected_turns)
+
+
+def test_odds_match_simulated_fights():
+    first, second = stats(120, 30, 12, 7, 0.2), stats(100, 28, 8, 9, 0.35)
+    rng = random.Random(1)
+    trials = 20000
+    wins = sum(simulate(first, second, rng) for _ in range(trials))
+    assert solve(first, second).player1_win == pytest.approx(wins / trials, abs=0.02)
+
+
+def test_predict_reads_catalog_entries():
+    entry = {'meta': {'stats': {'HP': 30, 'Attack': 20, 'Defense': 10, 'Speed': 5}}}
+    weaker = {'meta': {'stats': {'HP': 10, 'Attack': 20, 'Defense': 10, 'Speed': 1}}}
+    assert predict(entry, weaker).player1_win == 1.0
@@ -0,0 +1,83 @@
+# test_battle_replay.py
+
+import asyncio
+
+from battle_logic import BattleSession, replay
+from battle_replay import DRAW, RECORD_STRUCT, BattleLog, BattleLogWriter, read_battle_logs
+
+
+def ordinooki(ordinooki_id, hp, attack, defense, speed, chance):
+    return {'id': ordinooki_id, 'meta': {'stats': {'HP': hp, 'Attack': attack, 'Defense': defense, 'Speed': speed,
+                                                   'Critical Chance': chance}}}
+
+
+FIRST = ordinooki('o1', 120, 30, 12, 7, 0.3)
+SECOND = ordinooki('o2', 100, 28, 8, 7, 0.4)
+
+
+def play(seed, battle_id=1):
+    session = BattleSession({'username': 'alice', 'ordinooki': FIRST}, {'username': 'bob', 'ordinooki': SECOND},
+                            None, seed)
+    session.log.battle_id = battle_id
+    session.begin()
+    while not session.play_turn():
+        pass
+    return session.log
+
+
+def test_records_are_fixed_width():
+    log = BattleLog(7, ('alice', 'bob'), ('o1', 'o2'))
+    log.first = 0
+    log.record(0, 22, True, 100, 78)
+    log.record(1, 20, False, 80, 78)
+    assert len(log.records) == 2 * RECORD_STRUCT.size
+    assert list(log) == [(0, 1, 22, 100, 78), (1, 0, 20, 80, 78)]
+    log.finish(0)
+    assert log.render() == ["alice starts the battle!", "alice attacks bob for 22 damage (Critical Hit!).",
+                            "bob attacks alice for 20 damage.", "alice Wins!"]
+
+
+def test_pack_round_trip():
+    log = play(seed=12345, battle_id=42)
+    restored, offset = BattleLog.unpack_from(log.pack())
+    assert offset == len(log.pack())
+    for slot in BattleLog.__slots__:
+        assert getattr(restored, slot) == getattr(log, slot), slot
+
+
+def test_forfeit_and_draw_survive_packing():
+    forfeited = BattleLog(1, ('alice', 'bob'), ('o1', 'o2'), battle_id=3)
+    forfeited.first = 1
+    forfeited.finish(0, forfeit=True)
+    drawn = BattleLog(2, ('carol', 'dave'), ('o3', 'o4'), battle_id=4)
+    drawn.first = 0
+    drawn.finish(DRAW)
+    data = forfeited.pack() + drawn.pack()
+
+    first, offset = BattleLog.unpack_from(data)
+    second, _ = BattleLog.unpack_from(data, offset)
+    assert (first.winner, first.forfeit, first.result_message()) == ('alice', True, "alice Wins! (bob left the battle)")
+    assert (second.winner, second.outcome, second.result_message()) == (None, DRAW, "It's a Draw!")
+
+
+def test_replay_reproduces_the_fight():
+    for seed in range(20):
+        log = play(seed)
+        replayed = replay(log, FIRST, SECOND)
+        assert replayed.records == log.records
+        assert (replayed.first, replayed.outcome) == (log.first, log.outcome)
+
+
+def test_writer_appends_and_reader_reads_back(tmp_path):
+    path = str(tmp_path / 'battles.log')
+    writer = BattleLogWriter(path)
+    logs = [play(seed, battle_id) for battle_id, seed in enumerate((5, 6, 7), 1)]
+    for log in logs[:2]:
+        writer.add(log)
+    asyncio.run(writer.flush())
+    writer.add(logs[2])
+    asyncio.run(writer.flush())
+
+    assert writer.written == 3 and writer.pending == []
+    assert [(log.battle_id, log.records) for log in read_battle_logs(path)] == \
+        [(log.battle_id, log.records) for log in logs]
@@ -0,0 +1,81 @@
+# test_broadcaster.py
+
+import asyncio
+
+from broadcaster import STALLED_CLOSE_CODE, Broadcaster
+
+
+class FakeWebSocket:
+    # Records sent frames, blocks in send() until `reading` is set
+    def __init__(self, reading=True):
+        self.sent = []
+        self.closed_with = None
+        self.reading = asyncio.Event()
+        if reading:
+            self.reading.set()
+
+    async def send(self, frame):
+        await self.reading.wait()
+        self.sent.append(frame)
+
+    async def close(self, code=1000, reason=''):
+        self.closed_with = code
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_frames_reach_clients_in_order():
+    async def scenario():
+        broadcaster = Broadcaster()
+        first, second = FakeWebSocket(), FakeWebSocket()
+        broadcaster.register(first)
+        broadcaster.register(second)
+        broadcaster.send(first, {"type": "hello"})
+        broadcaster.broadcast("raw frame", exclude=second)
+        broadcaster.send_many([first, second], {"type": "both"})
+        await settle()
+        return first.sent, second.sent
+
+    first, second = asyncio.run(scenario())
+    assert first == ['{"type": "hello"}', 'raw frame', '{"type": "both"}']
+    assert second == ['{"type": "both"}']
+
+
+def test_slow_client_is_backlogged_then_disconnected():
+    async def scenario():
+        broadcaster = Broadcaster(max_queue=4, queue_limit=8)
+        slow, fast = FakeWebSocket(reading=False), FakeWebSocket()
+        broadcaster.register(slow)
+        broadcaster.register(fast)
+        backlogged = []
+        for index in range(12):
+            broadcaster.broadcast({"type": "tick", "n": index})
+            backlogged.append(broadcaster.backlogged(slow))
+            await settle()
+        return broadcaster, slow, fast, backlogged
+
+    broadcaster, slow, fast, backlogged = asyncio.run(scenario())
+    # The writer holds one frame in send(), so the queue reaches 4 after the 5th frame
+    assert backlogged.index(True) == 4
+    assert slow.closed_with == STALLED_CLOSE_CODE
+    channel = broadcaster.channels[slow]
+    assert channel.closed and not channel.queue
+    assert channel.dropped > 0
+    assert not broadcaster.send(slow, {"type": "late"})
+    assert len(fast.sent) == 12 and fast.closed_with is None
+
+
+def test_unregister_stops_delivery():
+    async def scenario():
+        broadcaster = Broadcaster()
+        websocket = FakeWebSocket()
+        broadcaster.register(websocket)
+        broadcaster.unregister(websocket)
+        sent = broadcaster.send(websocket, {"type": "late"})
+        await settle()
+        return sent, websocket.sent
+
+    assert asyncio.run(scenario()) == (False, [])
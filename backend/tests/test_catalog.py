@@ -0,0 +1,104 @@
+# test_catalog.py
+
+import json
+import os
+
+import pytest
+
+import catalog
+from catalog import bundle_version, load_catalog
+
+ENTRIES = [
+    {'id': 'i0', 'meta': {'name': 'Nooki #0', 'attributes': [{'trait_type': 'Body', 'value': 'Red'}],
+                          'stats': {'HP': 100, 'Attack': 20, 'Defense': 5, 'Speed': 7, 'Critical Chance': 0.1,
+                                    'Special Attack': 'Flame'}}},
+    {'id': 'i1', 'meta': {'name': 'Nooki #1', 'attributes': [{'trait_type': 'Eyes', 'value': 'Blue'}],
+                          'stats': {'HP': 90, 'Attack': 25, 'Defense': 3, 'Speed': 9, 'Critical Chance': 0.2,
+                                    'Special Attack': 'Flame'}}},
+]
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'ordinooki.json'
+    path.write_text(json.dumps(ENTRIES))
+    return path
+
+
+@pytest.fixture
+def compiles(monkeypatch):
+    # Counts the catalogs compiled from JSON
+    calls = []
+    compile_catalog = catalog.compile_catalog
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return compile_catalog(*args, **kwargs)
+
+    monkeypatch.setattr(catalog, 'compile_catalog', counting)
+    return calls
+
+
+def touch(path, content=None):
+    if content is not None:
+        path.write_text(content)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_entries_round_trip(source, tmp_path):
+    loaded = load_catalog(str(source), str(tmp_path / 'cache'))
+    assert [loaded.get(entry['id']) for entry in ENTRIES] == ENTRIES
+    assert loaded.get('missing') is None
+    assert loaded.resolve(['i1', 'nope', 'i0']) == ([1, 0], ['nope'])
+    assert loaded.project(1, {'stats'})['meta'] == {'stats': ENTRIES[1]['meta']['stats']}
+
+
+def test_cache_is_reused_until_the_content_changes(source, tmp_path, compiles):
+    cache = str(tmp_path / 'cache')
+    first = load_catalog(str(source), cache)
+    assert load_catalog(str(source), cache).source_hash == first.source_hash
+    assert len(compiles) == 1
+
+    # Touched but unchanged: the hash matches and nothing is compiled
+    touch(source)
+    assert load_catalog(str(source), cache).source_hash == first.source_hash
+    assert len(compiles) == 1
+
+    touch(source, json.dumps(ENTRIES[:1]))
+    changed = load_catalog(str(source), cache)
+    assert len(compiles) == 2
+    assert len(changed) == 1 and changed.source_hash != first.source_hash
+    assert bundle_version(changed) != bundle_version(first)
+
+
+def test_get_catalog_picks_up_an_edited_source(source, tmp_path, compiles, monkeypatch):
+    monkeypatch.setattr(catalog, 'ORDINOOKI_JSON_PATH', str(source))
+    monkeypatch.setattr(catalog, 'CATALOG_CACHE_PATH', str(tmp_path / 'cache'))
+    monkeypatch.setattr(catalog, 'CATALOG_CHECK_INTERVAL', 0)
+    monkeypatch.setattr(catalog, '_catalog', None)
+    monkeypatch.setattr(catalog, '_catalog_fingerprint', None)
+    monkeypatch.setattr(catalog, '_bundle', None)
+
+    loaded = catalog.get_catalog()
+    assert catalog.get_catalog() is loaded
+    touch(source)
+    assert catalog.get_catalog() is loaded
+
+    touch(source, json.dumps(ENTRIES[:1]))
+    reloaded = catalog.get_catalog()
+    assert reloaded is not loaded and len(reloaded) == 1
+    assert catalog.get_bundle().version == bundle_version(reloaded)
+    assert len(compiles) == 2
+
+
+def test_get_catalog_checks_at_most_every_interval(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, 'ORDINOOKI_JSON_PATH', str(source))
+    monkeypatch.setattr(catalog, 'CATALOG_CACHE_PATH', str(tmp_path / 'cache'))
+    monkeypatch.setattr(catalog, 'CATALOG_CHECK_INTERVAL', 3600)
+    monkeypatch.setattr(catalog, '_catalog', None)
+    monkeypatch.setattr(catalog, '_catalog_fingerprint', None)
+
+    loaded = catalog.get_catalog()
+    touch(source, json.dumps(ENTRIES[:1]))
+    assert catalog.get_catalog() is loaded
@@ -0,0 +1,64 @@
+# test_challenge_routing.py
+
+import os
+
+import pytest
+
+pytest.importorskip('websockets')
+
+# Users are kept in memory, nothing is connected at import
+os.environ.setdefault('MONGODB_CONNECTION_STRING', 'memory://')
+
+import websocket_server  # noqa: E402
+from sessions import Session  # noqa: E402
+
+
+class FakeBroadcaster:
+    def __init__(self):
+        self.sent = []  # (websocket, message)
+
+    def send(self, websocket, message, kind=None):
+        self.sent.append((websocket, message))
+
+
+class FakeCluster:
+    def __init__(self):
+        self.events = []  # (username, event)
+        self.routed = []  # (username, message)
+
+    def send_event(self, username, event):
+        self.events.append((username, event))
+
+    def send_to(self, username, message):
+        self.routed.append((username, message))
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(websocket_server, 'broadcaster', FakeBroadcaster())
+    monkeypatch.setattr(websocket_server, 'challenges', websocket_server.ChallengeRegistry())
+    monkeypatch.setattr(websocket_server, 'cluster', FakeCluster())
+    return websocket_server
+
+
+def test_a_remote_challenge_is_shown_to_the_target(server):
+    session = Session('ws-bob', 'bob', False, None, None)
+    server.sessions.add(session)
+    try:
+        server.handle_cluster_event('bob', {"kind": "challenge_open", "from": 'alice', "ordinooki": 'o1', "ttl": 30})
+    finally:
+        server.sessions.remove(session)
+    assert server.challenges.get('alice', 'bob') is not None
+    [(websocket, message)] = server.broadcaster.sent
+    assert websocket == 'ws-bob' and message["type"] == "challenge_request"
+
+
+def test_a_remote_challenge_to_a_gone_target_is_rejected(server):
+    assert 'bob' not in server.sessions.clients
+    server.handle_cluster_event('bob', {"kind": "challenge_open", "from": 'alice', "ordinooki": 'o1', "ttl": 30})
+    # No phantom challenge, and the challenger's node is told to close its copy
+    assert server.challenges.get('alice', 'bob') is None
+    assert server.broadcaster.sent == []
+    assert server.cluster.events == [('alice', {"kind": "challenge_close", "from": 'alice', "to": 'bob'})]
+    [(username, message)] = server.cluster.routed
+    assert username == 'alice' and message["type"] == "challenge_response" and not message["success"]
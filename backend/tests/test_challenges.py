@@ -0,0 +1,80 @@
+# test_challenges.py
+
+import pytest
+
+from challenges import ChallengeError, ChallengeRegistry
+
+
+def test_add_indexes_both_sides():
+    registry = ChallengeRegistry(ttl=30)
+    challenge = registry.add('alice', 'bob', 'a1', now=0)
+    assert registry.get('alice', 'bob') is challenge
+    assert registry.by_target['bob'] == {'alice': challenge}
+    assert challenge.ttl(now=10) == 20
+
+
+@pytest.mark.parametrize('challenger, target, message', [
+    ('alice', 'alice', "yourself"),
+    ('alice', 'bob', "already challenged bob"),
+    ('bob', 'alice', "alice already challenged you"),
+])
+def test_check_refuses_duplicates(challenger, target, message):
+    registry = ChallengeRegistry()
+    registry.add('alice', 'bob', now=0)
+    with pytest.raises(ChallengeError, match=message):
+        registry.check(challenger, target)
+
+
+def test_limits_on_open_challenges():
+    registry = ChallengeRegistry(max_outgoing=2, max_incoming=2)
+    registry.add('alice', 'bob', now=0)
+    registry.add('alice', 'carol', now=0)
+    with pytest.raises(ChallengeError, match="at most 2"):
+        registry.add('alice', 'dave', now=0)
+    registry.add('erin', 'bob', now=0)
+    with pytest.raises(ChallengeError, match="too many"):
+        registry.add('frank', 'bob', now=0)
+
+
+def test_expire_returns_challenges_in_expiry_order():
+    registry = ChallengeRegistry(ttl=30)
+    registry.add('alice', 'bob', now=0)
+    registry.add('carol', 'dave', ttl=5, now=0)
+    registry.add('erin', 'frank', now=10)
+    assert registry.expire(now=4) == []
+    assert [challenge.challenger for challenge in registry.expire(now=30)] == ['carol', 'alice']
+    assert len(registry) == 1
+    assert registry.get('alice', 'bob') is None
+    assert registry.stats()["expired"] == 2
+
+
+def test_closed_challenges_never_expire():
+    registry = ChallengeRegistry(ttl=30)
+    registry.add('alice', 'bob', now=0)
+    registry.add('carol', 'bob', now=0)
+    assert registry.remove('alice', 'bob').challenger == 'alice'
+    assert registry.remove('alice', 'bob') is None
+    assert [challenge.challenger for challenge in registry.expire(now=60)] == ['carol']
+    assert registry.by_challenger == {} and registry.by_target == {}
+
+
+def test_remove_user_closes_both_directions():
+    registry = ChallengeRegistry()
+    registry.add('alice', 'bob', now=0)
+    registry.add('carol', 'alice', now=0)
+    registry.add('carol', 'bob', now=0)
+    removed = registry.remove_user('alice')
+    assert {(challenge.challenger, challenge.target) for challenge in removed} == {('alice', 'bob'),
+                                                                                   ('carol', 'alice')}
+    assert len(registry) == 1
+    assert registry.expire(now=10 ** 6)[0].target == 'bob'
+
+
+def test_timer_heap_is_compacted():
+    registry = ChallengeRegistry(max_outgoing=1000)
+    for index in range(200):
+        registry.add('alice', f'player{index}', now=0)
+    for index in range(200):
+        registry.remove('alice', f'player{index}')
+    assert len(registry) == 0
+    assert len(registry.timers) <= 64
@@ -0,0 +1,200 @@
+# test_cluster.py
+
+import asyncio
+
+from backplane import InMemoryBackplane, InMemoryHub
+from battle_manager import BattleManager, TimerWheel
+from battle_replay import BattleLogWriter
+from cluster import ClusterNode
+from interest import InterestManager
+from protocol import SessionIds
+
+
+class FakeBroadcaster:
+    def __init__(self):
+        self.sent = []  # (websocket, message)
+
+    def send(self, websocket, message, kind=None):
+        self.sent.append((websocket, message))
+
+    def send_many(self, websockets_, message, kind=None):
+        for websocket in websockets_:
+            self.send(websocket, message, kind)
+
+    def broadcast(self, message, kind=None):
+        self.sent.append((None, message))
+
+
+class FakeWorldTicker:
+    def __init__(self):
+        self.dirty = set()
+
+    def mark_dirty(self, username):
+        self.dirty.add(username)
+
+    def discard(self, username):
+        self.dirty.discard(username)
+
+
+def make_node(hub, node_id):
+    node = ClusterNode(InMemoryBackplane(hub), {"players": {}}, {}, FakeBroadcaster(), FakeWorldTicker(),
+                       InterestManager(), SessionIds(), node_id=node_id)
+    node.received = []
+    node.on_event.append(lambda username, event: node.received.append((username, event)))
+    return node
+
+
+def connect(node, username, x=10, y=20):
+    websocket = f"ws-{username}@{node.node_id}"
+    node.username_to_client[username] = websocket
+    node.game_state["players"][username] = {"x": x, "y": y}
+    node.player_joined(username)
+    return websocket
+
+
+async def settle():
+    # Publishing is scheduled, delivery happens on a later loop iteration
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def run(scenario):
+    async def main():
+        hub = InMemoryHub()
+        a, b = make_node(hub, 'a'), make_node(hub, 'b')
+        await a.start()
+        await b.start()
+        await settle()
+        await scenario(a, b)
+
+    asyncio.run(main())
+
+
+def test_players_are_mirrored_on_the_other_node():
+    async def scenario(a, b):
+        connect(a, 'alice')
+        await settle()
+        assert b.remote_players == {'alice': 'a'}
+        assert b.game_state["players"]['alice'] == {"x": 10, "y": 20}
+        assert 'alice' in b.world_ticker.dirty
+        assert b.is_online('alice') and b.node_of('alice') == 'a'
+
+        a.game_state["players"]['alice'] = {"x": 30, "y": 40}
+        a.player_moved('alice')
+        a.flush()
+        await settle()
+        assert b.game_state["players"]['alice'] == {"x": 30, "y": 40}
+
+        a.player_left('alice')
+        await settle()
+        assert not b.is_online('alice')
+        assert 'alice' not in b.game_state["players"]
+        assert (None, {"type": "playerDisconnect", "username": 'alice'}) in b.broadcaster.sent
+
+    run(scenario)
+
+
+def test_a_late_node_gets_a_snapshot():
+    async def main():
+        hub = InMemoryHub()
+        a = make_node(hub, 'a')
+        await a.start()
+        connect(a, 'alice')
+        await settle()
+
+        b = make_node(hub, 'b')
+        await b.start()
+        await settle()
+        assert b.remote_players == {'alice': 'a'}
+
+    asyncio.run(main())
+
+
+def test_send_to_routes_to_the_node_holding_the_player():
+    async def scenario(a, b):
+        websocket = connect(b, 'bob')
+        await settle()
+
+        assert a.send_to('bob', {"type": "hello"})
+        assert not a.send_to('nobody', {"type": "hello"})
+        await settle()
+        assert b.broadcaster.sent == [(websocket, {"type": "hello"})]
+        assert a.broadcaster.sent == []
+
+        assert a.send_event('bob', {"kind": "ping"})
+        await settle()
+        assert b.received == [('bob', {"kind": "ping"})]
+
+    run(scenario)
+
+
+def test_a_silent_node_loses_its_players():
+    async def scenario(a, b):
+        connect(a, 'alice')
+        await settle()
+        b._drop_node('a')
+        assert not b.is_online('alice')
+        assert 'alice' not in b.interest.visible
+
+    run(scenario)
+
+
+def battle_manager(node, tmp_path):
+    manager = BattleManager(node.broadcaster, node.username_to_client, start_delay=0, router=node,
+                            log_writer=BattleLogWriter(str(tmp_path / f'{node.node_id}.log')))
+    manager.wheel = TimerWheel(tick=0.001)
+    return manager
+
+
+def fighter(username):
+    stats = {'HP': 30, 'Attack': 20, 'Defense': 10, 'Speed': 5}
+    return {'username': username, 'ordinooki': {'id': username, 'meta': {'stats': stats}}}
+
+
+def test_a_player_fights_on_one_node_at_a_time(tmp_path):
+    async def scenario(a, b):
+        connect(a, 'alice')
+        connect(a, 'bob')
+        connect(b, 'carol')
+        await settle()
+        manager_a, manager_b = battle_manager(a, tmp_path), battle_manager(b, tmp_path)
+
+        assert manager_a.start(fighter('alice'), fighter('bob')) is not None
+        await settle()
+        assert manager_b.is_busy('alice')
+        assert manager_b.start(fighter('carol'), fighter('alice')) is None
+
+        manager_a.forfeit('bob')
+        await settle()
+        assert not manager_b.is_busy('alice')
+        assert manager_b.start(fighter('carol'), fighter('alice')) is not None
+
+    run(scenario)
+
+
+def test_fights_of_a_gone_node_free_their_players(tmp_path):
+    async def scenario(a, b):
+        manager_a = battle_manager(a, tmp_path)
+        manager_a.start(fighter('alice'), fighter('bob'))
+        await settle()
+        assert b.in_battle('alice')
+        b._drop_node('a')
+        assert not b.in_battle('alice') and not b.in_battle('bob')
+
+    run(scenario)
+
+
+def test_a_late_node_learns_the_running_fights(tmp_path):
+    async def main():
+        hub = InMemoryHub()
+        a = make_node(hub, 'a')
+        await a.start()
+        battle_manager(a, tmp_path).start(fighter('alice'), fighter('bob'))
+        await settle()
+
+        b = make_node(hub, 'b')
+        await b.start()
+        await settle()
+        assert b.in_battle('alice') and b.in_battle('bob')
+
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+# test_interest.py
+
+from interest import InterestManager, SpatialGrid
+
+
+def test_grid_query_uses_the_radius_not_the_cells():
+    grid = SpatialGrid(cell_size=10)
+    grid.update('near', 5, 5)
+    grid.update('corner', 14, 14)
+    grid.update('far', 40, 0)
+    assert grid.query(0, 0, 15) == {'near'}
+    assert grid.query(0, 0, 20) == {'near', 'corner'}
+
+
+def test_grid_moves_players_between_cells():
+    grid = SpatialGrid(cell_size=10)
+    grid.update('a', 1, 1)
+    grid.update('a', 25, 1)
+    assert grid.query(0, 0, 5) == set()
+    assert grid.query(25, 0, 5) == {'a'}
+    grid.remove('a')
+    assert grid.cells == {} and grid.positions == {}
+
+
+def test_join_sees_players_in_range():
+    interest = InterestManager(view_radius=100, cell_size=50)
+    interest.join('a', 0, 0)
+    interest.join('b', 1000, 0)
+    assert interest.join('c', 50, 0) == {'a'}
+    assert interest.watchers['a'] == {'c'}
+
+
+def test_update_reports_entered_updated_and_left():
+    interest = InterestManager(view_radius=100, cell_size=50)
+    interest.join('a', 0, 0)
+    interest.join('b', 500, 0)
+
+    # b walks into view of a: both see each other enter
+    events = interest.update({'b': (50, 0)})
+    assert events['a'] == (set(), {'b'}, set())
+    assert events['b'] == (set(), {'a'}, set())
+
+    # b moves within view: a gets an update
+    events = interest.update({'b': (60, 0)})
+    assert events['a'] == ({'b'}, set(), set())
+
+    # b walks away: both see each other leave
+    events = interest.update({'b': (500, 0)})
+    assert events['a'] == (set(), set(), {'b'})
+    assert events['b'] == (set(), set(), {'a'})
+    assert interest.visible == {'a': set(), 'b': set()}
+
+
+def test_remove_clears_both_indexes():
+    interest = InterestManager(view_radius=100, cell_size=50)
+    interest.join('a', 0, 0)
+    interest.join('b', 10, 0)
+    interest.update({'b': (20, 0)})
+    interest.remove('b')
+    assert interest.visible == {'a': set()}
+    assert 'b' not in interest.watchers
+    assert interest.watchers == {'a': set()}
+    assert interest.update({'b': (0, 0)}) == {}
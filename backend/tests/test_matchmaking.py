@@ -0,0 +1,65 @@
+# test_matchmaking.py
+
+import pytest
+
+from matchmaking import (DEFAULT_RATING, MATCH_MAX_POWER_WINDOW, MATCH_MAX_RATING_WINDOW, MATCH_POWER_WIDEN,
+                         MATCH_POWER_WINDOW, MATCH_RATING_WIDEN, MATCH_RATING_WINDOW, MatchQueue, expected_score, rate)
+
+
+def test_elo_is_zero_sum():
+    assert expected_score(DEFAULT_RATING, DEFAULT_RATING) == 0.5
+    winner, loser = rate(1500, 1500, 1, k=32)
+    assert (winner, loser) == (1516, 1484)
+    upset, favourite = rate(1300, 1700, 1, k=32)
+    assert upset - 1300 == pytest.approx(1700 - favourite)
+    assert upset - 1300 > 16
+
+
+def test_windows_widen_with_waiting_and_stop_growing():
+    queue = MatchQueue(widen_interval=5)
+    ticket = queue.add('alice', 1500, 200, now=0)
+    assert queue.windows(ticket, now=4.9) == (MATCH_RATING_WINDOW, MATCH_POWER_WINDOW)
+    assert queue.windows(ticket, now=5) == (MATCH_RATING_WINDOW + MATCH_RATING_WIDEN,
+                                            MATCH_POWER_WINDOW + MATCH_POWER_WIDEN)
+    assert queue.windows(ticket, now=10 ** 6) == (MATCH_MAX_RATING_WINDOW, MATCH_MAX_POWER_WINDOW)
+
+
+def test_find_picks_the_closest_opponent_within_the_windows():
+    queue = MatchQueue()
+    queue.add('far', 1500 + MATCH_RATING_WINDOW + 1, 200, now=0)
+    queue.add('close', 1520, 205, now=0)
+    queue.add('closer', 1505, 200, now=0)
+    ticket = queue.add('alice', 1500, 200, now=0)
+    assert queue.find(ticket, now=0).username == 'closer'
+
+
+def test_match_takes_both_players_out_of_the_queue():
+    queue = MatchQueue()
+    queue.add('bob', 1510, 210, now=0)
+    queue.add('alice', 1500, 200, now=0)
+    ticket, opponent = queue.match('alice', now=0)
+    assert (ticket.username, opponent.username) == ('alice', 'bob')
+    assert len(queue) == 0 and queue.buckets == {}
+    assert queue.match('alice', now=0) is None
+
+
+def test_pair_matches_once_the_windows_have_widened():
+    queue = MatchQueue(widen_interval=5)
+    queue.add('alice', 1500, 200, now=0)
+    queue.add('bob', 1500 + MATCH_RATING_WINDOW + MATCH_RATING_WIDEN, 200, now=0)
+    assert queue.match('bob', now=0) is None
+    assert queue.pair(now=4) == []
+    pairs = queue.pair(now=5)
+    assert [(ticket.username, opponent.username) for ticket, opponent in pairs] == [('alice', 'bob')]
+    assert queue.stats() == {"waiting": 0, "buckets": 0, "matched": 1}
+
+
+def test_rejoining_replaces_the_ticket():
+    queue = MatchQueue()
+    queue.add('alice', 1500, 200, now=0)
+    queue.add('alice', 1800, 400, now=1)
+    assert len(queue) == 1
+    assert queue.tickets['alice'].rating == 1800
+    assert len(queue.buckets) == 1
+    assert queue.remove('alice').power == 400
+    assert queue.remove('alice') is None
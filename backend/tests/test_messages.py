@@ -0,0 +1,45 @@
+# test_messages.py
+
+import json
+
+import pytest
+
+import protocol
+from messages import MAX_SCALE, Dispatcher, MessageError, PlayerUpdate
+
+
+def dispatcher():
+    messages = Dispatcher()
+    messages.on(PlayerUpdate)(lambda websocket, username, message: None)
+    return messages
+
+
+def test_parse_json_and_binary_movement():
+    messages = dispatcher()
+    message, _ = messages.parse(json.dumps({'type': 'playerUpdate', 'x': 1.5, 'y': -2, 'scale': 2}))
+    assert (message.x, message.y, message.scale, message.animation) == (1.5, -2, 2, 'stand')
+
+    frame = protocol.MOVE_STRUCT.pack(protocol.MSG_PLAYER_UPDATE, 15, -20, 0, protocol.FLAG_FLIP_X, 200)
+    message, _ = messages.parse(frame)
+    assert (message.x, message.y, message.flip_x, message.scale) == (1.5, -2, True, 2)
+
+
+@pytest.mark.parametrize('data, reason', [
+    ({'type': ['playerUpdate']}, 'malformed'),
+    ({'type': {'a': 1}}, 'malformed'),
+    ({'type': 'nope'}, 'unknown'),
+    ({'x': 'left', 'y': 0}, 'invalid'),
+    ({'x': 2e6, 'y': 0}, 'invalid'),
+    ({'x': 0, 'y': 0, 'scale': -1}, 'invalid'),
+    ({'x': 0, 'y': 0, 'scale': MAX_SCALE + 1}, 'invalid'),
+])
+def test_parse_rejects(data, reason):
+    with pytest.raises(MessageError) as error:
+        dispatcher().parse(json.dumps(data))
+    assert error.value.reason == reason
+
+
+def test_player_records_clamp_to_their_fields():
+    record = protocol.encode_player_record(1, {'x': 1e308, 'y': float('-inf'), 'scale': 1e9})
+    _, x, y, _, _, scale = protocol.PLAYER_RECORD_STRUCT.unpack(record)
+    assert (x, y, scale) == (protocol.MAX_FIXED_COORD, protocol.MIN_FIXED_COORD, protocol.MAX_FIXED_SCALE)
@@ -0,0 +1,140 @@
+# test_ownership.py
+
+import pytest
+
+pytest.importorskip('pymongo')
+
+from pymongo.errors import OperationFailure  # noqa: E402
+
+import ownership  # noqa: E402
+from ownership import OwnershipIndex  # noqa: E402
+
+
+class FakeUsers:
+    def __init__(self, *users):
+        self.users = {
+            user['username']: dict(user, ordinookiIds=list(user.get('ordinookiIds', ()))) for user in users
+        }
+
+    def update_one(self, query, update, session=None):
+        user = self.users.get(query['username'])
+        if user is None:
+            return
+        selected = query.get('selected_ordinooki')
+        if selected is not None and user.get('selected_ordinooki') not in selected['$in']:
+            return
+        for value in update.get('$addToSet', {}).get('ordinookiIds', {}).get('$each', ()):
+            if value not in user['ordinookiIds']:
+                user['ordinookiIds'].append(value)
+        pulled = update.get('$pull', {}).get('ordinookiIds', {}).get('$in', ())
+        user['ordinookiIds'] = [value for value in user['ordinookiIds'] if value not in pulled]
+        user.update(update.get('$set', {}))
+        for key in update.get('$unset', {}):
+            user.pop(key, None)
+
+
+class FakeOwners:
+    def __init__(self, owners=None):
+        self.entries = {
+            ordinooki_id: {'_id': ordinooki_id, 'owner': owner} for ordinooki_id, owner in (owners or {}).items()
+        }
+
+    def owners(self):
+        return {ordinooki_id: entry['owner'] for ordinooki_id, entry in self.entries.items()}
+
+    def find_one(self, query, projection=None):
+        entry = self.entries.get(query['_id'])
+        return dict(entry) if entry else None
+
+    def _set(self, ordinooki_id, fields):
+        self.entries.setdefault(ordinooki_id, {'_id': ordinooki_id}).update(fields)
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None, session=None):
+        before = self.entries.get(query['_id'])
+        before = dict(before) if before else None
+        self._set(query['_id'], update['$set'])
+        return before
+
+    def find(self, query, session=None):
+        return [dict(self.entries[ordinooki_id]) for ordinooki_id in query['_id']['$in']
+                if ordinooki_id in self.entries and self.entries[ordinooki_id]['owner'] != query['owner']['$ne']]
+
+    def bulk_write(self, operations, ordered=True, session=None):
+        for operation in operations:
+            self._set(operation._filter['_id'], operation._doc['$set'])
+
+
+class FakeSession:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def with_transaction(self, operation):
+        return operation(self)
+
+
+class FakeClient:
+    def __init__(self, transactions=True):
+        self.transactions = transactions
+        self.sessions = 0
+
+    def start_session(self):
+        if not self.transactions:
+            raise OperationFailure("Transaction numbers are only allowed on a replica set member or mongos",
+                                   code=ownership.ILLEGAL_OPERATION)
+        self.sessions += 1
+        return FakeSession()
+
+
+def make_index(owners=None, transactions=True):
+    users = FakeUsers(
+        {'username': 'alice', 'ordinookiIds': ['o1', 'o2'], 'selected_ordinooki': 'o1'},
+        {'username': 'bob', 'ordinookiIds': ['o3']},
+        {'username': 'carol'}
+    )
+    return OwnershipIndex(FakeClient(transactions), users, FakeOwners(owners))
+
+
+def test_claiming_a_new_ordinooki_has_no_previous_owner():
+    index = make_index()
+    assert index.claim('carol', ['o9'], selected_id='o9') == set()
+    assert index.owner_of('o9') == 'carol'
+    assert index.users.users['carol']['ordinookiIds'] == ['o9']
+    assert index.users.users['carol']['selected_ordinooki'] == 'o9'
+    assert index.client.sessions == 1
+
+
+def test_claim_transfers_from_the_previous_owner():
+    index = make_index({'o1': 'alice', 'o2': 'alice', 'o3': 'bob'})
+    assert index.claim('carol', ['o1']) == {'alice'}
+    alice = index.users.users['alice']
+    assert alice['ordinookiIds'] == ['o2']
+    # The transferred Ordinooki was alice's selected one
+    assert 'selected_ordinooki' not in alice
+    assert index.owner_of('o1') == 'carol'
+
+
+def test_bulk_claim_reports_every_previous_owner():
+    index = make_index({'o1': 'alice', 'o2': 'alice', 'o3': 'bob'})
+    assert index.claim('carol', ['o2', 'o3', 'o4', 'o3']) == {'alice', 'bob'}
+    assert index.owners.owners() == {'o1': 'alice', 'o2': 'carol', 'o3': 'carol', 'o4': 'carol'}
+    assert index.users.users['alice']['ordinookiIds'] == ['o1']
+    assert index.users.users['alice']['selected_ordinooki'] == 'o1'
+    assert index.users.users['bob']['ordinookiIds'] == []
+    assert index.users.users['carol']['ordinookiIds'] == ['o2', 'o3', 'o4']
+
+
+def test_reclaiming_an_owned_ordinooki_changes_nobody_else():
+    index = make_index({'o1': 'alice'})
+    assert index.claim('alice', ['o1']) == set()
+    assert index.claim('alice', ['o1', 'o2']) == set()
+    assert index.users.users['alice']['ordinookiIds'] == ['o1', 'o2']
+
+
+def test_standalone_servers_claim_without_transactions():
+    index = make_index({'o3': 'bob'}, transactions=False)
+    assert index.claim('carol', ['o3']) == {'bob'}
+    assert not index.transactions
+    assert index.claim('alice', ['o3']) == {'carol'}
@@ -0,0 +1,49 @@
+# test_password_hashing.py
+
+import threading
+from concurrent import futures
+
+import pytest
+
+pytest.importorskip('werkzeug')
+
+from password_hashing import HasherBusyError, PasswordHasher  # noqa: E402
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(max_workers=1, max_pending=1, queue_timeout=0.01, timeout=0.05)
+    yield hasher
+    hasher.close()
+
+
+def test_hash_and_check_round_trip():
+    hasher = PasswordHasher(max_workers=1)
+    try:
+        password_hash = hasher.hash('hunter2')
+        assert hasher.check(password_hash, 'hunter2')
+        assert not hasher.check(password_hash, 'hunter3')
+    finally:
+        hasher.close()
+
+
+def test_busy_when_every_slot_is_taken(hasher):
+    assert hasher.slots.acquire(blocking=False)
+    with pytest.raises(HasherBusyError):
+        hasher.hash('hunter2')
+    assert hasher.stats()['rejected'] == 1
+
+
+def test_a_slow_hash_times_out_and_keeps_its_slot(hasher, monkeypatch):
+    executor = futures.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(hasher, '_executor', lambda: executor)
+    done = threading.Event()
+    with pytest.raises(HasherBusyError):
+        hasher._run(done.wait)
+    assert hasher.stats()['timed_out'] == 1
+
+    # The slot is only freed once the hash really finished
+    assert not hasher.slots.acquire(blocking=False)
+    done.set()
+    executor.shutdown(wait=True)
+    assert hasher.slots.acquire(blocking=False)
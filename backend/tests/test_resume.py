@@ -0,0 +1,43 @@
+# test_resume.py
+
+import time
+
+from resume import ResumeRegistry
+
+
+def test_a_suspended_token_is_claimed_once():
+    registry = ResumeRegistry(ttl=60)
+    token = registry.issue()
+    registry.suspend('alice', token, 42, {'bob'})
+
+    record = registry.claim(token, 'alice')
+    assert (record.username, record.tick, record.visible) == ('alice', 42, {'bob'})
+    assert registry.claim(token, 'alice') is None
+    assert len(registry) == 0
+
+
+def test_a_token_only_resumes_its_own_user():
+    registry = ResumeRegistry(ttl=60)
+    token = registry.issue()
+    registry.suspend('alice', token, 1, set())
+    assert registry.claim(token, 'mallory') is None
+    assert registry.claim(token, 'alice') is not None
+
+
+def test_tokens_are_unique():
+    registry = ResumeRegistry()
+    assert len({registry.issue() for _ in range(100)}) == 100
+
+
+def test_expired_tokens_cannot_be_claimed(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    registry = ResumeRegistry(ttl=10)
+    registry.suspend('alice', 'old', 1, set())
+    now[0] += 5
+    registry.suspend('bob', 'new', 2, set())
+
+    now[0] += 6
+    assert registry.claim('old', 'alice') is None
+    assert len(registry) == 1
+    assert registry.claim('new', 'bob').tick == 2
@@ -0,0 +1,79 @@
+# test_sessions.py
+
+import gc
+import tracemalloc
+
+from sessions import Session, SessionTable, TokenBucket
+
+
+def test_bucket_starts_full_and_empties():
+    bucket = TokenBucket(rate=1, burst=3, now=0)
+    assert [bucket.take(now=0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2, burst=4, now=0)
+    assert bucket.take(4, now=0)
+    assert not bucket.take(now=0.25)
+    assert bucket.take(now=0.5)
+    assert not bucket.take(now=0.5)
+
+
+def test_bucket_never_holds_more_than_its_burst():
+    bucket = TokenBucket(rate=100, burst=5, now=0)
+    assert bucket.take(5, now=0)
+    assert not bucket.take(6, now=10 ** 6)
+    assert bucket.take(5, now=10 ** 6)
+
+
+def test_failed_take_keeps_the_refill():
+    bucket = TokenBucket(rate=1, burst=10, now=0)
+    assert bucket.take(10, now=0)
+    assert not bucket.take(3, now=2)
+    assert bucket.take(3, now=3)
+
+
+def churn(table, count):
+    for index in range(count):
+        session = Session(object(), f'player{index}')
+        table.add(session)
+        session.allow('playerUpdate')
+        session.allow_bytes(100)
+    for session in list(table):
+        table.remove(session)
+
+
+def test_session_churn_leaves_nothing_behind():
+    table = SessionTable()
+    churn(table, 1000)
+    assert len(table) == 0 and table.by_username == {}
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        churn(table, 1000)
+        gc.collect()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for _ in range(10):
+            churn(table, 1000)
+        gc.collect()
+        growth = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+    assert growth < 64 * 1024
+
+
+def test_removing_a_replaced_session_keeps_the_newer_one():
+    table = SessionTable()
+    old = Session(object(), 'alice')
+    new = Session(object(), 'alice')
+    removed = []
+    table.on_remove.append(removed.append)
+    table.add(old)
+    table.add(new)
+    table.remove(old)
+    # Per-connection state of the old one is dropped, whoever holds the username
+    assert removed == [old]
+    assert table.clients.get('alice') is new.websocket
+    assert old.websocket not in table.usernames
+    assert len(table) == 1
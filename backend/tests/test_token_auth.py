@@ -0,0 +1,114 @@
+# test_token_auth.py
+
+import asyncio
+import time
+
+import pytest
+
+jwt = pytest.importorskip('jwt')
+
+import token_auth
+from token_auth import TokenVerifier, UserNotFoundError
+
+SECRET = 'test-secret'
+
+
+def token(username='alice', expires_in=3600, **claims):
+    return jwt.encode({'username': username, 'exp': int(time.time() + expires_in), **claims}, SECRET,
+                      algorithm='HS256')
+
+
+class Users:
+    # user_exists callable counting its lookups
+    def __init__(self, *usernames):
+        self.usernames = set(usernames)
+        self.lookups = 0
+
+    def __call__(self, username):
+        self.lookups += 1
+        return username in self.usernames
+
+
+def test_verified_tokens_are_served_from_the_cache():
+    verifier = TokenVerifier(SECRET)
+    users = Users('alice')
+    signed = token()
+    assert verifier.verify(signed, users)['username'] == 'alice'
+    assert verifier.verify(signed, users)['username'] == 'alice'
+    assert users.lookups == 1
+    assert (verifier.stats['hits'], verifier.stats['misses']) == (1, 1)
+
+
+def test_cached_token_still_expires(monkeypatch):
+    verifier = TokenVerifier(SECRET)
+    signed = token(expires_in=60)
+    verifier.verify(signed, Users('alice'))
+
+    later = time.time() + 120
+    monkeypatch.setattr(token_auth.time, 'time', lambda: later)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verifier.verify(signed, Users('alice'))
+    assert signed not in verifier.verified
+
+
+def test_rejections_are_cached_until_their_ttl():
+    verifier = TokenVerifier(SECRET, negative_ttl=60)
+    users = Users()
+    signed = token()
+    for _ in range(3):
+        with pytest.raises(UserNotFoundError):
+            verifier.verify(signed, users)
+    assert users.lookups == 1
+    assert verifier.stats['negative_hits'] == 2
+
+
+def test_expired_rejection_is_checked_again(monkeypatch):
+    verifier = TokenVerifier(SECRET, negative_ttl=30)
+    users = Users()
+    signed = token()
+    with pytest.raises(UserNotFoundError):
+        verifier.verify(signed, users)
+
+    # The user registered meanwhile, the rejection only holds for its ttl
+    users.usernames.add('alice')
+    later = time.monotonic() + 31
+    monkeypatch.setattr(token_auth.time, 'monotonic', lambda: later)
+    assert verifier.verify(signed, users)['username'] == 'alice'
+    assert users.lookups == 2
+
+
+def test_bad_signatures_and_missing_usernames_are_rejected():
+    verifier = TokenVerifier(SECRET)
+    forged = jwt.encode({'username': 'alice'}, 'other-secret', algorithm='HS256')
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(forged, Users('alice'))
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(token(username=''), Users('alice'))
+    assert verifier.stats['rejections'] == 2
+
+
+def test_trusted_claims_skip_the_user_lookup():
+    verifier = TokenVerifier(SECRET, trust_claims=True)
+    users = Users()
+    assert verifier.verify(token(), users)['username'] == 'alice'
+    assert users.lookups == 0
+
+
+def test_verify_async_awaits_the_lookup():
+    verifier = TokenVerifier(SECRET)
+
+    async def user_exists(username):
+        return username == 'alice'
+
+    assert asyncio.run(verifier.verify_async(token(), user_exists))['username'] == 'alice'
+    with pytest.raises(UserNotFoundError):
+        asyncio.run(verifier.verify_async(token('bob'), user_exists))
+
+
+def test_cache_evicts_least_recently_used():
+    verifier = TokenVerifier(SECRET, max_entries=2)
+    users = Users('alice', 'bob', 'carol')
+    first, second, third = token('alice'), token('bob'), token('carol')
+    for signed in (first, second, first, third):
+        verifier.verify(signed, users)
+    assert list(verifier.verified) == [first, third]
@@ -0,0 +1,119 @@
+# test_user_cache.py
+
+import asyncio
+
+from user_cache import CachedUserStore, UserCache
+from user_store import InMemoryUserStore
+
+USERS = [
+    {'username': 'alice', 'selected_ordinooki': 'a1', 'ordinookiIds': ['a1', 'a2'], 'progress': {'x': 1, 'y': 2}},
+    {'username': 'bob', 'selected_ordinooki': 'b1', 'ordinookiIds': ['b1'], 'progress': {}},
+]
+
+
+class CountingStore(InMemoryUserStore):
+    # Counts the round trips that reach the store
+    def __init__(self, users=None):
+        super().__init__(users)
+        self.calls = 0
+
+    async def find_user(self, username, projection=None):
+        self.calls += 1
+        return await super().find_user(username, projection)
+
+    async def find_users(self, usernames, projection=None):
+        self.calls += 1
+        return await super().find_users(usernames, projection)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_cached_store_reads_through_once():
+    store = CountingStore(USERS)
+    cached = CachedUserStore(store)
+
+    async def scenario():
+        first = await cached.find_user('alice')
+        second = await cached.find_user('alice')
+        return first, second
+
+    first, second = run(scenario())
+    assert first == second == USERS[0]
+    assert store.calls == 1
+    assert (cached.cache.hits, cached.cache.misses) == (1, 1)
+
+
+def test_cached_store_applies_projection():
+    cached = CachedUserStore(InMemoryUserStore(USERS))
+
+    async def scenario():
+        missed = await cached.find_user('alice', {'selected_ordinooki': 1})
+        hit = await cached.find_user('alice', {'selected_ordinooki': 1})
+        many = await cached.find_users(['alice', 'bob'], {'selected_ordinooki': 1})
+        return missed, hit, many
+
+    missed, hit, many = run(scenario())
+    assert missed == hit == {'username': 'alice', 'selected_ordinooki': 'a1'}
+    assert many['bob'] == {'username': 'bob', 'selected_ordinooki': 'b1'}
+    # The cache still holds the full document
+    assert cached.cache.get('alice')['ordinookiIds'] == ['a1', 'a2']
+
+
+def test_cached_store_find_users_fetches_missing_only():
+    store = CountingStore(USERS)
+    cached = CachedUserStore(store)
+
+    async def scenario():
+        await cached.find_user('alice')
+        return await cached.find_users(['alice', 'bob', 'nobody'])
+
+    users = run(scenario())
+    assert set(users) == {'alice', 'bob'}
+    assert store.calls == 2
+
+
+def test_pending_progress_is_served_and_flushed():
+    store = InMemoryUserStore(USERS)
+    cached = CachedUserStore(store)
+
+    async def scenario():
+        await cached.find_user('alice')
+        cached.save_progress('alice', {'x': 7, 'y': 8})
+        served = await cached.find_user('alice', {'progress': 1})
+        await cached.flush()
+        return served
+
+    assert run(scenario())['progress'] == {'x': 7, 'y': 8}
+    assert store.users['alice']['progress'] == {'x': 7, 'y': 8}
+    assert cached.pending_progress == {}
+
+
+def test_update_invalidates_cache():
+    store = CountingStore(USERS)
+    cached = CachedUserStore(store)
+
+    async def scenario():
+        await cached.find_user('bob')
+        await cached.update_user('bob', {'$set': {'selected_ordinooki': 'b2'}})
+        return await cached.find_user('bob', {'selected_ordinooki': 1})
+
+    assert run(scenario())['selected_ordinooki'] == 'b2'
+    assert store.calls == 2
+
+
+def test_user_cache_evicts_least_recently_used():
+    cache = UserCache(max_entries=2)
+    cache.put('alice', USERS[0])
+    cache.put('bob', USERS[1])
+    cache.get('alice')
+    cache.put('carol', {'username': 'carol'})
+    assert list(cache.entries) == ['alice', 'carol']
+
+
+def test_user_cache_expires_entries():
+    cache = UserCache(ttl=-1)
+    cache.put('alice', USERS[0])
+    assert cache.get('alice') is None
+    assert 'alice' not in cache.entries
@@ -0,0 +1,94 @@
+# test_user_store.py
+
+import asyncio
+import json
+import threading
+
+from user_store import AsyncUserStore, InMemoryUserStore, create_user_store, project
+
+USERS = [
+    {'username': 'alice', 'selected_ordinooki': 'a1', 'ordinookiIds': ['a1', 'a2'], 'progress': {'x': 1, 'y': 2}},
+    {'username': 'bob', 'selected_ordinooki': 'b1', 'ordinookiIds': ['b1'], 'progress': {}},
+]
+
+
+class FakeCollection:
+    # The synchronous pymongo calls AsyncUserStore makes, recording the threads they run on
+    def __init__(self, users):
+        self.users = {user['username']: user for user in users}
+        self.threads = set()
+
+    def find_one(self, query, projection=None):
+        self.threads.add(threading.current_thread().name)
+        return project(self.users.get(query['username']), projection)
+
+    def find(self, query, projection=None):
+        self.threads.add(threading.current_thread().name)
+        return [project(self.users[username], projection) for username in query['username']['$in']
+                if username in self.users]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_project_keeps_username():
+    assert project(USERS[0], {'selected_ordinooki': 1}) == {'username': 'alice', 'selected_ordinooki': 'a1'}
+    assert project(USERS[0], None) is USERS[0]
+    assert project(None, {'progress': 1}) is None
+
+
+def test_in_memory_find_user_projects_and_copies():
+    store = InMemoryUserStore(USERS)
+    user = run(store.find_user('alice', {'progress': 1}))
+    assert user == {'username': 'alice', 'progress': {'x': 1, 'y': 2}}
+
+    user['progress']['x'] = 99
+    assert store.users['alice']['progress']['x'] == 1
+    assert run(store.find_user('nobody')) is None
+
+
+def test_in_memory_find_users_skips_unknown():
+    store = InMemoryUserStore(USERS)
+    users = run(store.find_users(['alice', 'bob', 'nobody'], {'selected_ordinooki': 1}))
+    assert users == {
+        'alice': {'username': 'alice', 'selected_ordinooki': 'a1'},
+        'bob': {'username': 'bob', 'selected_ordinooki': 'b1'},
+    }
+
+
+def test_in_memory_updates():
+    store = InMemoryUserStore(USERS)
+    run(store.update_user('alice', {'$set': {'rating': 1510.0}}))
+    run(store.bulk_set({'bob': {'progress': {'x': 5}}, 'nobody': {'progress': {}}}))
+    assert store.users['alice']['rating'] == 1510.0
+    assert store.users['bob']['progress'] == {'x': 5}
+    assert 'nobody' not in store.users
+
+
+def test_async_store_runs_queries_off_the_loop():
+    collection = FakeCollection(USERS)
+    store = AsyncUserStore(collection, max_workers=2)
+
+    async def scenario():
+        user = await store.find_user('alice', {'selected_ordinooki': 1})
+        users = await store.find_users(['alice', 'bob', 'nobody'], {'progress': 1})
+        return user, users
+
+    try:
+        user, users = run(scenario())
+    finally:
+        store.close()
+    assert user == {'username': 'alice', 'selected_ordinooki': 'a1'}
+    # find_users keys by username, so the projection keeps it
+    assert users == {'alice': {'username': 'alice', 'progress': {'x': 1, 'y': 2}},
+                     'bob': {'username': 'bob', 'progress': {}}}
+    assert collection.threads and all(name.startswith('mongo') for name in collection.threads)
+
+
+def test_memory_connection_string_seeds_the_store(tmp_path):
+    assert create_user_store('memory://').users == {}
+    seed = tmp_path / 'users.json'
+    seed.write_text(json.dumps(USERS))
+    store = create_user_store('memory://' + str(seed))
+    assert set(store.users) == {'alice', 'bob'}
@@ -0,0 +1,176 @@
+# test_world_tick.py
+
+import asyncio
+import json
+
+import protocol
+from interest import InterestManager
+from world_tick import WorldTicker
+
+
+class FakeBroadcaster:
+    # Collects the frames sent to every websocket, `slow` websockets report a backlog
+    def __init__(self):
+        self.frames = {}
+        self.slow = set()
+
+    def send(self, websocket, frame, kind=None):
+        self.frames.setdefault(websocket, []).append(frame)
+        return True
+
+    def backlogged(self, websocket):
+        return websocket in self.slow
+
+    def take(self, websocket):
+        return [json.loads(frame) for frame in self.frames.pop(websocket, [])]
+
+
+class World:
+    def __init__(self):
+        self.game_state = {"players": {}}
+        self.clients = {}  # websocket -> username
+        self.broadcaster = FakeBroadcaster()
+        self.interest = InterestManager(view_radius=100, cell_size=50)
+        self.session_ids = protocol.SessionIds()
+        self.ticker = WorldTicker(self.game_state, self.clients, self.broadcaster, self.interest, set(),
+                                  self.session_ids, history_ticks=5)
+
+    def join(self, username, x, y):
+        websocket = f"ws-{username}"
+        self.clients[websocket] = username
+        self.session_ids.assign(username)
+        self.game_state["players"][username] = {"x": x, "y": y}
+        self.interest.join(username, x, y)
+        self.ticker.mark_dirty(username)
+        return websocket
+
+    def move(self, username, x, y):
+        self.game_state["players"][username].update(x=x, y=y)
+        self.ticker.mark_dirty(username)
+
+
+def test_moves_in_a_tick_are_coalesced_into_one_delta():
+    world = World()
+    alice = world.join('alice', 0, 0)
+    world.join('bob', 50, 0)
+    world.ticker.flush()
+    assert world.broadcaster.take(alice)[0]["entered"] == ['bob']
+
+    world.move('bob', 60, 0)
+    world.move('bob', 70, 0)
+    world.ticker.flush()
+    deltas = world.broadcaster.take(alice)
+    assert len(deltas) == 1
+    assert deltas[0]["players"] == {'bob': {"x": 70, "y": 0, "username": 'bob'}}
+
+
+def test_quiet_ticks_send_nothing():
+    world = World()
+    alice = world.join('alice', 0, 0)
+    world.ticker.flush()
+    world.broadcaster.take(alice)
+    world.ticker.flush()
+    assert world.broadcaster.take(alice) == []
+    assert world.ticker.tick == 2
+
+
+def test_backlogged_client_gets_missed_moves_merged_later():
+    world = World()
+    alice = world.join('alice', 0, 0)
+    world.join('bob', 50, 0)
+    world.join('carol', 0, 50)
+    world.ticker.flush()
+    world.broadcaster.take(alice)
+
+    world.broadcaster.slow.add(alice)
+    world.move('bob', 60, 0)
+    world.ticker.flush()
+    world.move('carol', 0, 60)
+    world.ticker.flush()
+    assert world.broadcaster.take(alice) == []
+
+    # Nobody moves any more, the owed players still arrive in one delta
+    world.broadcaster.slow.clear()
+    world.ticker.flush()
+    deltas = world.broadcaster.take(alice)
+    assert len(deltas) == 1
+    assert deltas[0]["players"] == {'bob': {"x": 60, "y": 0, "username": 'bob'},
+                                    'carol': {"x": 0, "y": 60, "username": 'carol'}}
+    world.ticker.flush()
+    assert world.broadcaster.take(alice) == []
+
+
+def test_owed_players_stay_with_their_connection():
+    world = World()
+    old = world.join('alice', 0, 0)
+    world.join('bob', 50, 0)
+    world.ticker.flush()
+    world.broadcaster.slow.add(old)
+    world.move('bob', 60, 0)
+    world.ticker.flush()
+    assert world.ticker.owed == {old: {'bob'}}
+
+    # alice logs in again, the new connection does not inherit what the old one was owed
+    del world.clients[old]
+    new = 'ws-alice-2'
+    world.clients[new] = 'alice'
+    world.ticker.flush()
+    assert world.broadcaster.take(new) == []
+
+    world.ticker.discard_client(old)
+    assert world.ticker.owed == {}
+
+
+def test_entered_and_left_are_sent_even_when_backlogged():
+    world = World()
+    alice = world.join('alice', 0, 0)
+    world.join('bob', 500, 0)
+    world.ticker.flush()
+    world.broadcaster.take(alice)
+
+    world.broadcaster.slow.add(alice)
+    world.move('bob', 50, 0)
+    world.ticker.flush()
+    assert world.broadcaster.take(alice)[0]["entered"] == ['bob']
+
+
+def test_changed_since_covers_the_history_only():
+    world = World()
+    world.join('alice', 0, 0)
+    world.ticker.flush()                 # tick 1: alice
+    world.join('bob', 500, 0)
+    world.ticker.flush()                 # tick 2: bob
+    world.ticker.flush()                 # tick 3: nothing
+    assert world.ticker.changed_since(1) == {'bob'}
+    assert world.ticker.changed_since(0) == {'alice', 'bob'}
+    assert world.ticker.changed_since(3) == set()
+    assert world.ticker.changed_since(4) is None
+
+    for _ in range(5):
+        world.move('alice', 1, 0)
+        world.ticker.flush()
+    assert world.ticker.changed_since(1) is None
+    assert world.ticker.changed_since(world.ticker.tick - 1) == {'alice'}
+
+
+def test_a_failing_tick_does_not_stop_the_loop():
+    world = World()
+    ticker = WorldTicker(world.game_state, world.clients, world.broadcaster, world.interest, set(),
+                         world.session_ids, rate_hz=1000)
+    calls = []
+
+    def flush():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise RuntimeError("bad tick")
+
+    ticker.flush = flush
+
+    async def scenario():
+        task = asyncio.ensure_future(ticker.run())
+        while len(calls) < 3:
+            await asyncio.sleep(0.001)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert len(calls) >= 3
@@ -0,0 +1,147 @@
+# token_auth.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+# Token cache configuration
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 50000))          # Verified tokens kept in memory
+NEGATIVE_CACHE_TTL = float(os.environ.get('NEGATIVE_CACHE_TTL', 30))       # Seconds a rejected token stays rejected
+NEGATIVE_CACHE_SIZE = int(os.environ.get('NEGATIVE_CACHE_SIZE', 10000))    # Rejected tokens kept in memory
+# Trust signed claims without confirming the user exists in the database
+AUTH_TRUST_SIGNED_CLAIMS = os.environ.get('AUTH_TRUST_SIGNED_CLAIMS', '0') == '1'
+
+
+class UserNotFoundError(Exception):
+    pass
+
+
+class TokenVerifier:
+    def __init__(self, secret_key, trust_claims=AUTH_TRUST_SIGNED_CLAIMS, max_entries=TOKEN_CACHE_SIZE,
+                 negative_ttl=NEGATIVE_CACHE_TTL, negative_max_entries=NEGATIVE_CACHE_SIZE):
+        """
+        Verifies HS256 tokens and caches the outcome.
+
+        Verified claims are served from memory until the token's `exp`, so a
+        reconnecting client costs neither a signature check nor a database
+        lookup. Invalid tokens and unknown users are remembered for a short
+        while as well.
+
+        :param secret_key: Key the tokens are signed with
+        :param trust_claims: Skip the user existence check for validly signed tokens
+        :param max_entries: Verified tokens kept before the least recently used is evicted
+        :param negative_ttl: Seconds a rejected token is rejected without checking it again
+        :param negative_max_entries: Rejected tokens kept before the oldest is evicted
+        """
+        self.secret_key = secret_key
+        self.trust_claims = trust_claims
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.negative_max_entries = negative_max_entries
+        self.verified = OrderedDict()  # token -> claims
+        self.rejected = OrderedDict()  # token -> (retry_at, exception type, message)
+        self.lock = threading.Lock()    # Flask serves requests from several threads
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'negative_hits': 0,
+            'rejections': 0,
+            'user_lookups': 0
+        }
+
+    def _lookup(self, token):
+        with self.lock:
+            return self._lookup_locked(token)
+
+    def _lookup_locked(self, token):
+        claims = self.verified.get(token)
+        if claims is not None:
+            if claims.get('exp', float('inf')) <= time.time():
+                del self.verified[token]
+                error = jwt.ExpiredSignatureError("Signature has expired")
+                self._reject_locked(token, error)
+                raise error
+            self.verified.move_to_end(token)
+            self.stats['hits'] += 1
+            return claims
+
+        rejected = self.rejected.get(token)
+        if rejected is not None:
+            if rejected[0] > time.monotonic():
+                self.stats['negative_hits'] += 1
+                # Raise a fresh exception so tracebacks do not pile up on a shared instance
+                raise rejected[1](rejected[2])
+            del self.rejected[token]
+
+        self.stats['misses'] += 1
+        return None
+
+    def _decode(self, token):
+        try:
+            claims = jwt.decode(token, self.secret_key, algorithms=['HS256'])
+            if not claims.get('username'):
+                raise jwt.InvalidTokenError("Token does not contain username")
+            return claims
+        except jwt.InvalidTokenError as e:
+            self._reject(token, e)
+            raise
+
+    def _accept(self, token, claims):
+        with self.lock:
+            self.verified[token] = claims
+            while len(self.verified) > self.max_entries:
+                self.verified.popitem(last=False)
+
+    def _reject(self, token, error):
+        with self.lock:
+            self._reject_locked(token, error)
+
+    def _reject_locked(self, token, error):
+        self.stats['rejections'] += 1
+        self.rejected[token] = (time.monotonic() + self.negative_ttl, type(error), str(error))
+        self.rejected.move_to_end(token)
+        while len(self.rejected) > self.negative_max_entries:
+            self.rejected.popitem(last=False)
+
+    def _unknown_user(self, token, username):
+        error = UserNotFoundError(f"No user found with username: {username}")
+        self._reject(token, error)
+        raise error
+
+    def verify(self, token, user_exists):
+        """
+        Return the claims of a valid token.
+
+        :param user_exists: Callable taking a username, only called on a cache miss
+        :raises jwt.ExpiredSignatureError, jwt.InvalidTokenError, UserNotFoundError
+        """
+        claims = self._lookup(token)
+        if claims is not None:
+            return claims
+
+        claims = self._decode(token)
+        if not self.trust_claims:
+            self.stats['user_lookups'] += 1
+            if not user_exists(claims['username']):
+                self._unknown_user(token, claims['username'])
+        self._accept(token, claims)
+        return claims
+
+    async def verify_async(self, token, user_exists):
+        """
+        Same as verify() for an awaitable user_exists callable.
+        """
+        claims = self._lookup(token)
+        if claims is not None:
+            return claims
+
+        claims = self._decode(token)
+        if not self.trust_claims:
+            self.stats['user_lookups'] += 1
+            if not await user_exists(claims['username']):
+                self._unknown_user(token, claims['username'])
+        self._accept(token, claims)
+        return claims
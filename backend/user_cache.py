@@ -0,0 +1,194 @@
+# user_cache.py
+
+import asyncio
+import os
+import socket
+import time
+from collections import OrderedDict
+
+from logger import log
+from metrics import Histogram
+from user_store import project
+
+# User cache configuration
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 300))           # Seconds a cached user stays valid
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))         # Maximum number of cached users
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', 5))  # Seconds between progress flushes
+PROGRESS_BATCH_SIZE = 500                                               # Progress updates per bulk write
+
+# Other processes (auth.py) tell the websocket server about changed users over UDP
+CACHE_INVALIDATION_HOST = '127.0.0.1'
+CACHE_INVALIDATION_PORT = int(os.environ.get('CACHE_INVALIDATION_PORT', 6790))
+
+STORE_CALL_SECONDS = Histogram('ordinooki_store_call_duration_seconds',
+                               "Latency of calls to the user store (MongoDB)", ('operation',))
+
+
+class UserCache:
+    def __init__(self, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_SIZE):
+        """
+        Per-process user documents keyed by username, with TTL and LRU eviction.
+
+        :param ttl: Seconds an entry is served before it is fetched again
+        :param max_entries: Number of entries kept before the least recently used is evicted
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # username -> (expires_at, user document)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username):
+        entry = self.entries.get(username)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[username]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(username)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, username, user):
+        self.entries[username] = (time.monotonic() + self.ttl, user)
+        self.entries.move_to_end(username)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, username):
+        self.entries.pop(username, None)
+
+
+class CachedUserStore:
+    def __init__(self, store, cache=None, flush_interval=PROGRESS_FLUSH_INTERVAL):
+        """
+        Read-through user cache and write-behind progress queue over a user store.
+
+        Full user documents are fetched once and served from the cache for the
+        rest of the session. Progress saves are coalesced per user and written
+        in batches on a timer and on shutdown.
+
+        Returned documents are shared with the cache and must not be mutated.
+
+        :param store: AsyncUserStore or InMemoryUserStore
+        :param cache: UserCache to use, a default one is created if omitted
+        :param flush_interval: Seconds between write-behind flushes
+        """
+        self.store = store
+        self.cache = cache or UserCache()
+        self.flush_interval = flush_interval
+        self.pending_progress = {}  # username -> latest unsaved progress
+
+    async def _call(self, operation, *args):
+        # Every database round trip is timed, cache hits never get here
+        started = time.perf_counter()
+        try:
+            return await getattr(self.store, operation)(*args)
+        finally:
+            STORE_CALL_SECONDS.observe(time.perf_counter() - started, operation)
+
+    def _remember(self, username, user):
+        # Unsaved progress is newer than whatever the database returned
+        if username in self.pending_progress:
+            user = {**user, 'progress': self.pending_progress[username]}
+        self.cache.put(username, user)
+        return user
+
+    async def find_user(self, username, projection=None):
+        """
+        Fetch a user, the full document is cached and `projection` is applied to the copy returned.
+        """
+        user = self.cache.get(username)
+        if user is None:
+            user = await self._call('find_user', username)
+            if user is None:
+                return None
+            user = self._remember(username, user)
+        return project(user, projection)
+
+    async def find_users(self, usernames, projection=None):
+        found = {}
+        missing = []
+        for username in usernames:
+            user = self.cache.get(username)
+            if user is None:
+                missing.append(username)
+            else:
+                found[username] = user
+
+        if missing:
+            for username, user in (await self._call('find_users', missing)).items():
+                found[username] = self._remember(username, user)
+        if projection:
+            return {username: project(user, projection) for username, user in found.items()}
+        return found
+
+    async def update_user(self, username, update):
+        result = await self._call('update_user', username, update)
+        self.cache.invalidate(username)
+        return result
+
+    def invalidate(self, username):
+        self.cache.invalidate(username)
+
+    def save_progress(self, username, progress):
+        """
+        Queue a progress save without touching the database.
+        """
+        self.pending_progress[username] = progress
+        user = self.cache.entries.get(username)
+        if user is not None:
+            self.cache.entries[username] = (user[0], {**user[1], 'progress': progress})
+
+    async def flush(self):
+        while self.pending_progress:
+            batch = {}
+            for username in list(self.pending_progress)[:PROGRESS_BATCH_SIZE]:
+                batch[username] = {'progress': self.pending_progress.pop(username)}
+            try:
+                await self._call('bulk_set', batch)
+            except Exception as e:
+                # Keep the batch for the next flush unless newer progress arrived meanwhile
+                for username, fields in batch.items():
+                    self.pending_progress.setdefault(username, fields['progress'])
+                log.warning("Failed to flush player progress: %s", e)
+                return
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+class _InvalidationProtocol(asyncio.DatagramProtocol):
+    def __init__(self, target):
+        self.target = target
+
+    def datagram_received(self, data, addr):
+        username = data.decode('utf-8', errors='replace')
+        self.target.invalidate(username)
+
+
+async def start_invalidation_listener(target, host=CACHE_INVALIDATION_HOST, port=CACHE_INVALIDATION_PORT):
+    """
+    Listen for usernames whose documents changed elsewhere and drop them from the cache.
+
+    :param target: Object with an invalidate(username) method, a CachedUserStore or a ClusterNode
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _InvalidationProtocol(target),
+        local_addr=(host, port)
+    )
+    return transport
+
+
+def notify_user_changed(username, host=CACHE_INVALIDATION_HOST, port=CACHE_INVALIDATION_PORT):
+    """
+    Best-effort notification to the websocket server that a user document changed.
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(username.encode('utf-8'), (host, port))
+    except OSError as e:
+        log.warning("Failed to send cache invalidation for %s: %s", username, e)
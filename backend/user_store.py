@@ -0,0 +1,154 @@
+# user_store.py
+
+import asyncio
+import copy
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# MongoDB access configuration
+DATABASE_NAME = 'your_database_name'  # Replace with your actual database name
+USERS_COLLECTION = 'usuarios'         # Collection name
+MONGO_POOL_SIZE = int(os.environ.get('MONGO_POOL_SIZE', 16))  # Connections and worker threads
+MEMORY_CONNECTION_STRING = 'memory://'  # Selects the in-memory store instead of a live MongoDB
+
+
+def project(user, projection):
+    """
+    Apply an inclusion projection ({field: 1}) to a user document, the username is always kept.
+    """
+    if user is None or not projection:
+        return user
+    projected = {key: user[key] for key, include in projection.items() if include and key in user}
+    projected['username'] = user['username']
+    return projected
+
+
+class AsyncUserStore:
+    def __init__(self, collection, max_workers=MONGO_POOL_SIZE):
+        """
+        Non-blocking access to the usuarios collection.
+
+        pymongo is synchronous, so every call runs on a bounded thread pool
+        sized like the connection pool and the event loop never waits on a
+        database round trip.
+
+        :param collection: pymongo collection holding the user documents
+        :param max_workers: Number of threads issuing database calls
+        """
+        self.collection = collection
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mongo')
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    async def find_user(self, username, projection=None):
+        return await self._run(self.collection.find_one, {'username': username}, projection)
+
+    async def find_users(self, usernames, projection=None):
+        """
+        Fetch several users in a single round trip, keyed by username.
+        """
+        if projection:
+            # The username is needed to key the result
+            projection = {**projection, 'username': 1}
+
+        def query():
+            return list(self.collection.find({'username': {'$in': list(usernames)}}, projection))
+
+        users = await self._run(query)
+        return {user['username']: user for user in users}
+
+    async def update_user(self, username, update):
+        return await self._run(self.collection.update_one, {'username': username}, update)
+
+    async def bulk_set(self, updates):
+        """
+        Set fields on many users with a single unordered bulk_write.
+
+        :param updates: username -> dict of fields to $set
+        """
+        from pymongo import UpdateOne
+
+        operations = [UpdateOne({'username': username}, {'$set': fields}) for username, fields in updates.items()]
+        if operations:
+            return await self._run(self.collection.bulk_write, operations, ordered=False)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class InMemoryUserStore:
+    def __init__(self, users=None, latency=0.0):
+        """
+        Test double of AsyncUserStore backed by a dict.
+
+        Supports the subset of queries the websocket server issues, so the
+        server can be run and benchmarked without a live MongoDB.
+
+        :param users: Optional iterable of user documents to start with
+        :param latency: Simulated round trip time in seconds
+        """
+        self.users = {}  # username -> user document
+        self.latency = latency
+        for user in users or ():
+            self.users[user['username']] = copy.deepcopy(user)
+
+    async def _round_trip(self):
+        # Always yield to the loop, like a real database call would
+        await asyncio.sleep(self.latency)
+
+    @staticmethod
+    def _project(user, projection):
+        return copy.deepcopy(project(user, projection))
+
+    async def find_user(self, username, projection=None):
+        await self._round_trip()
+        return self._project(self.users.get(username), projection)
+
+    async def find_users(self, usernames, projection=None):
+        await self._round_trip()
+        return {
+            username: self._project(self.users[username], projection)
+            for username in usernames if username in self.users
+        }
+
+    async def update_user(self, username, update):
+        await self._round_trip()
+        user = self.users.get(username)
+        if user is None:
+            return None
+        for key, value in update.get('$set', {}).items():
+            user[key] = copy.deepcopy(value)
+        return user
+
+    async def bulk_set(self, updates):
+        await self._round_trip()
+        for username, fields in updates.items():
+            if username in self.users:
+                self.users[username].update(copy.deepcopy(fields))
+
+    def close(self):
+        pass
+
+
+def create_user_store(connection_string):
+    """
+    Build the user store for a connection string.
+
+    "memory://" selects InMemoryUserStore, "memory:///path/users.json" seeds it
+    with the user documents in that file. Anything else connects to MongoDB.
+    """
+    if connection_string.startswith(MEMORY_CONNECTION_STRING):
+        seed_path = connection_string[len(MEMORY_CONNECTION_STRING):]
+        if not seed_path:
+            return InMemoryUserStore()
+        with open(seed_path, 'r') as f:
+            return InMemoryUserStore(json.load(f))
+
+    from pymongo import MongoClient
+
+    client = MongoClient(connection_string, maxPoolSize=MONGO_POOL_SIZE)
+    collection = client[DATABASE_NAME][USERS_COLLECTION]
+    return AsyncUserStore(collection)
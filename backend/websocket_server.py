@@ -3,381 +3,820 @@
 import asyncio
 import websockets
 import json
-from pymongo import MongoClient
 import os
+import signal
 import jwt
 import datetime
 import time
 from functools import wraps
 
+from backplane import create_backplane
+from battle_manager import BattleManager
+from battle_odds import predict
+from battle_replay import DRAW
+from broadcaster import Broadcaster
+from catalog import bundle_version, get_catalog
+from challenges import ChallengeError, ChallengeRegistry
+from cluster import ClusterNode
+from interest import InterestManager
+from logger import log
+from matchmaking import DEFAULT_RATING, MatchQueue, power_table, rate
+from messages import (MAX_FRAME_SIZE, Authenticate, BattleLogRequest, BattlePreview, CatalogAck, ChallengeAccept,
+                      ChallengeCancel, ChallengeDecline, ChallengeRequest, Dispatcher, MatchmakingJoin,
+                      MatchmakingLeave, PlayerUpdate, decode)
+from metrics import METRICS_HOST, METRICS_PORT, CallbackMetric, Counter, start_metrics_server
+import protocol
+from resume import ResumeRegistry
+from sessions import Session, SessionTable
+from user_store import create_user_store
+from user_cache import CachedUserStore, start_invalidation_listener
+from token_auth import TokenVerifier, UserNotFoundError
+from world_tick import WorldTicker
+
+# Listening address, workers started by launcher.py share it with SO_REUSEPORT
+WEBSOCKET_HOST = os.environ.get('WEBSOCKET_HOST', 'localhost')
+WEBSOCKET_PORT = int(os.environ.get('WEBSOCKET_PORT', 6789))
+WORKER_STATS_INTERVAL = float(os.environ.get('WORKER_STATS_INTERVAL', 10))  # Seconds between stats reports
+SNAPSHOT_CHUNK_SIZE = int(os.environ.get('SNAPSHOT_CHUNK_SIZE', 100))        # Players per gameState chunk
+
 # Secret key for JWT (should be the same as in auth.py)
 SECRET_KEY = 'your_secret_key'  # Replace with the same secret key used in auth.py
 
 # MongoDB connection
 MONGODB_CONNECTION_STRING = os.environ.get('MONGODB_CONNECTION_STRING')
 if not MONGODB_CONNECTION_STRING:
-    print("Please set the MONGODB_CONNECTION_STRING environment variable.")
-    exit(1)
-
-try:
-    client = MongoClient(MONGODB_CONNECTION_STRING)
-    db = client['your_database_name']  # Replace with your actual database name
-    usuarios_collection = db['usuarios']  # Collection name
-    print("Connected to MongoDB.")
-except Exception as e:
-    print(f"Failed to connect to MongoDB: {e}")
+    log.error("Please set the MONGODB_CONNECTION_STRING environment variable.")
     exit(1)
 
-# Load Ordinooki data from JSON
-ORDINOOKI_JSON_PATH = os.path.join(os.path.dirname(__file__), 'ordinooki.json')  # Adjust the path as needed
 try:
-    with open(ORDINOOKI_JSON_PATH, 'r') as f:
-        ordinooki_data_list = json.load(f)
-    # Create a dictionary for quick lookup by ID
-    ordinooki_data_dict = {ordinooki['id']: ordinooki for ordinooki in ordinooki_data_list}
-    print("Ordinooki data loaded successfully.")
+    # All database calls go through the non-blocking store, never on the event loop
+    # User documents are cached per process and progress is written behind
+    user_store = CachedUserStore(create_user_store(MONGODB_CONNECTION_STRING))
+    log.info("Connected to MongoDB.")
 except Exception as e:
-    print(f"Failed to load Ordinooki data: {e}")
+    log.error("Failed to connect to MongoDB: %s", e)
     exit(1)
 
-# Rate limiting configuration
-MIN_UPDATE_INTERVAL_MS = 100  # Minimum update interval in milliseconds (adjust as needed)
+# Verified tokens are cached until they expire
+token_verifier = TokenVerifier(SECRET_KEY)
 
 # Keep track of connected clients and game state
-connected_clients = set()
-client_usernames = {}        # websocket -> username mapping
-last_update_times = {}       # username -> last update time tracking
-username_to_client = {}      # username -> websocket mapping
+sessions = SessionTable()    # One Session per connection, holding all of its state
 game_state = {
     "map": "assets/map.png",  # Reference to the map
     "players": {}             # Player data will be stored here
 }
 
+# Outbound fan-out, one bounded queue per connected client
+broadcaster = Broadcaster()
+
+# Spatial index deciding which players each client gets updates for
+interest = InterestManager()
+
+# Numeric ids of the players, used by clients that negotiated the compact binary protocol
+session_ids = protocol.SessionIds()
+
+# Movement is coalesced and sent to clients once per tick
+world_ticker = WorldTicker(game_state, sessions.usernames, broadcaster, interest, sessions.binary, session_ids)
+sessions.on_remove.append(lambda session: world_ticker.discard_client(session.websocket))
+
+# Dropped sessions that can be resumed with a delta instead of a full snapshot
+resume_registry = ResumeRegistry()
+
+# Presence, movement and routed messages shared with the other server nodes
+cluster = ClusterNode(create_backplane(), game_state, sessions.clients, broadcaster, world_ticker, interest,
+                      session_ids)
+
+# Every live fight of this process, driven by one shared timer wheel
+battle_manager = BattleManager(broadcaster, sessions.clients, router=cluster)
+cluster.on_leave.append(battle_manager.forfeit)
+cluster.on_invalidate.append(user_store.invalidate)
+
+# Players of this node waiting for an automatic opponent, matched fights are ranked
+match_queue = MatchQueue()
+ranked_battles = set()  # battle ids of matched fights, their result changes both ratings
+
+# Open challenges involving players of this node, expired by one timer heap
+challenges = ChallengeRegistry()
+
+RESUMES = Counter('ordinooki_resumes_total', "Resumed sessions, per catch-up kind", ('kind',))
+
+# Server state exposed on http://METRICS_HOST:METRICS_PORT/metrics, read when scraped
+CallbackMetric('ordinooki_suspended_sessions', "Dropped sessions that can still be resumed",
+               lambda: len(resume_registry))
+CallbackMetric('ordinooki_connected_clients', "Open client connections", lambda: len(sessions))
+CallbackMetric('ordinooki_catalog_clients', "Clients holding the current catalog bundle",
+               lambda: sum(1 for session in sessions if session.catalog_version is not None))
+CallbackMetric('ordinooki_send_queue_frames', "Frames waiting in all client send queues",
+               lambda: broadcaster.queue_depth()[0])
+CallbackMetric('ordinooki_send_queue_max_frames', "Frames waiting in the longest client send queue",
+               lambda: broadcaster.queue_depth()[1])
+CallbackMetric('ordinooki_token_cache_total', "Token verifications, per outcome", lambda: {
+    (outcome,): count for outcome, count in token_verifier.stats.items()
+}, kind='counter', labels=('outcome',))
+CallbackMetric('ordinooki_user_cache_total', "User cache lookups, per result", lambda: {
+    ("hit",): user_store.cache.hits, ("miss",): user_store.cache.misses
+}, kind='counter', labels=('result',))
+CallbackMetric('ordinooki_pending_progress', "Player progress saves waiting for the next flush",
+               lambda: len(user_store.pending_progress))
+CallbackMetric('ordinooki_active_battles', "Battles being played on this node",
+               lambda: battle_manager.stats()["active_battles"])
+CallbackMetric('ordinooki_matchmaking_waiting', "Players waiting for an automatic opponent",
+               lambda: len(match_queue))
+CallbackMetric('ordinooki_matchmaking_matches_total', "Pairs formed by matchmaking",
+               lambda: match_queue.matched, kind='counter')
+CallbackMetric('ordinooki_open_challenges', "Challenges waiting for an answer",
+               lambda: len(challenges))
+CallbackMetric('ordinooki_cluster_remote_players', "Players connected to other nodes",
+               lambda: len(cluster.remote_players))
+CallbackMetric('ordinooki_log_dropped_total', "Log lines dropped because the buffer was full",
+               lambda: log.dropped, kind='counter')
+
+# Client messages are parsed into typed structs and routed by type
+dispatcher = Dispatcher()
+
+def reject_challenge(websocket, text):
+    broadcaster.send(websocket, {
+        "type": "challenge_response",
+        "success": False,
+        "message": text
+    })
+
+def localize(websocket, message):
+    """
+    Expand the Ordinooki ids of a compact message for a client without its catalog bundle.
+
+    Messages naming Ordinookis by id carry the "catalogVersion" they refer
+    to. A client that acknowledged that version resolves the ids itself, any
+    other client gets each {"ordinookiId"} entry filled with the full data.
+    """
+    version = message.get("catalogVersion")
+    session = sessions.get(websocket)
+    if version is None or session is not None and session.catalog_version == version:
+        return message
+    catalog = get_catalog()
+    return {
+        key: {**value, "ordinooki": catalog.get(value["ordinookiId"])}
+        if isinstance(value, dict) and "ordinookiId" in value else value
+        for key, value in message.items()
+    }
+
+cluster.localize = localize
+
+@dispatcher.on(PlayerUpdate)
+def handle_player_update(websocket, username, message):
+    # Update the game state with the new player data, the latest update wins
+    game_state["players"][username] = message.state()
+
+    # Other clients receive it with the next worldDelta tick, other nodes with the next delta batch
+    world_ticker.mark_dirty(username)
+    cluster.player_moved(username)
+
+async def start_fight(from_username, target_username, ranked=False, ordinooki_ids=None):
+    """
+    Start a server-played fight between two players and send both of them fight_start.
+
+    :param ranked: The fight was arranged by matchmaking and its result changes both ratings
+    :param ordinooki_ids: username -> selected Ordinooki id already known to the caller
+    :return: The battle id, None if the fight could not start
+    """
+    players = (from_username, target_username)
+
+    def fight_start_error(text):
+        cluster.send_many(players, {"type": "fight_start_error", "message": text})
+
+    def already_fighting():
+        fight_start_error("One of the players is already in a battle.")
+        log.debug("Fight start failed: %s or %s is already in a battle.", from_username, target_username)
+
+    # A player can only be in one battle at a time, on any node
+    if battle_manager.is_busy(from_username) or battle_manager.is_busy(target_username):
+        already_fighting()
+        return None
+
+    # Fetch the Ordinooki IDs the caller does not know yet from the database in one query
+    ordinooki_ids = dict(ordinooki_ids or {})
+    missing = [player for player in players if not ordinooki_ids.get(player)]
+    if missing:
+        users = await user_store.find_users(missing, {'selected_ordinooki': 1})
+        for player in missing:
+            ordinooki_ids[player] = users.get(player, {}).get('selected_ordinooki')
+    from_ordinooki_id = ordinooki_ids[from_username]
+    to_ordinooki_id = ordinooki_ids[target_username]
+    if not from_ordinooki_id or not to_ordinooki_id:
+        fight_start_error("Both players must have selected an Ordinooki to fight.")
+        log.debug("Fight start failed: One or both players haven't selected an Ordinooki.")
+        return None
+
+    # Fetch Ordinooki details from the catalog, loaded on first use
+    catalog = get_catalog()
+    from_ordinooki = catalog.get(from_ordinooki_id)
+    to_ordinooki = catalog.get(to_ordinooki_id)
+    if not from_ordinooki or not to_ordinooki:
+        fight_start_error("Ordinooki data is missing for one or both players.")
+        log.warning("Fight start failed: Ordinooki data missing for players.")
+        return None
+
+    # The server plays the fight out and streams battle_update frames
+    # start() checks again, either player may have entered another fight during the lookup
+    battle_id = battle_manager.start(
+        {"username": from_username, "ordinooki": from_ordinooki},
+        {"username": target_username, "ordinooki": to_ordinooki}
+    )
+    if battle_id is None:
+        already_fighting()
+        return None
+    if ranked:
+        ranked_battles.add(battle_id)
+
+    # Send fight_start message to both players, Ordinookis are named by catalog id
+    fight_start_message = {
+        "type": "fight_start",
+        "battleId": battle_id,
+        "ranked": ranked,
+        "catalogVersion": bundle_version(catalog),
+        "player1": {
+            "username": from_username,
+            "ordinookiId": from_ordinooki_id
+        },
+        "player2": {
+            "username": target_username,
+            "ordinookiId": to_ordinooki_id
+        }
+    }
+    # Each player gets it expanded or not, depending on the bundle it holds
+    for player in players:
+        cluster.send_to(player, fight_start_message)
+    log.info("Fight started between %s and %s", from_username, target_username)
+    return battle_id
+
+def close_challenge(challenge):
+    # The node of the other player holds a copy of a challenge between two nodes
+    for player in (challenge.challenger, challenge.target):
+        if player not in sessions.clients:
+            cluster.send_event(player, {"kind": "challenge_close", "from": challenge.challenger,
+                                        "to": challenge.target})
+
+def open_challenge(challenger, target, ordinooki_id, ttl=None):
+    """
+    Register a challenge on the target's node and show it to the target.
+
+    :raises ChallengeError: The target cannot take the challenge
+    """
+    # Looked up first, a target that left in the meantime must not leave a challenge behind
+    websocket = sessions.clients.get(target)
+    if websocket is None:
+        raise ChallengeError(f"User {target} is not connected.")
+    challenge = challenges.add(challenger, target, ordinooki_id, ttl)
+    broadcaster.send(websocket, {
+        "type": "challenge_request",
+        "from": challenger,
+        "to": target,
+        "expiresIn": challenge.ttl()
+    })
+    return challenge
+
+def notify_challenge_closed(challenge, reason):
+    # Only players of this node, the other node tells its own player
+    message = {"type": "challenge_cancel", "from": challenge.challenger, "to": challenge.target, "reason": reason}
+    for player in (challenge.challenger, challenge.target):
+        websocket = sessions.clients.get(player)
+        if websocket is not None:
+            broadcaster.send(websocket, message)
+
+def expire_challenge(challenge):
+    notify_challenge_closed(challenge, "expired")
+    log.debug("Challenge from %s to %s expired", challenge.challenger, challenge.target)
+
+def drop_challenges(username):
+    # A player that left takes its open challenges with it
+    for challenge in challenges.remove_user(username):
+        notify_challenge_closed(challenge, "disconnected")
+
+def handle_cluster_event(username, event):
+    kind = event.get("kind")
+    if kind == "challenge_open":
+        # A player of another node challenged a player of this one
+        challenger = event.get("from")
+        try:
+            open_challenge(challenger, username, event.get("ordinooki"), event.get("ttl"))
+        except ChallengeError as e:
+            cluster.send_event(challenger, {"kind": "challenge_close", "from": challenger, "to": username})
+            cluster.send_to(challenger, {"type": "challenge_response", "success": False, "message": str(e)})
+    elif kind == "challenge_close":
+        challenges.remove(event.get("from"), event.get("to"))
+
+cluster.on_event.append(handle_cluster_event)
+cluster.on_leave.append(drop_challenges)
+cluster.on_invalidate.append(challenges.forget_ordinooki)
+
+@dispatcher.on(ChallengeRequest)
+async def handle_challenge_request(websocket, username, message):
+    # The challenger is the authenticated player, whatever "from" the client claims
+    target = message.target
+    try:
+        challenges.check(username, target)
+        if not cluster.is_online(target):
+            raise ChallengeError(f"User {target} is not connected.")
+
+        # The challenger's Ordinooki is looked up once, accepting resolves it from the registry
+        user = await user_store.find_user(username)
+        ordinooki_id = (user or {}).get('selected_ordinooki')
+        if not ordinooki_id:
+            raise ChallengeError("You must select an Ordinooki to fight.")
+        if sessions.clients.get(username) is not websocket:
+            return  # Disconnected while the user was fetched
+
+        if target in sessions.clients:
+            open_challenge(username, target, ordinooki_id)
+        elif cluster.is_online(target):
+            # Held here for the challenger, the target's node opens its own copy
+            challenge = challenges.add(username, target, ordinooki_id)
+            cluster.send_event(target, {"kind": "challenge_open", "from": username, "ordinooki": ordinooki_id,
+                                        "ttl": challenge.ttl()})
+        else:
+            raise ChallengeError(f"User {target} is not connected.")
+    except ChallengeError as e:
+        log.debug("Challenge request from %s to %s failed: %s", username, target, e)
+        reject_challenge(websocket, str(e))
+        return
+    log.debug("Challenge request from %s to %s forwarded", username, target)
+
+@dispatcher.on(ChallengeAccept)
+async def handle_challenge_accept(websocket, username, message):
+    # Sent by the challenged player, "to" names the challenger
+    challenger = message.target
+    challenge = challenges.remove(challenger, username)
+    if challenge is None:
+        reject_challenge(websocket, f"No open challenge from {challenger}.")
+        return
+    close_challenge(challenge)
+    if not cluster.is_online(challenger):
+        log.debug("Challenge accept failed: %s not connected.", challenger)
+        reject_challenge(websocket, "Challenge accept failed. Ensure both players are connected.")
+        return
+
+    # A player fighting a challenge stops waiting for an automatic opponent
+    match_queue.remove(username)
+    match_queue.remove(challenger)
+    # The acceptor's selection comes from the user cache, it may have changed since the challenge
+    await start_fight(username, challenger, ordinooki_ids={challenger: challenge.ordinooki_id})
+
+@dispatcher.on(ChallengeDecline)
+def handle_challenge_decline(websocket, username, message):
+    # Sent by the challenged player, "to" names the challenger
+    challenger = message.target
+    challenge = challenges.remove(challenger, username)
+    if challenge is None:
+        reject_challenge(websocket, f"No open challenge from {challenger}.")
+        return
+    close_challenge(challenge)
+
+    # Notify both players that the challenge is declined
+    cluster.send_many((challenger, username), {
+        "type": "challenge_decline",
+        "from": username,
+        "to": challenger
+    })
+    log.debug("Challenge declined by %s for %s", username, challenger)
+
+@dispatcher.on(ChallengeCancel)
+def handle_challenge_cancel(websocket, username, message):
+    # Sent by the challenger
+    challenge = challenges.remove(username, message.target)
+    if challenge is None:
+        return
+    close_challenge(challenge)
+
+    # Notify both players
+    cluster.send_many((message.target, username), {
+        "type": "challenge_cancel",
+        "from": username,
+        "to": message.target
+    })
+    log.debug("Challenge between %s and %s cancelled", username, message.target)
+
+@dispatcher.on(CatalogAck)
+def handle_catalog_ack(websocket, username, message):
+    # The client downloaded the bundle from auth.py's /api/catalog and can resolve ids itself
+    version = bundle_version(get_catalog())
+    accepted = message.version == version
+    session = sessions.get(websocket)
+    if session is not None:
+        session.catalog_version = version if accepted else None
+    broadcaster.send(websocket, {"type": "catalog_ack", "version": version, "accepted": accepted})
+
+def matchmaking_status(websocket, queued, **fields):
+    broadcaster.send(websocket, {"type": "matchmaking_status", "queued": queued, **fields})
+
+async def start_match(ticket, opponent):
+    # Matched players go through the same fight_start flow as an accepted challenge
+    log.debug("Matched %s (%.0f) with %s (%.0f)", ticket.username, ticket.rating, opponent.username, opponent.rating)
+    await start_fight(opponent.username, ticket.username, ranked=True)
+
+def record_ratings(battle_log):
+    if battle_log.battle_id in ranked_battles:
+        ranked_battles.discard(battle_log.battle_id)
+        asyncio.ensure_future(update_ratings(battle_log))
+
+async def update_ratings(battle_log):
+    # Elo update of a finished ranked fight, a forfeit counts as a loss
+    usernames = battle_log.usernames
+    users = await user_store.find_users(usernames, {'rating': 1})
+    score = 0.5 if battle_log.outcome == DRAW else 1.0 if battle_log.outcome == 0 else 0.0
+    ratings = rate(users.get(usernames[0], {}).get('rating', DEFAULT_RATING),
+                   users.get(usernames[1], {}).get('rating', DEFAULT_RATING), score)
+    try:
+        await asyncio.gather(*(
+            user_store.update_user(username, {'$set': {'rating': rating}})
+            for username, rating in zip(usernames, ratings)
+        ))
+    except Exception as e:
+        log.warning("Failed to save ratings of battle %s: %s", battle_log.battle_id, e)
+        return
+    for username, rating in zip(usernames, ratings):
+        cluster.send_to(username, {"type": "rating_update", "battleId": battle_log.battle_id, "rating": rating})
+
+battle_manager.on_finish.append(record_ratings)
+
+@dispatcher.on(MatchmakingJoin)
+async def handle_matchmaking_join(websocket, username, message):
+    # Wait for an opponent of similar rating whose Ordinooki is about as strong
+    if battle_manager.is_busy(username):
+        matchmaking_status(websocket, False, message="You are already in a battle.")
+        return
+    user = await user_store.find_user(username)
+    if sessions.clients.get(username) is not websocket:
+        return  # Disconnected while the user was fetched
+    catalog = get_catalog()
+    index = catalog.index_of((user or {}).get('selected_ordinooki'))
+    if index is None:
+        matchmaking_status(websocket, False, message="You must select an Ordinooki to fight.")
+        return
+
+    rating = user.get('rating', DEFAULT_RATING)
+    match_queue.add(username, rating, power_table(catalog)[index])
+    matchmaking_status(websocket, True, rating=rating)
+    pair = match_queue.match(username)
+    if pair is not None:
+        await start_match(*pair)
+
+@dispatcher.on(MatchmakingLeave)
+def handle_matchmaking_leave(websocket, username, message):
+    match_queue.remove(username)
+    matchmaking_status(websocket, False)
+
+@dispatcher.on(BattlePreview)
+async def handle_battle_preview(websocket, username, message):
+    # Predicted odds of a fight against another player, before accepting a challenge
+    opponent_username = message.target
+    users = await user_store.find_users([username, opponent_username])
+    catalog = get_catalog()
+    own_ordinooki = catalog.get(users.get(username, {}).get('selected_ordinooki'))
+    opponent_ordinooki = catalog.get(users.get(opponent_username, {}).get('selected_ordinooki'))
+
+    if not own_ordinooki or not opponent_ordinooki:
+        broadcaster.send(websocket, {
+            "type": "battle_preview",
+            "to": opponent_username,
+            "success": False,
+            "message": "Both players must have selected an Ordinooki."
+        })
+        return
+
+    odds = predict(own_ordinooki, opponent_ordinooki)
+    broadcaster.send(websocket, {
+        "type": "battle_preview",
+        "to": opponent_username,
+        "success": True,
+        "winProbability": odds.player1_win,
+        "lossProbability": odds.player2_win,
+        "drawProbability": odds.draw,
+        # A fight nobody can win never ends, JSON has no infinity
+        "expectedTurns": odds.expected_turns if odds.draw < 1 else None
+    })
+
+@dispatcher.on(BattleLogRequest)
+def handle_battle_log(websocket, username, message):
+    # Human-readable messages of a live or recently finished battle
+    battle_log = battle_manager.get_log(message.battle_id)
+    if battle_log is None:
+        broadcaster.send(websocket, {
+            "type": "battle_log",
+            "battleId": message.battle_id,
+            "success": False,
+            "message": "Unknown battle."
+        })
+        return
+
+    broadcaster.send(websocket, {
+        "type": "battle_log",
+        "battleId": message.battle_id,
+        "success": True,
+        "seed": str(battle_log.seed),
+        "messages": battle_log.render()
+    })
+
+async def send_snapshot(websocket, visible_players):
+    """
+    Send the players in view as gameState chunks, yielding to the other
+    connections between chunks so a large snapshot never stalls the loop.
+    """
+    players = game_state["players"]
+    binary = websocket in sessions.binary
+    player_ids = sorted(visible_players)
+    chunks = max(1, -(-len(player_ids) // SNAPSHOT_CHUNK_SIZE))
+    for index in range(chunks):
+        if index:
+            await asyncio.sleep(0)
+        broadcaster.send(websocket, {
+            "type": "gameState",
+            "map": game_state["map"],
+            "tick": world_ticker.tick,
+            "chunk": index,
+            "chunks": chunks,
+            "players": {
+                id: {
+                    **players[id],
+                    "username": id,
+                    **({"sessionId": session_ids.get(id)} if binary else {})
+                } for id in player_ids[index * SNAPSHOT_CHUNK_SIZE:(index + 1) * SNAPSHOT_CHUNK_SIZE] if id in players
+            }
+        })
+
 async def server(websocket, path):
     # Receive the authentication token from the client
     try:
         auth_message = await asyncio.wait_for(websocket.recv(), timeout=5)
-        auth_data = json.loads(auth_message)
-        token = auth_data.get('token')
+        auth = Authenticate.parse(decode(auth_message))
 
         # Authenticate the user using JWT
-        username = authenticate_user(token)
+        username = await authenticate_user(auth.token)
         if not username:
             await websocket.send(json.dumps({'error': 'Authentication failed'}))
             await websocket.close()
             return
 
+        # A dropped client presenting its resume token only needs what it missed
+        resumed = resume_registry.claim(auth.resume, username) if auth.resume else None
+        resume_token = resume_registry.issue()
+        response = {'authenticated': True, 'resumeToken': resume_token, 'resumed': resumed is not None}
+
+        # Clients fetch the bundle of this version from auth.py unless they already hold it
+        catalog_version = bundle_version(get_catalog())
+        response['catalogVersion'] = catalog_version
+
+        # Negotiate the wire protocol for movement frames, JSON unless asked otherwise
+        binary = auth.protocol == protocol.PROTOCOL_BINARY
+        if binary:
+            response.update({
+                'protocol': protocol.PROTOCOL_BINARY,
+                'sessionId': session_ids.assign(username),
+                'animations': protocol.ANIMATIONS
+            })
+        else:
+            session_ids.assign(username)
         # Send authentication success message
-        await websocket.send(json.dumps({'authenticated': True}))
+        await websocket.send(json.dumps(response))
 
     except asyncio.TimeoutError:
         await websocket.send(json.dumps({'error': 'Authentication timeout'}))
         await websocket.close()
         return
     except Exception as e:
-        print(f"Error during authentication: {e}")
+        log.warning("Error during authentication: %s", e)
         await websocket.send(json.dumps({'error': 'Invalid authentication message'}))
         await websocket.close()
         return
 
-    # Add new connection to the set
-    connected_clients.add(websocket)
-    client_usernames[websocket] = username
-    username_to_client[username] = websocket
-    print(f"New client connected: {username}")
+    # Register the connection, everything it owns is on its session
+    held_version = catalog_version if auth.catalog_version == catalog_version else None
+    session = Session(websocket, username, binary, held_version, resume_token)
+    sessions.add(session)
+    broadcaster.register(websocket)
+    log.info("New client connected: %s", username)
 
     player_id = username
-
-    # Load user progress if it exists
-    user = usuarios_collection.find_one({'username': username})
-    progress = user.get('progress', {})
-    if progress:
-        x = progress.get('x', 250)
-        y = progress.get('y', 425)
-        animation = progress.get('animation', 'stand')
-        flipX = progress.get('flipX', False)
-        scale = progress.get('scale', 1)
-    else:
-        x, y, animation, flipX, scale = 250, 425, 'stand', False, 1
-
-    # Initialize new player state in the game state
-    game_state["players"][player_id] = {
-        "x": x,
-        "y": y,
-        "animation": animation,
-        "flipX": flipX,
-        "scale": scale
-    }
-
-    # Send the current game state to the newly connected client (excluding its own data)
-    await websocket.send(json.dumps({
-        "type": "gameState",
-        "map": game_state["map"],
-        "players": {
-            id: {
-                **player,
-                "username": id
-            } for id, player in game_state["players"].items() if id != player_id
+    try:
+        # Load user progress if it exists
+        user = await user_store.find_user(username)
+        progress = (user or {}).get('progress', {})
+        if progress:
+            x = progress.get('x', 250)
+            y = progress.get('y', 425)
+            animation = progress.get('animation', 'stand')
+            flipX = progress.get('flipX', False)
+            scale = progress.get('scale', 1)
+        else:
+            x, y, animation, flipX, scale = 250, 425, 'stand', False, 1
+
+        # Initialize new player state in the game state
+        game_state["players"][player_id] = {
+            "x": x,
+            "y": y,
+            "animation": animation,
+            "flipX": flipX,
+            "scale": scale
         }
-    }))
+        world_ticker.mark_dirty(player_id)
+        cluster.player_joined(player_id)
+
+        # Players within view of the newly connected client (excluding its own data)
+        visible_players = interest.join(player_id, x, y)
+        missed = None
+        if resumed is not None:
+            # The client may have lost frames queued before the drop, its own tick is the safer one
+            last_tick = resumed.tick if auth.tick is None else min(auth.tick, resumed.tick)
+            missed = world_ticker.changed_since(last_tick)
+
+        if missed is not None:
+            # Resumed within the history: one delta against what the client still shows
+            known = resumed.visible
+            broadcaster.send(websocket, world_ticker.delta_frame(
+                websocket,
+                visible_players & known & missed,
+                visible_players - known,
+                known - visible_players
+            ), kind="worldDelta")
+            RESUMES.inc("delta")
+        else:
+            if resumed is not None:
+                RESUMES.inc("snapshot")
+            await send_snapshot(websocket, visible_players)
 
-    try:
+        # Every frame is checked against the session's rate limits before it is parsed
         async for message in websocket:
-            # Parse the message
-            data = json.loads(message)
-
-            message_type = data.get("type", "playerUpdate")
-
-            if message_type == "playerUpdate":
-                # Check rate limiting
-                current_time = time.time() * 1000  # Get current time in milliseconds
-                if current_time - last_update_times.get(username, 0) < MIN_UPDATE_INTERVAL_MS:
-                    continue  # Ignore this update if too soon
-
-                # Update last update time
-                last_update_times[username] = current_time
-
-                # Update the game state with the new player data
-                game_state["players"][player_id] = {
-                    "x": data.get("x"),
-                    "y": data.get("y"),
-                    "animation": data.get("animation", "stand"),
-                    "flipX": data.get("flipX", False),
-                    "scale": data.get("scale", 1)
-                }
-
-                # Broadcast the player's update to all other clients
-                update_message = {
-                    "type": "playerUpdate",
-                    "username": player_id,
-                    "x": data.get("x"),
-                    "y": data.get("y"),
-                    "animation": data.get("animation", "stand"),
-                    "flipX": data.get("flipX", False),
-                    "scale": data.get("scale", 1)
-                }
-                for client in connected_clients:
-                    if client != websocket:
-                        await client.send(json.dumps(update_message))
-
-            elif message_type == "challenge_request":
-                # Handle challenge request
-                target_username = data.get("to")
-                from_username = data.get("from")
-                if target_username in username_to_client:
-                    target_client = username_to_client[target_username]
-                    # Forward the challenge request to the target client
-                    await target_client.send(json.dumps({
-                        "type": "challenge_request",
-                        "from": from_username,
-                        "to": target_username
-                    }))
-                    print(f"Challenge request from {from_username} to {target_username} forwarded")
-                else:
-                    # Target user not connected
-                    print(f"Challenge request failed: User {target_username} not connected")
-                    # Notify the sender that the target is not available
-                    await websocket.send(json.dumps({
-                        "type": "challenge_response",
-                        "success": False,
-                        "message": f"User {target_username} is not connected."
-                    }))
-
-            elif message_type == "challenge_accept":
-                # Handle challenge acceptance
-                target_username = data.get("to")
-                from_username = data.get("from")
-
-                # Notify both players that the challenge is accepted
-                if target_username in username_to_client and from_username in username_to_client:
-                    target_client = username_to_client[target_username]
-                    from_client = username_to_client[from_username]
-
-                    # Fetch Ordinooki IDs for both players from the database
-                    from_user = usuarios_collection.find_one({'username': from_username})
-                    to_user = usuarios_collection.find_one({'username': target_username})
-
-                    from_ordinooki_id = from_user.get('selected_ordinooki')
-                    to_ordinooki_id = to_user.get('selected_ordinooki')
-
-                    if not from_ordinooki_id or not to_ordinooki_id:
-                        # Handle case where one or both players haven't selected an Ordinooki
-                        error_message = {
-                            "type": "fight_start_error",
-                            "message": "Both players must have selected an Ordinooki to fight."
-                        }
-                        await from_client.send(json.dumps(error_message))
-                        await target_client.send(json.dumps(error_message))
-                        print(f"Fight start failed: One or both players haven't selected an Ordinooki.")
-                        continue
-
-                    # Fetch Ordinooki details from the loaded JSON
-                    from_ordinooki = ordinooki_data_dict.get(from_ordinooki_id)
-                    to_ordinooki = ordinooki_data_dict.get(to_ordinooki_id)
-
-                    if not from_ordinooki or not to_ordinooki:
-                        # Handle case where Ordinooki data is missing
-                        error_message = {
-                            "type": "fight_start_error",
-                            "message": "Ordinooki data is missing for one or both players."
-                        }
-                        await from_client.send(json.dumps(error_message))
-                        await target_client.send(json.dumps(error_message))
-                        print(f"Fight start failed: Ordinooki data missing for players.")
-                        continue
-
-                    # Send fight_start message to both players with full Ordinooki data
-                    fight_start_message = {
-                        "type": "fight_start",
-                        "player1": {
-                            "username": from_username,
-                            "ordinooki": from_ordinooki
-                        },
-                        "player2": {
-                            "username": target_username,
-                            "ordinooki": to_ordinooki
-                        }
-                    }
-
-                    await from_client.send(json.dumps(fight_start_message))
-                    await target_client.send(json.dumps(fight_start_message))
-
-                    print(f"Fight started between {from_username} and {target_username}")
-
-                else:
-                    # One or both users are not connected
-                    print(f"Challenge accept failed: {from_username} or {target_username} not connected.")
-                    await websocket.send(json.dumps({
-                        "type": "challenge_response",
-                        "success": False,
-                        "message": f"Challenge accept failed. Ensure both players are connected."
-                    }))
-
-            elif message_type == "challenge_decline":
-                # Handle challenge decline
-                target_username = data.get("to")
-                from_username = data.get("from")
-
-                # Notify both players that the challenge is declined
-                if target_username in username_to_client and from_username in username_to_client:
-                    target_client = username_to_client[target_username]
-                    from_client = username_to_client[from_username]
-
-                    await target_client.send(json.dumps({
-                        "type": "challenge_decline",
-                        "from": from_username,
-                        "to": target_username
-                    }))
-                    await from_client.send(json.dumps({
-                        "type": "challenge_decline",
-                        "from": from_username,
-                        "to": target_username
-                    }))
-                    print(f"Challenge declined by {from_username} for {target_username}")
-                else:
-                    # One or both users are not connected
-                    print(f"Challenge decline failed: {from_username} or {target_username} not connected.")
-                    await websocket.send(json.dumps({
-                        "type": "challenge_response",
-                        "success": False,
-                        "message": f"Challenge decline failed. Ensure both players are connected."
-                    }))
-
-            elif message_type == "challenge_cancel":
-                # Handle challenge cancellation
-                target_username = data.get("to")
-                from_username = data.get("from")
-
-                # Notify both players
-                clients_to_notify = set()
-                if target_username in username_to_client:
-                    clients_to_notify.add(username_to_client[target_username])
-                if from_username in username_to_client:
-                    clients_to_notify.add(username_to_client[from_username])
-
-                cancel_message = {
-                    "type": "challenge_cancel",
-                    "from": from_username,
-                    "to": target_username
-                }
-
-                for client in clients_to_notify:
-                    await client.send(json.dumps(cancel_message))
-
-                print(f"Challenge between {from_username} and {target_username} cancelled")
-
-            else:
-                print(f"Unknown message type received from {username}: {message_type}")
+            await dispatcher.dispatch(websocket, username, message, session)
 
     except websockets.exceptions.ConnectionClosedError:
-        print(f"Client {username} disconnected")
+        log.info("Client %s disconnected", username)
     except Exception as e:
-        print(f"An error occurred: {e}")
+        log.error("An error occurred: %s", e)
     finally:
-        # Remove disconnected clients
-        connected_clients.remove(websocket)
-        client_usernames.pop(websocket, None)
-        username_to_client.pop(username, None)
-        print(f"Client removed: {username}")
-
-        # Save user progress
-        player_data = game_state["players"].get(player_id)
-        if player_data:
-            usuarios_collection.update_one(
-                {'username': username},
-                {'$set': {'progress': player_data}}
-            )
-
-        # Remove the player from the game state
-        if player_id in game_state["players"]:
-            del game_state["players"][player_id]
-            print(f"Removed player {player_id} from game state")
-
-        # Notify all clients about the removed player
-        disconnect_message = {
-            "type": "playerDisconnect",
-            "username": player_id
-        }
-
-        for client in connected_clients:
-            await client.send(json.dumps(disconnect_message))
-
-def authenticate_user(token):
-    try:
-        # Decode the JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        username = payload.get('username')
-
-        if username:
-            user = usuarios_collection.find_one({'username': username})
-            if user:
-                print(f"Authenticated user: {username}")
-                return username
-            else:
-                print(f"No user found with username: {username}")
-                return None
+        # Remove disconnected clients, dropping the session frees its state and rate limits
+        sessions.remove(session)
+        broadcaster.unregister(websocket)
+        if sessions.clients.get(username, websocket) is not websocket:
+            # The player reconnected before this connection closed, the player state belongs to the newer one
+            log.debug("Client replaced: %s", username)
         else:
-            print("Token does not contain username")
-            return None
+            resume_registry.suspend(username, session.resume_token, world_ticker.tick,
+                                    set(interest.visible.get(player_id, ())))
+            match_queue.remove(username)
+            drop_challenges(username)
+            battle_manager.forfeit(username)
+            cluster.player_left(username)
+            log.debug("Client removed: %s", username)
+
+            # Queue the user progress, it is saved with the next batched flush
+            player_data = game_state["players"].get(player_id)
+            if player_data:
+                user_store.save_progress(username, player_data)
+
+            # Remove the player from the game state
+            world_ticker.discard(player_id)
+            interest.remove(player_id)
+            session_ids.release(player_id)
+            if player_id in game_state["players"]:
+                del game_state["players"][player_id]
+                log.debug("Removed player %s from game state", player_id)
+
+            # Notify all clients about the removed player
+            disconnect_message = {
+                "type": "playerDisconnect",
+                "username": player_id
+            }
+
+            broadcaster.broadcast(disconnect_message)
+
+async def user_exists(username):
+    return await user_store.find_user(username) is not None
+
+async def authenticate_user(token):
+    try:
+        # Verify the JWT token, repeated tokens are answered from the cache
+        payload = await token_verifier.verify_async(token, user_exists)
+        username = payload['username']
+        log.debug("Authenticated user: %s", username)
+        return username
     except jwt.ExpiredSignatureError:
-        print("Token has expired")
+        log.debug("Token has expired")
         return None
     except jwt.InvalidTokenError as e:
-        print(f"Invalid token: {e}")
+        log.debug("Invalid token: %s", e)
+        return None
+    except UserNotFoundError as e:
+        log.debug("%s", e)
         return None
     except Exception as e:
-        print(f"Error during token decoding: {e}")
+        log.warning("Error during token decoding: %s", e)
         return None
 
-# Start WebSocket server with higher timeout settings
-start_server = websockets.serve(
-    server,
-    "localhost",
-    6789,
-    ping_interval=20,  # Ping clients every 20 seconds to keep the connection alive
-    ping_timeout=60,   # Wait for 60 seconds before considering a client dead
-)
-
-asyncio.get_event_loop().run_until_complete(start_server)
-print("WebSocket server started on ws://localhost:6789")
-asyncio.get_event_loop().run_forever()
+def stats():
+    """
+    Counters of this worker, published to the launcher.
+    """
+    return {
+        "node": cluster.node_id,
+        "pid": os.getpid(),
+        "clients": len(sessions),
+        "players": len(game_state["players"]),
+        "tick": world_ticker.tick,
+        "dropped_frames": sum(channel.dropped for channel in broadcaster.channels.values()),
+        "pending_progress": len(user_store.pending_progress),
+        "user_cache": {"hits": user_store.cache.hits, "misses": user_store.cache.misses},
+        "tokens": dict(token_verifier.stats),
+        "battles": battle_manager.stats(),
+        "matchmaking": match_queue.stats(),
+        "challenges": challenges.stats(),
+        "cluster": cluster.stats()
+    }
+
+async def report_stats(interval=WORKER_STATS_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        cluster.publish_stats(stats())
+
+async def serve(host=WEBSOCKET_HOST, port=WEBSOCKET_PORT, reuse_port=False, listen_invalidations=True):
+    """
+    Run the server until SIGTERM or SIGINT, then drain it.
+
+    :param reuse_port: Bind with SO_REUSEPORT so several workers share the port
+    :param listen_invalidations: Listen for auth.py's cache invalidations, one worker per host does
+    """
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    logger_task = loop.create_task(log.run())
+    await cluster.start()
+    # Start WebSocket server with higher timeout settings
+    websocket_server = await websockets.serve(
+        server,
+        host,
+        port,
+        reuse_port=reuse_port,
+        max_size=MAX_FRAME_SIZE,  # Larger frames close the connection before they are buffered
+        ping_interval=20,  # Ping clients every 20 seconds to keep the connection alive
+        ping_timeout=60,   # Wait for 60 seconds before considering a client dead
+    )
+    invalidation_transport = None
+    if listen_invalidations:
+        # Invalidations are passed on to the other workers over the backplane
+        invalidation_transport = await start_invalidation_listener(cluster)
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            # Serving players matters more than being scraped
+            log.warning("Metrics endpoint unavailable: %s", e)
+
+    tasks = [
+        loop.create_task(task) for task in (
+            cluster.run(),
+            world_ticker.run(),
+            battle_manager.run(),
+            battle_manager.log_writer.run(),
+            match_queue.run(start_match),
+            challenges.run(expire_challenge),
+            user_store.run(),
+            report_stats()
+        )
+    ]
+    log.info("WebSocket server started on ws://%s:%s", host, port)
+    if metrics_server:
+        log.info("Metrics served on http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+
+    await stopping.wait()
+    log.info("Draining connections...")
+    # Closing the server disconnects every client, which queues their progress
+    websocket_server.close()
+    await websocket_server.wait_closed()
+    if invalidation_transport:
+        invalidation_transport.close()
+    if metrics_server:
+        metrics_server.close()
+    for task in tasks:
+        task.cancel()
+
+    # Write out any progress still waiting in the write-behind queue
+    await user_store.flush()
+    log.info("Player progress flushed.")
+    await battle_manager.log_writer.flush()
+    log.info("Battle logs flushed.")
+    await cluster.stop()
+    logger_task.cancel()
+    log.flush()
+
+def main(host=WEBSOCKET_HOST, port=WEBSOCKET_PORT, reuse_port=False, listen_invalidations=True):
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(serve(host, port, reuse_port, listen_invalidations))
+
+if __name__ == '__main__':
+    main()
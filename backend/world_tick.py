@@ -0,0 +1,193 @@
+# world_tick.py
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+import protocol
+from broadcaster import BROADCAST_SECONDS
+from logger import log
+
+# Tick configuration
+TICK_RATE_HZ = float(os.environ.get('TICK_RATE_HZ', 20))  # World snapshots sent per second
+RESUME_HISTORY_TICKS = int(os.environ.get('RESUME_HISTORY_TICKS', 200))  # Ticks of changes kept for resuming clients
+
+
+class WorldTicker:
+    def __init__(self, game_state, client_usernames, broadcaster, interest, binary_clients, session_ids,
+                 rate_hz=TICK_RATE_HZ, history_ticks=RESUME_HISTORY_TICKS):
+        """
+        Fixed-rate loop that coalesces player movement into worldDelta frames.
+
+        Player updates only overwrite `game_state["players"]` and mark the
+        player dirty (last writer wins). Once per tick every client receives a
+        single frame with the latest state of the changed players inside its
+        view radius, plus the players that entered or left that radius.
+
+        :param game_state: Shared game state holding the "players" dict
+        :param client_usernames: websocket -> username mapping of connected clients
+        :param broadcaster: Broadcaster used to queue the frames
+        :param interest: InterestManager deciding who sees whom
+        :param binary_clients: Set of websockets that negotiated the binary protocol
+        :param session_ids: protocol.SessionIds used to address players in binary frames
+        :param rate_hz: Number of ticks per second
+        :param history_ticks: Ticks of changed player ids kept for changed_since()
+        """
+        self.game_state = game_state
+        self.client_usernames = client_usernames
+        self.broadcaster = broadcaster
+        self.interest = interest
+        self.binary_clients = binary_clients
+        self.session_ids = session_ids
+        self.interval = 1.0 / rate_hz
+        self.tick = 0
+        self.dirty = set()
+        self.owed = {}  # websocket -> players whose latest state the connection was not sent while it lagged behind
+        self.history_ticks = history_ticks
+        self.history = deque()  # (tick, player ids changed in that tick), oldest first
+        self.history_floor = 0  # Every change after this tick is in the history
+
+    def mark_dirty(self, player_id):
+        self.dirty.add(player_id)
+
+    def discard(self, player_id):
+        self.dirty.discard(player_id)
+
+    def discard_client(self, websocket):
+        # Owed players belong to one connection, a newer login of the same player starts clean
+        self.owed.pop(websocket, None)
+
+    def flush(self):
+        self.tick += 1
+        if not self.dirty and not self.owed:
+            return
+        started = time.perf_counter()
+        changed, self.dirty = self.dirty, set()
+        if changed:
+            self._remember(changed)
+        self._send_deltas(changed)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started, "worldDelta")
+
+    def _remember(self, changed):
+        self.history.append((self.tick, changed))
+        while self.history[0][0] <= self.tick - self.history_ticks:
+            self.history_floor = self.history.popleft()[0]
+
+    def changed_since(self, tick):
+        """
+        Players whose state changed in the ticks after `tick`.
+
+        :return: A set of player ids, or None if those ticks are no longer in the history
+        """
+        if tick < self.history_floor or tick > self.tick:
+            return None
+        changed = set()
+        for entry_tick, players in reversed(self.history):
+            if entry_tick <= tick:
+                break
+            changed |= players
+        return changed
+
+    def _encode_fragment(self, player_id):
+        players = self.game_state["players"]
+        return json.dumps(player_id) + ': ' + json.dumps({**players[player_id], "username": player_id})
+
+    def _encode_record(self, player_id):
+        return protocol.encode_player_record(self.session_ids.get(player_id), self.game_state["players"][player_id])
+
+    def delta_frame(self, websocket, updated, entered, left, fragment=None, record=None):
+        """
+        Build the worldDelta frame of one viewer, in the viewer's wire protocol.
+
+        :param updated: Known players whose state changed
+        :param entered: Players that came into view, sent in full
+        :param left: Players that went out of view
+        :param fragment: Cached JSON encoder of a player entry, encodes anew if None
+        :param record: Cached binary encoder of a player record, encodes anew if None
+        """
+        players = self.game_state["players"]
+        if websocket in self.binary_clients:
+            record = record or self._encode_record
+            return protocol.encode_world_delta(
+                self.tick,
+                [record(player_id) for player_id in updated | entered if player_id in players],
+                [protocol.encode_entered(self.session_ids.get(player_id), player_id)
+                 for player_id in entered if player_id in players],
+                [session_id for session_id in map(self.session_ids.get, left) if session_id is not None]
+            )
+
+        fragment = fragment or self._encode_fragment
+        shown = [fragment(player_id) for player_id in updated | entered if player_id in players]
+        frame = '{"type": "worldDelta", "tick": %d, "players": {' % self.tick + ', '.join(shown) + '}'
+        if entered:
+            frame += ', "entered": ' + json.dumps(sorted(entered))
+        if left:
+            frame += ', "left": ' + json.dumps(sorted(left))
+        return frame + '}'
+
+    def _send_deltas(self, changed):
+        players = self.game_state["players"]
+        positions = {
+            player_id: (players[player_id].get("x"), players[player_id].get("y"))
+            for player_id in changed if player_id in players
+        }
+        events = self.interest.update(positions) if positions else {}
+        if not events and not self.owed:
+            return
+
+        # Encode every player at most once per tick, frames are joined from the fragments
+        fragments = {}
+
+        def fragment(player_id):
+            encoded = fragments.get(player_id)
+            if encoded is None:
+                encoded = fragments[player_id] = self._encode_fragment(player_id)
+            return encoded
+
+        # Binary records are packed once as well and shared by every binary client
+        records = {}
+
+        def record(player_id):
+            encoded = records.get(player_id)
+            if encoded is None:
+                encoded = records[player_id] = self._encode_record(player_id)
+            return encoded
+
+        # Deltas are never dropped: a player that stopped would not be sent again. A backlogged
+        # client is skipped instead and gets the players it missed merged into a later delta, this
+        # is the only backpressure on movement until the broadcaster's hard limit disconnects it
+        owed = self.owed
+        for websocket, username in self.client_usernames.items():
+            viewer_events = events.get(username)
+            if not viewer_events and websocket not in owed:
+                continue
+            updated, entered, left = viewer_events or (set(), set(), set())
+            if not (entered or left) and self.broadcaster.backlogged(websocket):
+                owed.setdefault(websocket, set()).update(updated)
+                continue
+            missed = owed.pop(websocket, None)
+            if missed:
+                updated = (updated | missed) & self.interest.visible.get(username, set())
+                if not (updated or entered or left):
+                    continue
+            frame = self.delta_frame(websocket, updated, entered, left, fragment, record)
+            self.broadcaster.send(websocket, frame, kind="worldDelta")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                # One bad tick must not stop the world for everybody
+                log.error("World tick %d failed: %s", self.tick, e)
+            next_tick += self.interval
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Fell behind, skip the missed ticks instead of bursting
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
@@ -422,6 +422,21 @@ function Game() {
 
   // Function to handle WebSocket messages
   function handleWebSocketMessage(data, username, scene, otherPlayers) {
+    // Unpack batched world updates sent once per server tick
+    if (data.type === 'worldDelta') {
+      Object.values(data.players).forEach((player) => {
+        handleWebSocketMessage({ type: 'playerUpdate', ...player }, username, scene, otherPlayers);
+      });
+      // Remove players that moved out of view
+      (data.left || []).forEach((name) => {
+        if (otherPlayers.current[name]) {
+          otherPlayers.current[name].destroy();
+          delete otherPlayers.current[name];
+        }
+      });
+      return;
+    }
+
     // Handle player updates
     if (data.type === 'playerUpdate' && data.username !== username) {
       let otherPlayer = otherPlayers.current[data.username];
@@ -10,6 +10,8 @@ class WebSocketManager {
     this.reconnectAttempts = 0;
     this.messageQueue = []; // Queue for messages to be sent when the connection is open
     this.authenticated = false; // Flag to indicate if authentication is complete
+    this.resumeToken = null; // Lets a reconnect receive only the world changes it missed
+    this.lastTick = null; // Last world tick received
   }
 
   connect(token) {
@@ -23,8 +25,13 @@ class WebSocketManager {
       // Log the token being sent
       console.log(`Sending authentication token: ${this.token}`);
 
-      // Send the authentication token
-      this.socket.send(JSON.stringify({ token: this.token }));
+      // Send the authentication token, with the resume token of the previous connection if any
+      const auth = { token: this.token };
+      if (this.resumeToken && this.lastTick !== null) {
+        auth.resume = this.resumeToken;
+        auth.tick = this.lastTick;
+      }
+      this.socket.send(JSON.stringify(auth));
     };
 
     this.socket.onmessage = (event) => {
@@ -44,6 +51,7 @@ class WebSocketManager {
         // Authentication successful
         console.log('Authentication successful.');
         this.authenticated = true;
+        this.resumeToken = data.resumeToken || null;
 
         // Send any queued messages
         while (this.messageQueue.length > 0) {
@@ -51,6 +59,9 @@ class WebSocketManager {
           this.sendData(message);
         }
       } else {
+        if (data.tick !== undefined) {
+          this.lastTick = data.tick;
+        }
         // Notify all registered listeners
         this.onMessageCallbacks.forEach((callback) => callback(data));
       }